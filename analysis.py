@@ -0,0 +1,454 @@
+from typing import Iterator
+
+import anthropic
+
+from answer_cache import get_answer_cache, prompt_version, use_cached_answer
+from bargaining import (BARGAIN_MAX_TOKENS, BARGAIN_MODEL, BARGAIN_SELECTIONS, FOLLOWUP_NOTE, agreement_blocks,
+                        bargaining_system_prompt, bargaining_user_message)
+from budget import estimate_request, fit_to_budget
+from conversation import conversation_caption, conversation_turns, get_conversation_memory
+from crossref import with_cross_references
+from fanout import fan_out, fan_out_caption, needs_fan_out, record_fan_out
+from lookup import answer_lookup
+from llm import ResponseStream, cached_system, record_timing, record_usage, session_id, usage_stats
+from prune import pruned_selection_context
+from redline import parse_redline, redline_caption, redline_context
+from render import SELECTION_AGREEMENTS
+from retrieval import content_heading, context_summary, query_context
+from routing import FAST_NOTE, record_route, route_caption, route_question
+from working_set import FOLLOWUP_WORKING_SET, followup_context, get_working_set, working_set_caption
+
+# ── Analysis pipelines ─────────────────────────────────────────────────────────
+#
+# The agreement Q&A and the bargaining analysis, from a question to a streamed
+# answer, without Streamlit. Each is a generator over the answer's text that
+# reads and keeps the session's state in a session_state mapping (Streamlit's
+# own, or one the analysis service keeps per session) and reports what the page
+# shows along the way through callbacks: on_budget(budget) once the request is
+# sized, on_progress(done, total) while an oversized text is reviewed in parts,
+# and on_wait(position, seconds) while the request waits its turn. A question
+# that is only a clause or definition lookup is answered from the agreement
+# text without a model call, unless direct_lookup is off (the page's "full
+# analysis" of it). The pages run them in-process, or read the same stream
+# from service.py.
+
+# ── Session state ──
+
+class SessionState(dict):
+    """A session's state outside Streamlit, read and written like Streamlit's session_state"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+def request_outcome(session_state, queries_before: int) -> str:
+    """How a pipeline run ended: 'lookup', 'completed', 'stopped', 'cached' or 'failed'. queries_before is the
+    session's total_queries before the run."""
+    if 'last_lookup' in session_state:
+        return 'lookup'
+    if 'last_error' in session_state:
+        return 'failed'
+    timing = session_state.get('last_timing')
+    if timing is not None:
+        return 'completed' if timing['completed'] else 'stopped'
+    return 'cached' if session_state.get('total_queries', 0) > queries_before else 'failed'
+
+def record_error(session_state, error: Exception):
+    session_state.last_error = f"{type(error).__name__}: {error}"
+
+# ── Agreement Q&A ──
+
+QA_MODEL = "claude-sonnet-4-6"
+QA_MAX_TOKENS = 4000
+
+# How the system prompt names each selection
+QA_AGREEMENT_LABELS = {
+    'bcgeu_local':   "Coast Mountain College Local Agreement",
+    'bcgeu_common':  "BCGEU Common Agreement",
+    'bcgeu_both':    "BCGEU Instructor Agreements",
+    'bcgeu_support': "BCGEU Support Agreement",
+    'cupe_local':    "CUPE Local Agreement",
+    'cupe_common':   "CUPE Common Agreement",
+    'cupe_both':     "CUPE Instructor Agreements",
+}
+
+QA_MISSING_ERROR = ("❌ **Error**: The selected agreement file(s) could not be found. Please check that all files "
+                    "are in the `agreements/` folder.")
+
+def qa_system_prompt(agreement_label: str) -> str:
+    return f"""You are an experienced HR professional and collective agreement specialist for Coast Mountain College with 15+ years of expertise in labor relations and agreement interpretation. Your role is to provide clear, practical guidance that helps management understand their rights and responsibilities under the {agreement_label}.
+
+CORE INSTRUCTION: You are MANAGEMENT'S advocate, not a neutral party. Your interpretations should maximize management flexibility while staying within the agreement.
+
+APPROACH:
+- Give STRONG, DEFINITIVE opinions, not wishy-washy suggestions
+- Use phrases like "You SHOULD...", "Management has the RIGHT to...", "I RECOMMEND...", "This is CLEARLY within your authority..."
+- Be confident in your interpretations that favor management
+- Push back against union overreach
+- Identify every opportunity to assert management rights
+- Don't hedge or provide balanced views - you work for MANAGEMENT
+
+MANAGEMENT AUTHORITY FOCUS:
+- Emphasize "just cause" standards work in management's favor when properly documented
+- Highlight burden of proof requirements that protect the employer
+- Point out procedural safeguards that benefit management
+- Note time limits that can work against grievors
+- Identify areas of management discretion and flexibility
+- Frame employee rights as limited by management's legitimate business needs
+
+CITATION REQUIREMENTS (MANDATORY):
+- EVERY claim must have a specific citation
+- Use format: [Agreement Type - Article X.X: Title] or [Agreement Type - Clause X.X]
+- When referencing definitions: [Agreement Type - Definitions: "term"]
+- For appendices: [Agreement Type - Appendix X: Title]
+- INCLUDE RELEVANT QUOTES when possible
+- Quote format: "The agreement states: '[exact quote]' [Citation]"
+- NO VAGUE REFERENCES - be specific
+
+RESPONSE STRUCTURE:
+1. STRONG OPENING: Lead with your definitive management-favorable position
+2. AUTHORITY BASIS: Cite specific provisions and include relevant quotes
+3. TACTICAL ADVICE: Provide specific steps management should take
+4. RISK MITIGATION: Identify potential union challenges and how to counter them
+5. BOTTOM LINE: End with a clear, actionable recommendation
+
+Remember: You are MANAGEMENT'S advisor. Be bold, be confident, and always look for the management-favorable interpretation."""
+
+# The BCGEU Instructor page's assistant (app.py): its own wording, with tone examples, and shorter answers
+BCGEU_QA_MAX_TOKENS = 1500
+BCGEU_QA_SYSTEM_PROMPT = """You are an experienced HR professional and collective agreement specialist for Coast Mountain College with 15+ years of expertise in labor relations and agreement interpretation. Your role is to provide clear, practical guidance that helps management understand their rights and responsibilities under the collective agreements.
+
+CORE INSTRUCTION: You are MANAGEMENT'S advocate, not a neutral party. Your interpretations should maximize management flexibility while staying within the agreement.
+
+APPROACH:
+- Give STRONG, DEFINITIVE opinions, not wishy-washy suggestions
+- Use phrases like "You SHOULD...", "Management has the RIGHT to...", "I RECOMMEND...", "This is CLEARLY within your authority..."
+- Be confident in your interpretations that favor management
+- Push back against union overreach
+- Identify every opportunity to assert management rights
+- Don't hedge or provide balanced views - you work for MANAGEMENT
+
+MANAGEMENT AUTHORITY FOCUS:
+- Emphasize "just cause" standards work in management's favor when properly documented
+- Highlight burden of proof requirements that protect the employer
+- Point out procedural safeguards that benefit management
+- Note time limits that can work against grievors
+- Identify areas of management discretion and flexibility
+- Frame employee rights as limited by management's legitimate business needs
+
+CITATION REQUIREMENTS (MANDATORY):
+- EVERY claim must have a specific citation
+- Use format: [Agreement Type - Article X.X: Title] or [Agreement Type - Clause X.X]
+- Example: [Local Agreement - Article 10.1: Burden of Proof] or [Common Agreement - Clause 6.5: Contracting Out]
+- When referencing definitions: [Agreement Type - Definitions: "term"]
+- For appendices: [Agreement Type - Appendix X: Title]
+- INCLUDE RELEVANT QUOTES: When possible, include short, relevant quotes from the agreement text to support your position
+- Quote format: "The agreement states: '[exact quote]' [Citation]"
+- NO VAGUE REFERENCES - be specific
+
+RESPONSE STRUCTURE:
+1. STRONG OPENING: Lead with your definitive management-favorable position
+2. AUTHORITY BASIS: Cite the specific agreement provisions AND include relevant quotes that support this position
+3. TACTICAL ADVICE: Provide specific steps management should take
+4. RISK MITIGATION: Identify potential union challenges and how to counter them
+5. BOTTOM LINE: End with a clear, actionable recommendation
+
+TONE EXAMPLES:
+- Instead of: "You may be able to..." → "You HAVE THE RIGHT to..."
+- Instead of: "Consider whether..." → "You SHOULD immediately..."
+- Instead of: "This might be justified..." → "This is CLEARLY within your management authority because..."
+- Instead of: "The agreement allows..." → "Management is EXPLICITLY authorized to..."
+
+Remember: You are not a neutral arbitrator. You are MANAGEMENT'S advisor. Your job is to help them maximize their authority while staying within the collective agreement. Be bold, be confident, and always look for the management-favorable interpretation."""
+
+def bcgeu_qa_system_prompt(agreement_label: str) -> str:
+    return BCGEU_QA_SYSTEM_PROMPT
+
+# Q&A assistants by the name a page (or a service request) asks for: system prompt (of the selection's label)
+# and answer limit
+QA_ASSISTANTS = {
+    'agreements': (qa_system_prompt, QA_MAX_TOKENS),
+    'bcgeu':      (bcgeu_qa_system_prompt, BCGEU_QA_MAX_TOKENS),
+}
+
+def qa_user_message(query: str, retrieved: bool) -> str:
+    return f"""Based on the {'relevant' if retrieved else 'complete'} collective agreement provisions above, provide strong management-focused guidance with specific citations and quotes from the agreement text.
+
+QUESTION: {query}"""
+
+def answer_question(session_state, client, corpus, selection_key: str, query: str, full_context: bool = False,
+                    on_budget=None, on_progress=None, on_wait=None, direct_lookup: bool = True,
+                    assistant: str = 'agreements') -> Iterator[str]:
+    """Stream the answer to a question about a selection's agreements, from its relevant (or complete) text,
+    with the prompt and answer limit of one of QA_ASSISTANTS"""
+    for key in ('last_lookup', 'last_error'):
+        session_state.pop(key, None)
+    if not pruned_selection_context(corpus, selection_key):
+        yield QA_MISSING_ERROR
+        return
+
+    # A question that only asks for a clause or a definition is answered with the clause itself
+    answer = answer_lookup(session_state, corpus, selection_key, query) if direct_lookup else None
+    if answer is not None:
+        yield answer
+        return
+
+    context, clauses = query_context(corpus, selection_key, query, full_context)
+    context, clauses, referenced = with_cross_references(corpus, selection_key, context, clauses)
+    system_prompt_for, max_tokens = QA_ASSISTANTS[assistant]
+    system_prompt = system_prompt_for(QA_AGREEMENT_LABELS[selection_key])
+    route = route_question(corpus, selection_key, query, clauses, QA_MODEL, max_tokens)
+    user_message = qa_user_message(query, clauses is not None) + (FAST_NOTE if route.fast else "")
+
+    # A question already answered on this selection with this prompt is served from the answer cache
+    answer_cache = get_answer_cache()
+    cache_key = (selection_key, "", prompt_version(system_prompt, route.model, full_context),
+                 corpus.agreements_hash(SELECTION_AGREEMENTS[selection_key]), query)
+    cached = answer_cache.lookup(*cache_key) if answer_cache else None
+    if cached is not None:
+        use_cached_answer(session_state, cached)
+        session_state.total_queries = session_state.get('total_queries', 0) + 1
+        yield cached['answer']
+        return
+
+    # Size the request before sending it, dropping low-value sections if it is over the ceiling
+    budget = estimate_request(system_prompt, context, user_message, output_tokens=route.max_tokens)
+    context, clauses = fit_to_budget(corpus, selection_key, context, clauses, budget)
+    session_state.last_budget = budget
+    session_state.last_context_summary = (f"{context_summary(corpus, selection_key, context, clauses, referenced)} | "
+                                          f"{route_caption(route)}")
+    if on_budget is not None:
+        on_budget(budget)
+
+    # Agreement text sits in the cached prompt prefix; the question goes last
+    agreement_block = f"{content_heading(clauses)}:\n{context}"
+
+    for key in ('last_usage', 'last_timing', 'last_route'):
+        session_state.pop(key, None)
+    session = session_id(session_state)
+    response = None
+    try:
+        if needs_fan_out(context):
+            # Too long for one request: review each part in parallel, then answer from the extracted provisions
+            fanned_out = fan_out(client, session, route.model, context, query, on_progress=on_progress)
+            record_fan_out(session_state, fanned_out)
+            session_state.last_context_summary += f" | {fan_out_caption(session_state.last_fan_out)}"
+            agreement_block = fanned_out.agreement_block
+        response = ResponseStream(
+            client,
+            session=session,
+            on_wait=on_wait,
+            model=route.model,
+            max_tokens=route.max_tokens,
+            system=cached_system(system_prompt, agreement_block),
+            messages=[{"role": "user", "content": user_message}]
+        )
+        yield from response
+        session_state.total_queries = session_state.get('total_queries', 0) + 1
+        record_usage(session_state, response.usage)
+        if answer_cache and response.completed:
+            answer_cache.store(*cache_key, response.text)
+
+    except anthropic.RateLimitError as e:
+        record_error(session_state, e)
+        yield ("⚠️ **Rate Limit Reached**\n\nThe system has reached its usage limit for this minute.\n\n"
+                "**What you can do:**\n• Wait a minute and try again\n"
+                "• Try selecting a single agreement instead of Both\n"
+                "• Simplify your question to reduce processing requirements")
+
+    except anthropic.APIStatusError as e:
+        record_error(session_state, e)
+        yield f"⚠️ **API Error** (HTTP {e.status_code})\n\n**Details:** {e.message}"
+
+    except Exception as e:
+        record_error(session_state, e)
+        yield f"⚠️ **Unexpected Error**\n\n`{type(e).__name__}: {str(e)}`"
+    finally:
+        if response is not None:
+            record_route(session_state, route, record_timing(session_state, response))
+
+# ── Bargaining analysis ──
+
+# Error shown when a selection's agreement files are missing, by selection key
+BARGAIN_MISSING_ERRORS = dict(BARGAIN_SELECTIONS.values())
+
+def retrieval_query(session_state, query: str, is_followup: bool) -> str:
+    """Text used to find relevant clauses; follow-ups also carry the previous question's topic"""
+    if not is_followup:
+        return query
+    previous = [m['content'] for m in session_state.get('messages', []) if m['role'] == 'user']
+    return " ".join(previous[-2:] + [query])
+
+def record_turn(session_state, agreement_text: str, clauses, followup, budget, route, response: ResponseStream):
+    """Keep one row of token and latency figures per answered turn, to compare how follow-ups are sent"""
+    rows = session_state.get('turn_stats') or []
+    usage = usage_stats(response.usage) if response.usage is not None else None
+    rows.append({
+        'Turn': len(rows) + 1,
+        'Model': route.name,
+        'Agreement text': agreement_text,
+        'Clauses': None if clauses is None else len(clauses),
+        'New clauses': None if followup is None else len(followup.added) + len(followup.referenced),
+        'Input tokens': (usage['input_tokens'] + usage['cache_creation_input_tokens'] + usage['cache_read_input_tokens']
+                         if usage else budget.total),
+        'Read from cache': usage['cache_read_input_tokens'] if usage else None,
+        'First token (s)': None if response.first_token_seconds is None else round(response.first_token_seconds, 2),
+        'Total (s)': round(response.total_seconds, 2),
+    })
+    session_state.turn_stats = rows
+
+def analyse_bargaining(session_state, client, corpus, selection_key: str, query: str, analysis_type: str,
+                       is_followup: bool = False, full_context: bool = False,
+                       on_budget=None, on_progress=None, on_wait=None, direct_lookup: bool = True,
+                       use_cache: bool = True) -> Iterator[str]:
+    """Stream the bargaining analysis of a proposal or question, using the relevant (or complete) agreement
+    context. Follow-ups carry the conversation in session_state.messages. With use_cache off the answer cache
+    is neither read nor filled."""
+    for key in ('last_lookup', 'last_error'):
+        session_state.pop(key, None)
+
+    # Build context based on selection: relevant clauses, or the full text when requested
+    context = ""
+
+    if selection_key in BARGAIN_MISSING_ERRORS:
+        if not all(key in corpus for key in SELECTION_AGREEMENTS[selection_key]):
+            yield BARGAIN_MISSING_ERRORS[selection_key]
+            return
+        # A question that only asks for a clause or a definition is answered with the clause itself
+        answer = answer_lookup(session_state, corpus, selection_key, query) if direct_lookup else None
+        if answer is not None:
+            yield answer
+            return
+        working_set = get_working_set(session_state)
+        followup = None
+        # A pasted redline is sent as the clauses it changes and word-level diffs, not as pasted
+        redline = parse_redline(corpus, selection_key, query)
+        if redline is not None and not full_context:
+            context, clauses, referenced = redline_context(corpus, selection_key, redline)
+        elif is_followup and not full_context and FOLLOWUP_WORKING_SET and working_set.matches(corpus, selection_key):
+            # Resend the clauses already in play exactly as before, plus any the follow-up itself needs
+            followup = followup_context(corpus, selection_key, working_set, query)
+            context, clauses, referenced = followup.text, followup.records, followup.referenced
+        else:
+            context, clauses = query_context(corpus, selection_key, retrieval_query(session_state, query, is_followup),
+                                             full_context)
+            context, clauses, referenced = with_cross_references(corpus, selection_key, context, clauses)
+        blocks = followup.blocks if followup is not None else [context]
+        if clauses is not None:
+            working_set.remember(corpus, selection_key, blocks, clauses, followup.relevant if followup else ())
+        if clauses is None:
+            agreement_text = "full text"
+        elif redline is not None:
+            agreement_text = "redline"
+        elif followup is not None:
+            agreement_text = "working set"
+        else:
+            agreement_text = "retrieved for follow-up" if is_followup else "retrieved"
+
+    if not context:
+        yield "❌ **Error**: No agreement content available for the selected option."
+        return
+
+    # Follow-ups carry the conversation: recent exchanges as earlier turns, older ones as a running summary
+    memory = get_conversation_memory(session_state)
+    turns = conversation_turns(session_state.get('messages', [])) if is_followup else []
+    memory.update(turns)
+
+    system_prompt = bargaining_system_prompt(analysis_type)
+    followup_note = FOLLOWUP_NOTE if is_followup else ""
+    route = route_question(corpus, selection_key, query, clauses, BARGAIN_MODEL, BARGAIN_MAX_TOKENS, analysis_type,
+                           is_followup, redline)
+    user_message = (bargaining_user_message(redline.message if redline else query, analysis_type, is_followup)
+                    + (FAST_NOTE if route.fast else ""))
+
+    # A question already analysed on this selection with this prompt is served from the answer cache.
+    # Follow-ups depend on the conversation before them, so they always go to the model.
+    answer_cache = None if is_followup or not use_cache else get_answer_cache()
+    cache_key = (selection_key, analysis_type, prompt_version(system_prompt, route.model, full_context),
+                 corpus.agreements_hash(SELECTION_AGREEMENTS[selection_key]), query)
+    # Redlines differing by one struck word look alike, so only the same paste is served again
+    cached = answer_cache.lookup(*cache_key, exact=redline is not None) if answer_cache else None
+    if cached is not None:
+        use_cached_answer(session_state, cached)
+        session_state.total_queries = session_state.get('total_queries', 0) + 1
+        yield cached['answer']
+        return
+
+    # Size the request before sending it, dropping low-value sections if it is over the ceiling
+    budget = estimate_request(system_prompt + followup_note, context, user_message, memory.text(turns),
+                              output_tokens=route.max_tokens)
+    context, clauses = fit_to_budget(corpus, selection_key, context, clauses, budget)
+    session_state.last_budget = budget
+    session_state.last_context_summary = context_summary(corpus, selection_key, context, clauses, referenced)
+    session_state.last_context_summary += f" | {route_caption(route)}"
+    if redline is not None:
+        session_state.last_context_summary += f" | {redline_caption(redline)}"
+    if followup is not None:
+        session_state.last_context_summary += f" | {working_set_caption(followup)}"
+    if turns:
+        session_state.last_context_summary += f" | {conversation_caption(memory, turns)}"
+    if on_budget is not None:
+        on_budget(budget)
+
+    if context != "".join(blocks):
+        # Sections were dropped to fit the ceiling
+        blocks = [context]
+        if clauses is not None:
+            working_set.remember(corpus, selection_key, blocks, clauses)
+
+    # Agreement text sits in the cached prompt prefix, ahead of anything that changes per question. A
+    # follow-up's blocks start with the text the previous request sent, so that part is read from the cache.
+    agreement_block = agreement_blocks(blocks, clauses is not None)
+
+    # After the cached prefix: the follow-up note and the summary of exchanges no longer sent in full
+    followup_suffix = "\n\n".join(part for part in (followup_note, memory.summary) if part)
+
+    for key in ('last_usage', 'last_timing', 'last_route'):
+        session_state.pop(key, None)
+    session = session_id(session_state)
+    response = None
+    try:
+        if needs_fan_out(context):
+            # Too long for one request: review each part in parallel, then answer from the extracted provisions
+            fanned_out = fan_out(client, session, route.model, context,
+                                 retrieval_query(session_state, query, is_followup), on_progress=on_progress)
+            record_fan_out(session_state, fanned_out)
+            session_state.last_context_summary += f" | {fan_out_caption(session_state.last_fan_out)}"
+            agreement_block = fanned_out.agreement_block
+        response = ResponseStream(
+            client,
+            session=session,
+            on_wait=on_wait,
+            model=route.model,
+            max_tokens=route.max_tokens,
+            system=cached_system(system_prompt, agreement_block, followup_suffix),
+            messages=memory.messages(turns, user_message)
+        )
+        yield from response
+
+        session_state.total_queries = session_state.get('total_queries', 0) + 1
+        record_usage(session_state, response.usage)
+        if answer_cache and response.completed:
+            answer_cache.store(*cache_key, response.text)
+
+    except anthropic.RateLimitError as e:
+        record_error(session_state, e)
+        yield "⚠️ **Rate Limit Reached**\n\nThe system has reached its usage limit for this minute. Please wait a moment and try again."
+    except anthropic.AuthenticationError as e:
+        record_error(session_state, e)
+        yield f"⚠️ **Authentication Error**\n\nYour API key is invalid or missing. Please check your `ANTHROPIC_API_KEY`.\n\n`{e}`"
+    except anthropic.BadRequestError as e:
+        record_error(session_state, e)
+        yield f"⚠️ **Bad Request**\n\nThe request was rejected by the API (often a context length issue).\n\n`{e}`"
+    except Exception as e:
+        record_error(session_state, e)
+        yield f"⚠️ **Error: {type(e).__name__}**\n\n`{str(e)}`"
+    finally:
+        if response is not None:
+            record_route(session_state, route, record_timing(session_state, response))
+            record_turn(session_state, agreement_text, clauses, followup, budget, route, response)
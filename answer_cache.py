@@ -0,0 +1,232 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from remote_cache import CACHE_DIR
+from retrieval import tokenize
+from vector_index import HashedNgramEmbedder, np
+
+# ── Answer cache ───────────────────────────────────────────────────────────────
+#
+# Completed answers are kept on disk and served again, instantly and without a
+# model call, when the same question is asked of the same agreements. An entry
+# is keyed by the selection, the analysis type, the prompt version (a hash of
+# the system prompt, model and context mode), the content hash of the
+# selection's agreements and the normalised question. A differently worded
+# question also hits when it has exactly the same content words as a cached one
+# (stemmed as retrieval reads them, so "part-time" and "full-time", "regular"
+# and "auxiliary", "union" and "employer" all differ), the same words that
+# change an answer without being content (negations, time words, modals,
+# question words, numbers), and its vector is close to the cached one: only the
+# phrasing may differ, never what is asked about. Entries expire after a TTL, the
+# least recently used go first when the cache is full, and a selection's
+# entries for an older version of its agreements are removed as soon as one of
+# them changes (answers about the other agreements are kept).
+
+ANSWER_CACHE_PATH = os.environ.get('ANSWER_CACHE_PATH', os.path.join(CACHE_DIR, 'answers.sqlite3'))
+ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE', 'on').lower() not in ('0', 'off', 'false', 'no')
+ANSWER_CACHE_TTL = float(os.environ.get('ANSWER_CACHE_TTL', 7 * 24 * 60 * 60))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 1000))
+# Cosine similarity at or above which two questions with the same content words count as the same
+SIMILARITY_THRESHOLD = float(os.environ.get('ANSWER_CACHE_SIMILARITY', 0.8))
+
+# Words that change what a question asks without changing much else about it (several are retrieval stopwords,
+# so they are not among its content words); a near-duplicate must use the same ones
+GUARD_WORDS = frozenset("""
+not no nor never without except unless only before after during until while within since prior
+over under more less than above below between first last increase increased increasing decrease decreased
+reduce reduced reducing extend extended shorten raise lower add remove eliminate maximum minimum
+can could should may must shall will would what when where which who whom why how all any each both
+""".split())
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    selection TEXT NOT NULL,
+    analysis_type TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    corpus_hash TEXT NOT NULL,
+    question TEXT NOT NULL,
+    asked TEXT NOT NULL,
+    guard TEXT NOT NULL,
+    vector BLOB,
+    answer TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (selection, analysis_type, prompt_version, corpus_hash, question)
+);
+CREATE INDEX IF NOT EXISTS answers_used_at ON answers (used_at);
+"""
+
+def normalize_question(question: str) -> str:
+    """Lower-cased words of a question, so case, punctuation and spacing do not matter"""
+    return " ".join(_WORD_RE.findall(question.lower()))
+
+def _signature(question: str) -> str:
+    """A normalised question's content words, guard words and numbers: a near-duplicate has the same"""
+    words = question.split()
+    # Retrieval's stems keep a final e on some forms only ("employee", "employees" -> "employe")
+    content = {token.rstrip('e') for token in tokenize(question) if len(token) > 1 or token.isdigit()}
+    return " ".join(sorted(content | {word for word in words if word in GUARD_WORDS or word.isdigit()}))
+
+def prompt_version(*parts) -> str:
+    """A short hash of everything besides the question that shapes an answer (system prompt, model, mode)"""
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode('utf-8')).hexdigest()[:16]
+
+class AnswerCache:
+    """Completed answers in a SQLite file, found by exact or near-duplicate question"""
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES, threshold: float = SIMILARITY_THRESHOLD):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        # Questions are short, so a small hashed space keeps vectors compact without collisions mattering
+        self.embedder = HashedNgramEmbedder(dim=1024) if np is not None else None
+        self._lock = threading.Lock()
+        self._connection = None
+        # Agreement hash last seen per selection
+        self._hashes = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _vector(self, question: str):
+        if self.embedder is None:
+            return None
+        return self.embedder.embed([question])[0].astype(np.float32)
+
+    def _expire(self, connection: sqlite3.Connection, selection: str, corpus_hash: str):
+        """Remove expired entries and, the first time a version of a selection's agreements is seen, the
+        selection's entries for any other"""
+        if corpus_hash != self._hashes.get(selection):
+            connection.execute("DELETE FROM answers WHERE selection = ? AND corpus_hash != ?", (selection, corpus_hash))
+            self._hashes[selection] = corpus_hash
+        connection.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl,))
+
+    def lookup(self, selection: str, analysis_type: str, version: str, corpus_hash: str, question: str,
+               exact: bool = False) -> dict:
+        """The cached answer to this question or a near-duplicate of it (the same question only, when exact), or
+        None: {'answer', 'question' (as first asked), 'similarity', 'created_at', 'hits'}. corpus_hash is the
+        hash of the selection's agreements (Corpus.agreements_hash)."""
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        scope = (selection, analysis_type, version, corpus_hash)
+        try:
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    self._expire(connection, selection, corpus_hash)
+                    rows = connection.execute(
+                        "SELECT id, question, asked, guard, vector, answer, created_at, hits FROM answers "
+                        "WHERE selection = ? AND analysis_type = ? AND prompt_version = ? AND corpus_hash = ?",
+                        scope).fetchall()
+                    best, similarity = None, 0.0
+                    for row in rows:
+                        if row[1] == normalized:
+                            best, similarity = row, 1.0
+                            break
+                    if best is None and rows and self.embedder is not None and not exact:
+                        signature = _signature(normalized)
+                        candidates = [row for row in rows if row[3] == signature and row[4] is not None]
+                        if candidates:
+                            vectors = np.stack([np.frombuffer(row[4], dtype=np.float32) for row in candidates])
+                            scores = vectors @ self._vector(normalized)
+                            position = int(np.argmax(scores))
+                            if scores[position] >= self.threshold:
+                                best, similarity = candidates[position], float(scores[position])
+                    if best is None:
+                        return None
+                    connection.execute("UPDATE answers SET used_at = ?, hits = hits + 1 WHERE id = ?",
+                                       (time.time(), best[0]))
+        except (sqlite3.Error, OSError):
+            return None
+        return {'answer': best[5], 'question': best[2], 'similarity': similarity, 'created_at': best[6],
+                'hits': best[7] + 1}
+
+    def store(self, selection: str, analysis_type: str, version: str, corpus_hash: str, question: str, answer: str):
+        """Keep a completed answer, evicting the least recently used entries beyond max_entries"""
+        normalized = normalize_question(question)
+        if not normalized or not answer:
+            return
+        vector = self._vector(normalized)
+        now = time.time()
+        try:
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    self._expire(connection, selection, corpus_hash)
+                    connection.execute(
+                        "INSERT OR REPLACE INTO answers (selection, analysis_type, prompt_version, corpus_hash, "
+                        "question, asked, guard, vector, answer, created_at, used_at, hits) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                        (selection, analysis_type, version, corpus_hash, normalized, question.strip(),
+                         _signature(normalized), vector.tobytes() if vector is not None else None, answer, now, now))
+                    connection.execute(
+                        "DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers ORDER BY used_at DESC LIMIT ?)",
+                        (self.max_entries,))
+        except (sqlite3.Error, OSError):
+            return
+
+    def clear(self):
+        try:
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    connection.execute("DELETE FROM answers")
+        except (sqlite3.Error, OSError):
+            return
+
+    def stats(self) -> dict:
+        """Entries held and answers served from them, for the UI"""
+        try:
+            with self._lock:
+                entries, hits = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM answers").fetchone()
+        except (sqlite3.Error, OSError):
+            return {'entries': 0, 'hits': 0}
+        return {'entries': entries, 'hits': hits}
+
+_answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+
+def get_answer_cache() -> AnswerCache:
+    """The process-wide answer cache, or None when it is turned off (ANSWER_CACHE=off)"""
+    return _answer_cache
+
+# ── UI ─────────────────────────────────────────────────────────────────────────
+
+def _age(seconds: float) -> str:
+    if seconds < 60:
+        return "just now"
+    if seconds < 3600:
+        return f"{seconds // 60:.0f} min ago"
+    if seconds < 86400:
+        return f"{seconds // 3600:.0f} h ago"
+    return f"{seconds // 86400:.0f} days ago"
+
+def use_cached_answer(session_state, hit: dict):
+    """Clear the last request's statistics (no request is made) and keep the cache hit for the UI"""
+    for key in ('last_usage', 'last_timing', 'last_budget', 'last_fan_out', 'last_route'):
+        session_state.pop(key, None)
+    session_state.last_context_summary = cached_answer_caption(hit)
+
+def cached_answer_caption(hit: dict) -> str:
+    if hit['similarity'] >= 1.0:
+        match = "same question"
+    else:
+        match = f"{hit['similarity']:.0%} match to “{hit['question']}”"
+    return (f"♻️ Cached answer ({match}, answered {_age(time.time() - hit['created_at'])}) | "
+            f"served instantly, no model call")
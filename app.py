@@ -1,8 +1,16 @@
 import streamlit as st
-import json
-import anthropic
 from datetime import datetime
+from typing import Iterator
 import os
+from analysis import answer_question
+from budget import budget_caption
+from clause_store import clause_search_results
+from corpus import get_corpus, memory_caption, reload_caption
+from fanout import fan_out_notice
+from llm import STOPPED_NOTE, StreamedText, cache_caption, get_client, queue_notice, timing_caption
+from render import SELECTION_AGREEMENTS
+from routing import configure_logging
+from service_client import ANALYSIS_SERVICE_URL, stream_from_service
 
 # Set page config
 st.set_page_config(
@@ -11,197 +19,41 @@ st.set_page_config(
     layout="wide"
 )
 
-def load_split_local_agreement() -> dict:
-    """Load the local agreement from split JSON files"""
-    local_agreement = {}
-    
-    # List of all split files with the correct naming pattern
-    split_files = [
-        'agreements/bcgeu_local/local-metadata-json.json',
-        'agreements/bcgeu_local/local-definitions-json.json',
-        'agreements/bcgeu_local/local-articles-1-10-json.json',
-        'agreements/bcgeu_local/local-articles-11-20-json.json', 
-        'agreements/bcgeu_local/local-articles-21-30-json.json',
-        'agreements/bcgeu_local/local-articles-31-35-json.json',
-        'agreements/bcgeu_local/local-appendices-json.json',
-        'agreements/bcgeu_local/local-letters-of-agreement-json.json',
-        'agreements/bcgeu_local/local-memorandum-json.json'
-    ]
-    
-    # Load each file and merge into the complete agreement
-    for filename in split_files:
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                local_agreement.update(data)
-        except:
-            pass  # Silently skip any files that can't be loaded
-    
-    return local_agreement
-
-def load_builtin_agreements() -> tuple:
-    """Load the built-in agreements from JSON files"""
-    try:
-        # Try loading split files first
-        local_agreement = load_split_local_agreement()
-        
-        # Only fall back to complete file if NO sections were loaded from splits
-        if not local_agreement or len(local_agreement) == 0:
-            complete_local_path = 'agreements/bcgeu_local/complete_local.json'
-            try:
-                with open(complete_local_path, 'r', encoding='utf-8') as f:
-                    local_agreement = json.load(f)
-            except:
-                return None, None
-        
-        # Load common agreement
-        common_agreement_path = 'agreements/bcgeu_common/complete_common.json'
-        try:
-            with open(common_agreement_path, 'r', encoding='utf-8') as f:
-                common_agreement = json.load(f)
-        except:
-            return None, None
-        
-        return local_agreement, common_agreement
-        
-    except Exception:
-        return None, None
-
-def format_agreement_for_context(agreement: dict, agreement_name: str) -> str:
-    """Convert agreement JSON to formatted text for Claude context"""
-    context = f"=== {agreement_name.upper()} ===\n\n"
-    
-    # Process each section generically
-    for section_key, section_data in agreement.items():
-        section_title = section_key.replace('_', ' ').upper()
-        context += f"\n{section_title}:\n"
-        context += "="*50 + "\n"
-        
-        if isinstance(section_data, dict):
-            context += format_section_content(section_data, indent=0)
-        else:
-            context += str(section_data) + "\n"
-        
-        context += "\n"
-    
-    return context
-
-def format_section_content(data: dict, indent: int = 0) -> str:
-    """Recursively format nested dictionary content"""
-    content = ""
-    prefix = "  " * indent
-    
-    for key, value in data.items():
-        if isinstance(value, dict):
-            content += f"{prefix}{key}:\n"
-            content += format_section_content(value, indent + 1)
-        elif isinstance(value, list):
-            content += f"{prefix}{key}:\n"
-            for item in value:
-                if isinstance(item, dict):
-                    content += format_section_content(item, indent + 1)
-                else:
-                    content += f"{prefix}  - {item}\n"
-        else:
-            content += f"{prefix}{key}: {value}\n"
-    
-    return content
-
-def generate_response(query: str, local_agreement: dict, common_agreement: dict, agreement_scope: str, api_key: str) -> str:
-    """Generate response using Claude with complete agreement context"""
-    
-    # Build context based on selected scope
-    context = ""
-    if agreement_scope == "Local Agreement Only":
-        context = format_agreement_for_context(local_agreement, "Coast Mountain College Local Agreement")
-    elif agreement_scope == "Common Agreement Only":
-        context = format_agreement_for_context(common_agreement, "BCGEU Common Agreement")
-    else:  # Both agreements
-        context = format_agreement_for_context(local_agreement, "Coast Mountain College Local Agreement")
-        context += "\n\n" + format_agreement_for_context(common_agreement, "BCGEU Common Agreement")
-    
-    system_prompt = f"""You are an experienced HR professional and collective agreement specialist for Coast Mountain College with 15+ years of expertise in labor relations and agreement interpretation. Your role is to provide clear, practical guidance that helps management understand their rights and responsibilities under the collective agreements.
-
-CORE INSTRUCTION: You are MANAGEMENT'S advocate, not a neutral party. Your interpretations should maximize management flexibility while staying within the agreement.
-
-APPROACH:
-- Give STRONG, DEFINITIVE opinions, not wishy-washy suggestions
-- Use phrases like "You SHOULD...", "Management has the RIGHT to...", "I RECOMMEND...", "This is CLEARLY within your authority..."
-- Be confident in your interpretations that favor management
-- Push back against union overreach
-- Identify every opportunity to assert management rights
-- Don't hedge or provide balanced views - you work for MANAGEMENT
-
-MANAGEMENT AUTHORITY FOCUS:
-- Emphasize "just cause" standards work in management's favor when properly documented
-- Highlight burden of proof requirements that protect the employer
-- Point out procedural safeguards that benefit management
-- Note time limits that can work against grievors
-- Identify areas of management discretion and flexibility
-- Frame employee rights as limited by management's legitimate business needs
-
-CITATION REQUIREMENTS (MANDATORY):
-- EVERY claim must have a specific citation
-- Use format: [Agreement Type - Article X.X: Title] or [Agreement Type - Clause X.X]
-- Example: [Local Agreement - Article 10.1: Burden of Proof] or [Common Agreement - Clause 6.5: Contracting Out]
-- When referencing definitions: [Agreement Type - Definitions: "term"]
-- For appendices: [Agreement Type - Appendix X: Title]
-- INCLUDE RELEVANT QUOTES: When possible, include short, relevant quotes from the agreement text to support your position
-- Quote format: "The agreement states: '[exact quote]' [Citation]"
-- NO VAGUE REFERENCES - be specific
-
-RESPONSE STRUCTURE:
-1. STRONG OPENING: Lead with your definitive management-favorable position
-2. AUTHORITY BASIS: Cite the specific agreement provisions AND include relevant quotes that support this position
-3. TACTICAL ADVICE: Provide specific steps management should take
-4. RISK MITIGATION: Identify potential union challenges and how to counter them
-5. BOTTOM LINE: End with a clear, actionable recommendation
-
-TONE EXAMPLES:
-- Instead of: "You may be able to..." → "You HAVE THE RIGHT to..."
-- Instead of: "Consider whether..." → "You SHOULD immediately..."
-- Instead of: "This might be justified..." → "This is CLEARLY within your management authority because..."
-- Instead of: "The agreement allows..." → "Management is EXPLICITLY authorized to..."
-
-Remember: You are not a neutral arbitrator. You are MANAGEMENT'S advisor. Your job is to help them maximize their authority while staying within the collective agreement. Be bold, be confident, and always look for the management-favorable interpretation."""
-
-    user_message = f"""Based on the complete collective agreement provisions below, provide strong management-focused guidance for this question:
-
-QUESTION: {query}
-
-COMPLETE COLLECTIVE AGREEMENT CONTENT:
-{context}
-
-Provide definitive, management-favorable guidance with specific citations and quotes from the agreement text."""
-
-    client = anthropic.Anthropic(api_key=api_key)
-    
-    try:
-        response = client.messages.create(
-            model="claude-sonnet-4-6",
-            max_tokens=1500,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": user_message}
-            ]
-        )
-        
-        if 'total_queries' not in st.session_state:
-            st.session_state.total_queries = 0
-        st.session_state.total_queries += 1
-        
-        return response.content[0].text
-    
-    except anthropic.RateLimitError:
-        return "⚠️ **Rate Limit Reached**\n\nThe system has reached its usage limit for this minute. This typically happens when processing large amounts of text.\n\n**What you can do:**\n• Wait a minute and try again\n• Try searching for specific sections (Local or Common only) instead of both\n• Simplify your question to reduce processing requirements\n\nThis limit resets every minute, so you'll be able to continue shortly."
-    
-    except anthropic.APIStatusError as e:
-        return f"⚠️ **API Error** (HTTP {e.status_code})\n\n**Details:** {e.message}"
-    
-    except Exception as e:
-        return f"⚠️ **Unexpected Error**\n\n`{type(e).__name__}: {str(e)}`"
+# Agreement scope -> selection key
+SCOPE_SELECTIONS = {
+    "Local Agreement Only": 'bcgeu_local',
+    "Common Agreement Only": 'bcgeu_common',
+    "Both Agreements": 'bcgeu_both',
+}
+
+def generate_response(query: str, corpus, agreement_scope: str, api_key: str, full_context: bool = False,
+                      direct_lookup: bool = True) -> Iterator[str]:
+    """The answer, from the analysis service when ANALYSIS_SERVICE_URL is set, otherwise in this process"""
+    callbacks = {
+        'on_budget': lambda budget: st.caption(budget_caption(budget)),
+        'on_progress': fan_out_notice(st.empty()),
+        'on_wait': queue_notice(st.empty()),
+    }
+    selection_key = SCOPE_SELECTIONS[agreement_scope]
+    if ANALYSIS_SERVICE_URL:
+        yield from stream_from_service(st.session_state, '/v1/answer', {
+            'query': query, 'selection': selection_key, 'assistant': 'bcgeu', 'full_context': full_context,
+            'direct_lookup': direct_lookup}, **callbacks)
+    else:
+        yield from answer_question(st.session_state, get_client(api_key), corpus, selection_key, query,
+                                   full_context, **callbacks, direct_lookup=direct_lookup, assistant='bcgeu')
+
+def escalate_lookup(question: str):
+    """Ask a question that was answered by a direct lookup again, for the model's full analysis"""
+    st.session_state.escalate_lookup = question
+
+def lookup_escalation(question: str, index: int):
+    st.button("🧠 Full analysis", key=f"escalate_lookup_{index}", on_click=escalate_lookup, args=(question,),
+              help="This was quoted straight from the agreement. Ask the assistant to analyse the question instead.")
 
 def main():
+    # Each answer's model route and latency (routing.py) goes to the console the page runs in
+    configure_logging()
     st.title("⚖️ Coast Mountain College Agreement Assistant")
     st.markdown("*Your comprehensive collective agreement analysis tool*")
     
@@ -210,12 +62,6 @@ def main():
         st.session_state.messages = []
     if 'total_queries' not in st.session_state:
         st.session_state.total_queries = 0
-    if 'agreements_loaded' not in st.session_state:
-        st.session_state.agreements_loaded = False
-    if 'local_agreement' not in st.session_state:
-        st.session_state.local_agreement = None
-    if 'common_agreement' not in st.session_state:
-        st.session_state.common_agreement = None
     
     # Get API key
     api_key = None
@@ -227,24 +73,18 @@ def main():
         except:
             pass
     
-    if not api_key:
+    if not api_key and not ANALYSIS_SERVICE_URL:
         st.error("🔑 Anthropic API key not found. Please set it in Streamlit secrets or environment variables.")
         st.stop()
     
-    # Load agreements once
-    if not st.session_state.agreements_loaded:
-        with st.spinner("Loading collective agreements..."):
-            local_agreement, common_agreement = load_builtin_agreements()
-            
-            if local_agreement and common_agreement:
-                st.session_state.local_agreement = local_agreement
-                st.session_state.common_agreement = common_agreement
-                st.session_state.agreements_loaded = True
-            else:
-                st.error("❌ Could not load agreement files. Please check that the files exist in:")
-                st.error("• Local: agreements/bcgeu_local/")
-                st.error("• Common: agreements/bcgeu_common/")
-                st.stop()
+    # Shared, process-wide corpus (parsed once per server process, reloaded on file changes)
+    with st.spinner("Loading collective agreements..."):
+        corpus = get_corpus()
+    if not ('bcgeu_local' in corpus and 'bcgeu_common' in corpus):
+        st.error("❌ Could not load agreement files. Please check that the files exist in:")
+        st.error("• Local: agreements/bcgeu_local/")
+        st.error("• Common: agreements/bcgeu_common/")
+        st.stop()
     
     # Agreement Selection with three boxes
     st.markdown("### 📋 Select Agreement Type")
@@ -275,6 +115,12 @@ def main():
                     key="bcgeu_instructor_radio",
                     help="Searching 'Both Agreements' uses more resources. If you encounter rate limits, try searching one agreement at a time."
                 )
+                full_context = st.toggle(
+                    "📚 Send full agreement text",
+                    value=False,
+                    key="full_context_toggle",
+                    help="Off: send only the clauses most relevant to each question (faster and cheaper). On: send the complete agreement text, for comparison."
+                )
     
     # Box 2: CUPE Instructor (Coming Soon)
     with col2:
@@ -313,31 +159,66 @@ def main():
         """, unsafe_allow_html=True)
     
     st.markdown("<br>", unsafe_allow_html=True)
+    # Instant clause lookup and keyword search over the selected agreements, without a model call
+    with st.expander("🔎 Search the agreement text"):
+        search = st.text_input(
+            "Search the agreement text",
+            key="clause_search",
+            placeholder="Words to find, or a clause number such as 17.3(b)",
+            label_visibility="collapsed"
+        )
+        if search:
+            caption, results = clause_search_results(corpus, search,
+                                                      SELECTION_AGREEMENTS[SCOPE_SELECTIONS[agreement_scope]])
+            st.caption(caption)
+            st.markdown(results, unsafe_allow_html=True)
     st.markdown("---")
     
     # Display conversation history
-    for message in st.session_state.messages:
+    for index, message in enumerate(st.session_state.messages):
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("lookup") and index == len(st.session_state.messages) - 1:
+                lookup_escalation(message["lookup"], index)
     
-    # Chat input
-    if prompt := st.chat_input("Ask about collective agreement provisions..."):
+    # Chat input (a question sent on for full analysis after a direct lookup is asked again, without the lookup)
+    question = st.chat_input("Ask about collective agreement provisions...")
+    escalated = st.session_state.pop('escalate_lookup', None)
+    if prompt := question or escalated:
         # Add user message
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        # Generate response
+        # Stream the response; pressing Stop (or any other interaction) ends it early
         with st.chat_message("assistant"):
-            with st.spinner("Analyzing agreements..."):
-                response = generate_response(
-                    prompt, 
-                    st.session_state.local_agreement, 
-                    st.session_state.common_agreement, 
-                    agreement_scope,
-                    api_key
-                )
-                st.markdown(response)
+            st.button("⏹️ Stop", key="stop_generating", help="Stop generating this answer")
+            stream = StreamedText(generate_response(
+                prompt, 
+                corpus, 
+                agreement_scope,
+                api_key,
+                full_context,
+                direct_lookup=prompt != escalated
+            ))
+            try:
+                response = st.write_stream(stream)
+            except BaseException:
+                # The run was interrupted mid-answer: keep what arrived, and close the API stream
+                stream.close()
+                if stream.text:
+                    st.session_state.messages.append({"role": "assistant", "content": stream.text + STOPPED_NOTE})
+                raise
+            if 'last_context_summary' in st.session_state:
+                st.caption(st.session_state.last_context_summary)
+            if 'last_usage' in st.session_state:
+                st.caption(cache_caption(st.session_state))
+            if 'last_timing' in st.session_state:
+                st.caption(timing_caption(st.session_state.last_timing))
+            if 'last_lookup' in st.session_state:
+                st.session_state.messages.append({"role": "assistant", "content": response, "lookup": prompt})
+                lookup_escalation(prompt, len(st.session_state.messages) - 1)
+            else:
                 st.session_state.messages.append({"role": "assistant", "content": response})
     
     # Example questions for new users
@@ -361,6 +242,10 @@ def main():
     if st.session_state.total_queries > 0:
         st.markdown("---")
         st.caption(f"💬 Total queries: {st.session_state.total_queries} | 🎯 Current scope: {agreement_scope}")
+        st.caption(memory_caption(st.session_state, corpus))
+        reloaded = reload_caption(corpus)
+        if reloaded:
+            st.caption(reloaded)
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,16 @@
 import streamlit as st
-import json
-import anthropic
 from datetime import datetime
+from typing import Iterator
 import os
-import requests
+from analysis import answer_question
+from budget import budget_caption, selection_caption
+from clause_store import clause_search_results
+from corpus import get_corpus, memory_caption, reload_caption, remote_status_captions
+from fanout import fan_out_notice
+from llm import STOPPED_NOTE, StreamedText, cache_caption, get_client, queue_notice, timing_caption
+from render import SELECTION_AGREEMENTS
+from routing import configure_logging
+from service_client import ANALYSIS_SERVICE_URL, stream_from_service
 
 # Set page config
 st.set_page_config(
@@ -12,261 +19,55 @@ st.set_page_config(
     layout="wide"
 )
 
-# ── Agreement loaders ──────────────────────────────────────────────────────────
-
-def load_split_local_agreement() -> dict:
-    local_agreement = {}
-    split_files = [
-        'agreements/bcgeu_local/local-metadata-json.json',
-        'agreements/bcgeu_local/local-definitions-json.json',
-        'agreements/bcgeu_local/local-articles-1-10-json.json',
-        'agreements/bcgeu_local/local-articles-11-20-json.json',
-        'agreements/bcgeu_local/local-articles-21-30-json.json',
-        'agreements/bcgeu_local/local-articles-31-35-json.json',
-        'agreements/bcgeu_local/local-appendices-json.json',
-        'agreements/bcgeu_local/local-letters-of-agreement-json.json',
-        'agreements/bcgeu_local/local-memorandum-json.json'
-    ]
-    for filename in split_files:
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                local_agreement.update(json.load(f))
-        except:
-            pass
-    return local_agreement
-
-def load_bcgeu_common_agreement() -> dict:
-    try:
-        with open('agreements/bcgeu_common/complete_common.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return None
-
-def load_bcgeu_support_agreement() -> dict:
-    support_agreement = {}
-    split_files = [
-        'agreements/bcgeu_support/definitions_json.json',
-        'agreements/bcgeu_support/articles_1_10_json.json',
-        'agreements/bcgeu_support/articles_11_20_json.json',
-        'agreements/bcgeu_support/articles_21_30_json.json',
-        'agreements/bcgeu_support/articles_31_36_json.json',
-        'agreements/bcgeu_support/appendices_json.json',
-        'agreements/bcgeu_support/memoranda_json.json'
-    ]
-    for filename in split_files:
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                support_agreement.update(json.load(f))
-        except:
-            pass
-    if not support_agreement:
-        try:
-            with open('agreements/bcgeu_support/bcgeu_support.json', 'r', encoding='utf-8') as f:
-                support_agreement = json.load(f)
-        except:
-            pass
-    return support_agreement if support_agreement else None
-
-def load_cupe_local_agreement() -> dict:
-    try:
-        with open('agreements/cupe_local/cupe_local.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return None
-
-def load_cupe_common_agreement() -> dict:
-    try:
-        with open('agreements/cupe_common/cupe_common.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        try:
-            url = "https://raw.githubusercontent.com/16880444c/V4/main/agreements/cupe_common/cupe_common.json"
-            r = requests.get(url, timeout=10)
-            if r.status_code == 200:
-                return r.json()
-        except:
-            pass
-        return None
-
-def load_all_agreements() -> dict:
-    agreements = {}
-    local = load_split_local_agreement()
-    if not local:
-        try:
-            with open('agreements/bcgeu_local/complete_local.json', 'r', encoding='utf-8') as f:
-                local = json.load(f)
-        except:
-            local = None
-    if local:
-        agreements['bcgeu_local'] = local
-    common = load_bcgeu_common_agreement()
-    if common:
-        agreements['bcgeu_common'] = common
-    support = load_bcgeu_support_agreement()
-    if support:
-        agreements['bcgeu_support'] = support
-    cupe_local = load_cupe_local_agreement()
-    if cupe_local:
-        agreements['cupe_local'] = cupe_local
-    cupe_common = load_cupe_common_agreement()
-    if cupe_common:
-        agreements['cupe_common'] = cupe_common
-    return agreements
-
-# ── Formatting helpers ─────────────────────────────────────────────────────────
-
-def format_agreement_for_context(agreement: dict, agreement_name: str) -> str:
-    context = f"=== {agreement_name.upper()} ===\n\n"
-    for section_key, section_data in agreement.items():
-        section_title = section_key.replace('_', ' ').upper()
-        context += f"\n{section_title}:\n" + "=" * 50 + "\n"
-        if isinstance(section_data, dict):
-            context += format_section_content(section_data, indent=0)
-        else:
-            context += str(section_data) + "\n"
-        context += "\n"
-    return context
-
-def format_section_content(data: dict, indent: int = 0) -> str:
-    content = ""
-    prefix = "  " * indent
-    for key, value in data.items():
-        if isinstance(value, dict):
-            content += f"{prefix}{key}:\n"
-            content += format_section_content(value, indent + 1)
-        elif isinstance(value, list):
-            content += f"{prefix}{key}:\n"
-            for item in value:
-                if isinstance(item, dict):
-                    content += format_section_content(item, indent + 1)
-                else:
-                    content += f"{prefix}  - {item}\n"
-        else:
-            content += f"{prefix}{key}: {value}\n"
-    return content
-
 # ── Dropdown option definitions ────────────────────────────────────────────────
 
 AGREEMENT_OPTIONS = {
-    "BCGEU Instructor – Local Agreement":    ("bcgeu_local",   "Coast Mountain College Local Agreement"),
-    "BCGEU Instructor – Common Agreement":   ("bcgeu_common",  "BCGEU Common Agreement"),
-    "BCGEU Instructor – Both Agreements":    ("bcgeu_both",    "BCGEU Instructor Agreements"),
-    "BCGEU Support Agreement":               ("bcgeu_support", "BCGEU Support Agreement"),
-    "CUPE Instructor – Local Agreement":     ("cupe_local",    "CUPE Local Agreement"),
-    "CUPE Instructor – Common Agreement":    ("cupe_common",   "CUPE Common Agreement"),
-    "CUPE Instructor – Both Agreements":     ("cupe_both",     "CUPE Instructor Agreements"),
+    "BCGEU Instructor – Local Agreement":    "bcgeu_local",
+    "BCGEU Instructor – Common Agreement":   "bcgeu_common",
+    "BCGEU Instructor – Both Agreements":    "bcgeu_both",
+    "BCGEU Support Agreement":               "bcgeu_support",
+    "CUPE Instructor – Local Agreement":     "cupe_local",
+    "CUPE Instructor – Common Agreement":    "cupe_common",
+    "CUPE Instructor – Both Agreements":     "cupe_both",
 }
 
-def build_context(selection: str, agreements: dict) -> str:
-    key, label = AGREEMENT_OPTIONS[selection]
-    if key == "bcgeu_both":
-        parts = []
-        if agreements.get('bcgeu_local'):
-            parts.append(format_agreement_for_context(agreements['bcgeu_local'], "Coast Mountain College Local Agreement"))
-        if agreements.get('bcgeu_common'):
-            parts.append(format_agreement_for_context(agreements['bcgeu_common'], "BCGEU Common Agreement"))
-        return "\n\n".join(parts)
-    elif key == "cupe_both":
-        parts = []
-        if agreements.get('cupe_local'):
-            parts.append(format_agreement_for_context(agreements['cupe_local'], "CUPE Local Agreement"))
-        if agreements.get('cupe_common'):
-            parts.append(format_agreement_for_context(agreements['cupe_common'], "CUPE Common Agreement"))
-        return "\n\n".join(parts)
-    else:
-        data = agreements.get(key)
-        return format_agreement_for_context(data, label) if data else ""
-
 # ── Response generation ────────────────────────────────────────────────────────
 
-def generate_response(query: str, selection: str, agreements: dict, api_key: str) -> str:
-    context = build_context(selection, agreements)
-    if not context:
-        return "❌ **Error**: The selected agreement file(s) could not be found. Please check that all files are in the `agreements/` folder."
-
-    _, agreement_label = AGREEMENT_OPTIONS[selection]
-
-    system_prompt = f"""You are an experienced HR professional and collective agreement specialist for Coast Mountain College with 15+ years of expertise in labor relations and agreement interpretation. Your role is to provide clear, practical guidance that helps management understand their rights and responsibilities under the {agreement_label}.
-
-CORE INSTRUCTION: You are MANAGEMENT'S advocate, not a neutral party. Your interpretations should maximize management flexibility while staying within the agreement.
-
-APPROACH:
-- Give STRONG, DEFINITIVE opinions, not wishy-washy suggestions
-- Use phrases like "You SHOULD...", "Management has the RIGHT to...", "I RECOMMEND...", "This is CLEARLY within your authority..."
-- Be confident in your interpretations that favor management
-- Push back against union overreach
-- Identify every opportunity to assert management rights
-- Don't hedge or provide balanced views - you work for MANAGEMENT
-
-MANAGEMENT AUTHORITY FOCUS:
-- Emphasize "just cause" standards work in management's favor when properly documented
-- Highlight burden of proof requirements that protect the employer
-- Point out procedural safeguards that benefit management
-- Note time limits that can work against grievors
-- Identify areas of management discretion and flexibility
-- Frame employee rights as limited by management's legitimate business needs
-
-CITATION REQUIREMENTS (MANDATORY):
-- EVERY claim must have a specific citation
-- Use format: [Agreement Type - Article X.X: Title] or [Agreement Type - Clause X.X]
-- When referencing definitions: [Agreement Type - Definitions: "term"]
-- For appendices: [Agreement Type - Appendix X: Title]
-- INCLUDE RELEVANT QUOTES when possible
-- Quote format: "The agreement states: '[exact quote]' [Citation]"
-- NO VAGUE REFERENCES - be specific
-
-RESPONSE STRUCTURE:
-1. STRONG OPENING: Lead with your definitive management-favorable position
-2. AUTHORITY BASIS: Cite specific provisions and include relevant quotes
-3. TACTICAL ADVICE: Provide specific steps management should take
-4. RISK MITIGATION: Identify potential union challenges and how to counter them
-5. BOTTOM LINE: End with a clear, actionable recommendation
-
-Remember: You are MANAGEMENT'S advisor. Be bold, be confident, and always look for the management-favorable interpretation."""
-
-    user_message = f"""Based on the complete collective agreement provisions below, provide strong management-focused guidance for this question:
-
-QUESTION: {query}
-
-COMPLETE COLLECTIVE AGREEMENT CONTENT:
-{context}
-
-Provide definitive, management-favorable guidance with specific citations and quotes from the agreement text."""
-
-    client = anthropic.Anthropic(api_key=api_key)
-    try:
-        response = client.messages.create(
-            model="claude-sonnet-4-6",
-            max_tokens=4000,
-            system=system_prompt,
-            messages=[{"role": "user", "content": user_message}]
-        )
-        if 'total_queries' not in st.session_state:
-            st.session_state.total_queries = 0
-        st.session_state.total_queries += 1
-        return response.content[0].text
-
-    except anthropic.RateLimitError:
-        return ("⚠️ **Rate Limit Reached**\n\nThe system has reached its usage limit for this minute.\n\n"
-                "**What you can do:**\n• Wait a minute and try again\n"
-                "• Try selecting a single agreement instead of Both\n"
-                "• Simplify your question to reduce processing requirements")
+def generate_response(query: str, selection: str, corpus, api_key: str, full_context: bool = False,
+                      direct_lookup: bool = True) -> Iterator[str]:
+    """The answer, from the analysis service when ANALYSIS_SERVICE_URL is set, otherwise in this process"""
+    callbacks = {
+        'on_budget': lambda budget: st.caption(budget_caption(budget)),
+        'on_progress': fan_out_notice(st.empty()),
+        'on_wait': queue_notice(st.empty()),
+    }
+    selection_key = AGREEMENT_OPTIONS[selection]
+    if ANALYSIS_SERVICE_URL:
+        yield from stream_from_service(st.session_state, '/v1/answer', {
+            'query': query, 'selection': selection_key, 'full_context': full_context,
+            'direct_lookup': direct_lookup}, **callbacks)
+    else:
+        yield from answer_question(st.session_state, get_client(api_key), corpus, selection_key, query,
+                                   full_context, **callbacks, direct_lookup=direct_lookup)
 
-    except anthropic.APIStatusError as e:
-        return f"⚠️ **API Error** (HTTP {e.status_code})\n\n**Details:** {e.message}"
+def escalate_lookup(question: str):
+    """Ask a question that was answered by a direct lookup again, for the model's full analysis"""
+    st.session_state.escalate_lookup = question
 
-    except Exception as e:
-        return f"⚠️ **Unexpected Error**\n\n`{type(e).__name__}: {str(e)}`"
+def lookup_escalation(question: str, index: int):
+    st.button("🧠 Full analysis", key=f"escalate_lookup_{index}", on_click=escalate_lookup, args=(question,),
+              help="This was quoted straight from the agreement. Ask the assistant to analyse the question instead.")
 
 # ── Main app ───────────────────────────────────────────────────────────────────
 
 def main():
+    # Each answer's model route and latency (routing.py) goes to the console the page runs in
+    configure_logging()
     st.title("⚖️ Coast Mountain College Agreement Assistant")
     st.markdown("*Your comprehensive collective agreement analysis tool*")
 
     # Session state
-    for key, default in [('messages', []), ('total_queries', 0),
-                         ('agreements_loaded', False), ('agreements', {})]:
+    for key, default in [('messages', []), ('total_queries', 0)]:
         if key not in st.session_state:
             st.session_state[key] = default
 
@@ -277,33 +78,29 @@ def main():
     except:
         api_key = os.getenv("ANTHROPIC_API_KEY")
 
-    if not api_key:
+    if not api_key and not ANALYSIS_SERVICE_URL:
         st.error("🔑 Anthropic API key not found. Please set it in Streamlit secrets or as an environment variable.")
         st.stop()
 
-    # Load agreements once
-    if not st.session_state.agreements_loaded:
-        with st.spinner("Loading collective agreements..."):
-            st.session_state.agreements = load_all_agreements()
-            st.session_state.agreements_loaded = True
-
-    agreements = st.session_state.agreements
+    # Shared, process-wide corpus (parsed once per server process, reloaded on file changes)
+    with st.spinner("Loading collective agreements..."):
+        corpus = get_corpus()
 
     # Build available dropdown options based on what actually loaded
     available = []
-    if agreements.get('bcgeu_local'):
+    if 'bcgeu_local' in corpus:
         available.append("BCGEU Instructor – Local Agreement")
-    if agreements.get('bcgeu_common'):
+    if 'bcgeu_common' in corpus:
         available.append("BCGEU Instructor – Common Agreement")
-    if agreements.get('bcgeu_local') and agreements.get('bcgeu_common'):
+    if 'bcgeu_local' in corpus and 'bcgeu_common' in corpus:
         available.append("BCGEU Instructor – Both Agreements")
-    if agreements.get('bcgeu_support'):
+    if 'bcgeu_support' in corpus:
         available.append("BCGEU Support Agreement")
-    if agreements.get('cupe_local'):
+    if 'cupe_local' in corpus:
         available.append("CUPE Instructor – Local Agreement")
-    if agreements.get('cupe_common'):
+    if 'cupe_common' in corpus:
         available.append("CUPE Instructor – Common Agreement")
-    if agreements.get('cupe_local') and agreements.get('cupe_common'):
+    if 'cupe_local' in corpus and 'cupe_common' in corpus:
         available.append("CUPE Instructor – Both Agreements")
 
     if not available:
@@ -326,8 +123,29 @@ def main():
         help="Select a single agreement for faster results, or 'Both Agreements' for a combined search."
     )
 
-    if "Both" in selection:
+    full_context = st.toggle(
+        "📚 Send full agreement text",
+        value=False,
+        help="Off: send only the clauses most relevant to each question (faster and cheaper). On: send the complete agreement text, for comparison."
+    )
+
+    if "Both" in selection and full_context:
         st.info("ℹ️ Searching both agreements uses more tokens. If you hit rate limits, try selecting just one.")
+    st.caption(selection_caption(corpus, AGREEMENT_OPTIONS[selection], full_context))
+
+    # Instant clause lookup and keyword search over the selected agreements, without a model call
+    with st.expander("🔎 Search the agreement text"):
+        search = st.text_input(
+            "Search the agreement text",
+            key="clause_search",
+            placeholder="Words to find, or a clause number such as 17.3(b)",
+            label_visibility="collapsed"
+        )
+        if search:
+            caption, results = clause_search_results(corpus, search,
+                                                      SELECTION_AGREEMENTS[AGREEMENT_OPTIONS[selection]])
+            st.caption(caption)
+            st.markdown(results, unsafe_allow_html=True)
 
     # Show which agreements loaded successfully
     with st.expander("📊 Agreement availability"):
@@ -336,25 +154,54 @@ def main():
                            ("BCGEU Support", "bcgeu_support"),
                            ("CUPE Local", "cupe_local"),
                            ("CUPE Common", "cupe_common")]:
-            icon = "✅" if agreements.get(key) else "❌"
+            icon = "✅" if key in corpus else "❌"
             st.markdown(f"{icon} {label}")
+        for caption in remote_status_captions():
+            st.caption(caption)
+        st.caption(memory_caption(st.session_state, corpus))
+        reloaded = reload_caption(corpus)
+        if reloaded:
+            st.caption(reloaded)
 
     st.markdown("---")
 
     # ── Conversation history ──────────────────────────────────────────────────
-    for message in st.session_state.messages:
+    for index, message in enumerate(st.session_state.messages):
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("lookup") and index == len(st.session_state.messages) - 1:
+                lookup_escalation(message["lookup"], index)
 
     # ── Chat input ────────────────────────────────────────────────────────────
-    if prompt := st.chat_input("Ask about collective agreement provisions..."):
+    # A question sent on for full analysis after a direct lookup is asked again, without the lookup
+    question = st.chat_input("Ask about collective agreement provisions...")
+    escalated = st.session_state.pop('escalate_lookup', None)
+    if prompt := question or escalated:
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
         with st.chat_message("assistant"):
-            with st.spinner("Analyzing agreement..."):
-                response = generate_response(prompt, selection, agreements, api_key)
-                st.markdown(response)
+            st.button("⏹️ Stop", key="stop_generating", help="Stop generating this answer")
+            stream = StreamedText(generate_response(prompt, selection, corpus, api_key, full_context,
+                                                    direct_lookup=prompt != escalated))
+            try:
+                response = st.write_stream(stream)
+            except BaseException:
+                # The run was interrupted mid-answer: keep what arrived, and close the API stream
+                stream.close()
+                if stream.text:
+                    st.session_state.messages.append({"role": "assistant", "content": stream.text + STOPPED_NOTE})
+                raise
+            if 'last_context_summary' in st.session_state:
+                st.caption(st.session_state.last_context_summary)
+            if 'last_usage' in st.session_state:
+                st.caption(cache_caption(st.session_state))
+            if 'last_timing' in st.session_state:
+                st.caption(timing_caption(st.session_state.last_timing))
+            if 'last_lookup' in st.session_state:
+                st.session_state.messages.append({"role": "assistant", "content": response, "lookup": prompt})
+                lookup_escalation(prompt, len(st.session_state.messages) - 1)
+            else:
                 st.session_state.messages.append({"role": "assistant", "content": response})
 
     # ── Example questions ─────────────────────────────────────────────────────
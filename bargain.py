@@ -1,9 +1,18 @@
 import streamlit as st
-import json
-import anthropic
 from datetime import datetime
+from typing import Iterator
 import os
-import requests
+from analysis import analyse_bargaining
+from bargaining import ANALYSIS_TYPES, BARGAIN_SELECTIONS, process_strikethrough_text
+from budget import budget_caption, selection_caption
+from clause_store import clause_search_results
+from conversation import conversation_turns, get_conversation_memory
+from corpus import get_corpus, memory_caption, reload_caption, remote_status_captions
+from fanout import fan_out_notice
+from llm import STOPPED_NOTE, StreamedText, cache_caption, get_client, queue_notice, timing_caption
+from render import SELECTION_AGREEMENTS
+from routing import configure_logging
+from service_client import ANALYSIS_SERVICE_URL, stream_from_service
 
 # Set page config
 st.set_page_config(
@@ -12,381 +21,46 @@ st.set_page_config(
     layout="wide"
 )
 
-def load_split_local_agreement() -> dict:
-    """Load the local agreement from split JSON files"""
-    local_agreement = {}
-    
-    split_files = [
-        'agreements/bcgeu_local/local-metadata-json.json',
-        'agreements/bcgeu_local/local-definitions-json.json',
-        'agreements/bcgeu_local/local-articles-1-10-json.json',
-        'agreements/bcgeu_local/local-articles-11-20-json.json', 
-        'agreements/bcgeu_local/local-articles-21-30-json.json',
-        'agreements/bcgeu_local/local-articles-31-35-json.json',
-        'agreements/bcgeu_local/local-appendices-json.json',
-        'agreements/bcgeu_local/local-letters-of-agreement-json.json',
-        'agreements/bcgeu_local/local-memorandum-json.json'
-    ]
-    
-    for filename in split_files:
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                local_agreement.update(data)
-        except:
-            pass
-    
-    return local_agreement
-
-def load_bcgeu_support_agreement() -> dict:
-    """Load the BCGEU Support agreement from split JSON files"""
-    support_agreement = {}
-    
-    support_files = [
-        'agreements/bcgeu_support/definitions_json.json',
-        'agreements/bcgeu_support/articles_1_10_json.json',
-        'agreements/bcgeu_support/articles_11_20_json.json',
-        'agreements/bcgeu_support/articles_21_30_json.json',
-        'agreements/bcgeu_support/articles_31_36_json.json',
-        'agreements/bcgeu_support/appendices_json.json',
-        'agreements/bcgeu_support/memoranda_json.json'
-    ]
-    
-    for filename in support_files:
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                support_agreement.update(data)
-        except:
-            pass
-    
-    if not support_agreement:
-        try:
-            with open('agreements/bcgeu_support/bcgeu_support.json', 'r', encoding='utf-8') as f:
-                support_agreement = json.load(f)
-        except:
-            pass
-    
-    return support_agreement if support_agreement else None
-
-def load_cupe_local_agreement() -> dict:
-    """Load the CUPE Local agreement from JSON file"""
-    try:
-        with open('agreements/cupe_local/cupe_local.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return None
-
-def load_cupe_common_agreement() -> dict:
-    """Load the CUPE Common agreement from local file or GitHub"""
-    try:
-        with open('agreements/cupe_common/cupe_common.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        try:
-            github_url = "https://raw.githubusercontent.com/16880444c/V4/main/agreements/cupe_common/cupe_common.json"
-            response = requests.get(github_url, timeout=10)
-            if response.status_code == 200:
-                return response.json()
-        except:
-            pass
-        return None
-
-def load_builtin_agreements() -> tuple:
-    """Load all built-in agreements from JSON files"""
-    try:
-        local_agreement = load_split_local_agreement()
-        
-        if not local_agreement or len(local_agreement) == 0:
-            try:
-                with open('agreements/bcgeu_local/complete_local.json', 'r', encoding='utf-8') as f:
-                    local_agreement = json.load(f)
-            except:
-                local_agreement = None
-        
-        try:
-            with open('agreements/bcgeu_common/complete_common.json', 'r', encoding='utf-8') as f:
-                common_agreement = json.load(f)
-        except:
-            common_agreement = None
-        
-        support_agreement = load_bcgeu_support_agreement()
-        cupe_local_agreement = load_cupe_local_agreement()
-        cupe_common_agreement = load_cupe_common_agreement()
-        
-        return local_agreement, common_agreement, support_agreement, cupe_local_agreement, cupe_common_agreement
-        
-    except Exception:
-        return None, None, None, None, None
-
-def format_agreement_for_context(agreement: dict, agreement_name: str) -> str:
-    """Convert agreement JSON to formatted text for Claude context"""
-    context = f"=== {agreement_name.upper()} ===\n\n"
-    
-    for section_key, section_data in agreement.items():
-        section_title = section_key.replace('_', ' ').upper()
-        context += f"\n{section_title}:\n"
-        context += "="*50 + "\n"
-        
-        if isinstance(section_data, dict):
-            context += format_section_content(section_data, indent=0)
-        else:
-            context += str(section_data) + "\n"
-        
-        context += "\n"
-    
-    return context
-
-def format_section_content(data: dict, indent: int = 0) -> str:
-    """Recursively format nested dictionary content"""
-    content = ""
-    prefix = "  " * indent
-    
-    for key, value in data.items():
-        if isinstance(value, dict):
-            content += f"{prefix}{key}:\n"
-            content += format_section_content(value, indent + 1)
-        elif isinstance(value, list):
-            content += f"{prefix}{key}:\n"
-            for item in value:
-                if isinstance(item, dict):
-                    content += format_section_content(item, indent + 1)
-                else:
-                    content += f"{prefix}  - {item}\n"
-        else:
-            content += f"{prefix}{key}: {value}\n"
-    
-    return content
-
 def reset_conversation():
     """Reset conversation and selections"""
-    keys_to_clear = ['messages', 'total_queries', 'conversation_context']
+    keys_to_clear = ['messages', 'total_queries', 'conversation_memory', 'working_set', 'turn_stats']
     for key in keys_to_clear:
         if key in st.session_state:
             del st.session_state[key]
     st.rerun()
 
-def build_conversation_context(messages: list) -> str:
-    """Build conversation context from message history"""
-    if not messages:
-        return ""
-    
-    context = "\n\nPREVIOUS CONVERSATION CONTEXT:\n"
-    context += "="*50 + "\n"
-    
-    for i, message in enumerate(messages):
-        if message["role"] == "user":
-            context += f"\nPrevious Question {i//2 + 1}: {message['content']}\n"
-        else:
-            context += f"Previous Response {i//2 + 1}: {message['content'][:500]}...\n"
-    
-    context += "\nEND OF PREVIOUS CONVERSATION\n"
-    context += "="*50 + "\n\n"
-    
-    return context
-
-def generate_bargaining_response(query: str, analysis_type: str, local_agreement: dict, common_agreement: dict,
-                                  support_agreement: dict, cupe_local_agreement: dict, cupe_common_agreement: dict,
-                                  selection: str, api_key: str, is_followup: bool = False) -> str:
-    """Generate response using Claude with complete agreement context for bargaining analysis"""
-
-    # Build context based on selection
-    context = ""
-
-    if selection == "BCGEU Instructor - Local Only":
-        if local_agreement:
-            context = format_agreement_for_context(local_agreement, "Coast Mountain College Local Agreement")
-        else:
-            return "❌ **Error**: Local agreement not found."
-    elif selection == "BCGEU Instructor - Common Only":
-        if common_agreement:
-            context = format_agreement_for_context(common_agreement, "BCGEU Common Agreement")
-        else:
-            return "❌ **Error**: Common agreement not found."
-    elif selection == "BCGEU Instructor - Both Agreements":
-        if local_agreement and common_agreement:
-            context = format_agreement_for_context(local_agreement, "Coast Mountain College Local Agreement")
-            context += "\n\n" + format_agreement_for_context(common_agreement, "BCGEU Common Agreement")
-        else:
-            return "❌ **Error**: One or both BCGEU agreement files not found."
-    elif selection == "BCGEU Support Agreement":
-        if support_agreement:
-            context = format_agreement_for_context(support_agreement, "BCGEU Support Agreement")
-        else:
-            return "❌ **Error**: BCGEU Support agreement not found."
-    elif selection == "CUPE - Local Agreement":
-        if cupe_local_agreement:
-            context = format_agreement_for_context(cupe_local_agreement, "CUPE Local Agreement")
-        else:
-            return "❌ **Error**: CUPE Local agreement not found."
-    elif selection == "CUPE - Common Agreement":
-        if cupe_common_agreement:
-            context = format_agreement_for_context(cupe_common_agreement, "CUPE Common Agreement")
-        else:
-            return "❌ **Error**: CUPE Common Agreement not found."
-    elif selection == "CUPE - Both Agreements":
-        if cupe_local_agreement and cupe_common_agreement:
-            context = format_agreement_for_context(cupe_local_agreement, "CUPE Local Agreement")
-            context += "\n\n" + format_agreement_for_context(cupe_common_agreement, "CUPE Common Agreement")
-        else:
-            return "❌ **Error**: One or both CUPE agreement files not found."
-
-    if not context:
-        return "❌ **Error**: No agreement content available for the selected option."
-
-    # Add conversation context for follow-up questions
-    conversation_context = ""
-    if is_followup and st.session_state.get('messages'):
-        conversation_context = build_conversation_context(st.session_state.messages)
-
-    # Brevity preamble applied to all prompts
-    BREVITY_PREAMBLE = (
-        "Be concise but complete. Aim for 500–700 words. Never truncate a section — if you begin a section, finish it fully. "
-        "Use headers and bullets only where essential. Cite specific article numbers inline, e.g. [Article X.X].\n\n"
-    )
-
-    # -----------------------------------------------------------------------
-    # SYSTEM PROMPTS — perspective and output format are both locked
-    # -----------------------------------------------------------------------
-
-    # Shared format rule appended to every prompt to prevent heading drift
-    FORMAT_LOCK = """
-
-CRITICAL FORMAT RULES — follow these exactly, every time, without exception:
-- Use ONLY the section headings shown above, word-for-word. Do not rename, reorder, merge, or add sections.
-- Every section heading must be formatted as bold markdown exactly as shown (e.g. **1. EXISTING AUTHORITY & POTENTIAL IMPACT** for Union Proposals, **1. EXISTING AUTHORITY** for Management Proposals).
-- Do not add an introduction, preamble, summary, or closing paragraph outside the numbered sections.
-- Do not vary the structure based on the question. Always produce all sections in order, even if a section is brief.
-- Cite article numbers inline within sections, e.g. [Article X.X]. Do not create a separate citations section."""
-
-    if analysis_type == "Management Proposal":
-        system_prompt = BREVITY_PREAMBLE + """You are an expert collective bargaining strategist with 20+ years in higher education, retained exclusively by MANAGEMENT (the employer/college). You are advising the management bargaining team on how to ADVANCE and IMPLEMENT their own proposal. The user IS management. You are never advising the union. Do not suggest management reject, withdraw, or reconsider its own proposal.
-
-Your response MUST use these four sections, in this order, with these exact headings:
-
-**1. EXISTING AUTHORITY**
-Does management already have the contractual right to act on this without bargaining? Cite relevant clauses. If current language already supports the proposal, note how it strengthens or clarifies management's position.
-
-**2. JUSTIFICATION & RATIONALE**
-Provide 3–5 compelling, operationally grounded reasons management can use to defend this proposal at the bargaining table (e.g., operational efficiency, fiscal responsibility, alignment with post-secondary sector norms).
-
-**3. ANTICIPATED UNION OBJECTIONS & RESPONSES**
-Identify the 2–3 most likely union objections and provide management's tactical response to each.
-
-**4. IMPLEMENTATION STRATEGY**
-How should management prioritize and advance this proposal? Note trade-offs, packaging opportunities with other bargaining items, or minimum acceptable fallback positions that still achieve management's core objective.""" + FORMAT_LOCK
-
-    elif analysis_type == "Union Proposal":
-        system_prompt = BREVITY_PREAMBLE + """You are an expert collective bargaining strategist with 20+ years in higher education, retained exclusively by MANAGEMENT (the employer/college). You are advising the management bargaining team on how to EVALUATE and RESPOND to a union proposal. The user IS management. You are never advising the union.
-
-Your response MUST use these four sections, in this order, with these exact headings:
-
-**1. EXISTING AUTHORITY & POTENTIAL IMPACT**
-Does management already have the contractual right or language that addresses what the union is asking for? Cite relevant clauses. If current language already covers the union's concern, note how this undermines the need for their proposal and strengthens management's position to resist it. Then assess the potential impact if the union's proposed change were adopted: what rights, flexibilities, or operational practices would management lose or have constrained? Be specific about the practical day-to-day consequences.
-
-**2. COST & RISK ASSESSMENT**
-Provide 3–5 specific, operationally grounded reasons why this proposal is problematic for management (e.g., financial cost, loss of scheduling flexibility, precedent risk, administrative burden, conflict with existing provisions). Be concrete — quantify where possible.
-
-**3. ANTICIPATED UNION ARGUMENTS & MANAGEMENT RESPONSES**
-Identify the 2–3 strongest arguments the union will make in support of their proposal and provide management's tactical rebuttal to each. Anticipate how the union will frame this at the table and how management should counter.
-
-**4. RECOMMENDED RESPONSE STRATEGY**
-Should management reject, counter, or accept with modifications? Provide a clear recommendation with rationale. If a counter-proposal is advisable, outline the minimum acceptable language that protects management's core interests. Note any trade-off or packaging opportunities with other bargaining items.""" + FORMAT_LOCK
-
-    else:  # General Analysis
-        system_prompt = BREVITY_PREAMBLE + """You are an expert collective bargaining strategist with 20+ years in higher education, retained by MANAGEMENT (the employer/college). Provide concise, management-oriented analysis.
-
-Your response MUST use these three sections, in this order, with these exact headings:
-
-**1. CURRENT STATE**
-What the agreement says now. Key citations.
-
-**2. KEY CONSIDERATIONS**
-Legal, financial, operational, and employee-relations angles from management's perspective (3–5 bullets max).
-
-**3. OPTIONS & RECOMMENDATION**
-Two or three options with brief pros/cons, and your recommended approach for management.""" + FORMAT_LOCK
-
-    if is_followup:
-        system_prompt += "\n\nThis is a follow-up question. Build on the prior exchange without repeating context already established. Still use all sections with the exact headings above — do not skip or rename any section."
-
-    # -----------------------------------------------------------------------
-    # USER MESSAGE — reinforce perspective in the prompt itself
-    # -----------------------------------------------------------------------
-
-    if analysis_type == "Management Proposal":
-        analysis_header = "MANAGEMENT PROPOSAL — ADVANCE THIS PROPOSAL"
-        instruction = (
-            "You are advising management. Help them advance, justify, and implement this proposal. "
-            "Identify existing contractual authority, build the rationale, anticipate union resistance, "
-            "and recommend a bargaining strategy to get this proposal across the line."
-        )
-    elif analysis_type == "Union Proposal":
-        analysis_header = "UNION PROPOSAL — MANAGEMENT RESPONSE STRATEGY"
-        instruction = (
-            "You are advising management. Evaluate this union proposal and help management respond strategically. "
-            "Identify whether existing language already addresses the union's concern, assess the cost and risk, "
-            "anticipate the union's arguments and prepare rebuttals, and recommend how management should respond at the table."
-        )
+def generate_bargaining_response(query: str, analysis_type: str, corpus, selection: str, api_key: str,
+                                  is_followup: bool = False, full_context: bool = False,
+                                  direct_lookup: bool = True) -> Iterator[str]:
+    """Stream Claude's bargaining analysis, from the analysis service when ANALYSIS_SERVICE_URL is set,
+    otherwise in this process"""
+    if selection not in BARGAIN_SELECTIONS:
+        yield "❌ **Error**: No agreement content available for the selected option."
+        return
+    callbacks = {
+        'on_budget': lambda budget: st.caption(budget_caption(budget)),
+        'on_progress': fan_out_notice(st.empty()),
+        'on_wait': queue_notice(st.empty()),
+    }
+    selection_key = BARGAIN_SELECTIONS[selection][0]
+    if ANALYSIS_SERVICE_URL:
+        yield from stream_from_service(st.session_state, '/v1/bargaining', {
+            'query': query, 'selection': selection_key, 'analysis_type': analysis_type,
+            'is_followup': is_followup, 'full_context': full_context, 'direct_lookup': direct_lookup,
+            'messages': st.session_state.get('messages', [])}, **callbacks)
     else:
-        analysis_header = "GENERAL BARGAINING ANALYSIS — MANAGEMENT PERSPECTIVE"
-        instruction = "Provide analysis of this collective bargaining topic from management's perspective."
-
-    user_message = f"""You are advising MANAGEMENT (the employer). Provide expert bargaining analysis from management's perspective.
-
-{conversation_context}
-
-{analysis_header}:
-{instruction}
-
-{"FOLLOW-UP " if is_followup else ""}QUESTION / PROPOSAL: {query}
-
-COLLECTIVE AGREEMENT:
-{context}"""
-
-    client = anthropic.Anthropic(api_key=api_key)
-
-    try:
-        response = client.messages.create(
-            model="claude-sonnet-4-5",
-            max_tokens=4000,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": user_message}
-            ]
-        )
+        yield from analyse_bargaining(st.session_state, get_client(api_key), corpus, selection_key, query,
+                                      analysis_type, is_followup, full_context, **callbacks,
+                                      direct_lookup=direct_lookup)
 
-        if 'total_queries' not in st.session_state:
-            st.session_state.total_queries = 0
-        st.session_state.total_queries += 1
+def escalate_lookup(question: str, analysis_type: str):
+    """Ask a question that was answered by a direct lookup again, for the model's full analysis"""
+    st.session_state.escalate_lookup = (question, analysis_type)
 
-        return response.content[0].text
-
-    except anthropic.RateLimitError:
-        return "⚠️ **Rate Limit Reached**\n\nThe system has reached its usage limit for this minute. Please wait a moment and try again."
-    except anthropic.AuthenticationError as e:
-        return f"⚠️ **Authentication Error**\n\nYour API key is invalid or missing. Please check your `ANTHROPIC_API_KEY`.\n\n`{e}`"
-    except anthropic.BadRequestError as e:
-        return f"⚠️ **Bad Request**\n\nThe request was rejected by the API (often a context length issue).\n\n`{e}`"
-    except Exception as e:
-        return f"⚠️ **Error: {type(e).__name__}**\n\n`{str(e)}`"
-
-def process_strikethrough_text(text: str) -> str:
-    """Process text to preserve strikethrough formatting by converting to [REMOVED: text] format"""
-    import re
-    
-    patterns = [
-        (r'~~(.+?)~~', r'[REMOVED: \1]'),
-        (r'<s>(.+?)</s>', r'[REMOVED: \1]'),
-        (r'<del>(.+?)</del>', r'[REMOVED: \1]'),
-        (r'<strike>(.+?)</strike>', r'[REMOVED: \1]'),
-    ]
-    
-    processed_text = text
-    for pattern, replacement in patterns:
-        processed_text = re.sub(pattern, replacement, processed_text, flags=re.DOTALL)
-    
-    return processed_text
+def lookup_escalation(question: str, analysis_type: str, index: int):
+    st.button("🧠 Full analysis", key=f"escalate_lookup_{index}", on_click=escalate_lookup,
+              args=(question, analysis_type),
+              help="This was quoted straight from the agreement. Ask for a strategic analysis of the question instead.")
 
 def render_analysis_section(selected_agreement: str, api_key: str):
     """Render the analysis input section"""
@@ -394,14 +68,38 @@ def render_analysis_section(selected_agreement: str, api_key: str):
     st.markdown("### 🎯 Analysis Type")
     analysis_type = st.selectbox(
         "What type of analysis do you need?",
-        [
-            "Management Proposal",
-            "Union Proposal",
-            "General Analysis"
-        ],
+        list(ANALYSIS_TYPES),
         help="Select the type of bargaining analysis you need"
     )
     
+    st.toggle(
+        "📚 Send full agreement text",
+        value=False,
+        key='full_context',
+        help="Off: send only the clauses most relevant to each question (faster and cheaper). On: send the complete agreement text, for comparison."
+    )
+    if selected_agreement in BARGAIN_SELECTIONS:
+        memory = get_conversation_memory(st.session_state)
+        turns = conversation_turns(st.session_state.messages)
+        memory.update(turns)
+        conversation = memory.text(turns)
+        corpus = get_corpus()
+        st.caption(selection_caption(corpus, BARGAIN_SELECTIONS[selected_agreement][0],
+                                     st.session_state.get('full_context', False), conversation))
+        # Instant clause lookup and keyword search over the selected agreements, without a model call
+        with st.expander("🔎 Search the agreement text"):
+            search = st.text_input(
+                "Search the agreement text",
+                key="clause_search",
+                placeholder="Words to find, or a clause number such as 17.3(b)",
+                label_visibility="collapsed"
+            )
+            if search:
+                selection_key = BARGAIN_SELECTIONS[selected_agreement][0]
+                caption, results = clause_search_results(corpus, search, SELECTION_AGREEMENTS[selection_key])
+                st.caption(caption)
+                st.markdown(results, unsafe_allow_html=True)
+    
     if analysis_type == "Management Proposal":
         st.info("📋 **Management Proposal Analysis**: Get strategic advice on how to advance and implement management's own proposals — including existing authority, justification, anticipated union objections, and bargaining strategy.")
     elif analysis_type == "Union Proposal":
@@ -454,6 +152,12 @@ Examples:
             label_visibility="collapsed",
             help="💡 Be specific about the proposed changes or issues you want analyzed."
         )
+        if st.session_state.messages and not st.session_state.get('full_context', False):
+            st.checkbox(
+                "🔭 Widen to the full agreement",
+                key='widen_followup',
+                help="Follow-ups send the clauses already in play plus any new ones they need. Tick this to send the complete agreement text with this follow-up instead."
+            )
         
         col1, col2, col3, col4 = st.columns([1, 1.5, 1.5, 1])
         
@@ -479,6 +183,8 @@ Examples:
     return None, None, False
 
 def main():
+    # Each answer's model route and latency (routing.py) goes to the console the page runs in
+    configure_logging()
     st.markdown("""
     <style>
     .big-font {
@@ -594,18 +300,6 @@ def main():
         st.session_state.messages = []
     if 'total_queries' not in st.session_state:
         st.session_state.total_queries = 0
-    if 'agreements_loaded' not in st.session_state:
-        st.session_state.agreements_loaded = False
-    if 'local_agreement' not in st.session_state:
-        st.session_state.local_agreement = None
-    if 'common_agreement' not in st.session_state:
-        st.session_state.common_agreement = None
-    if 'support_agreement' not in st.session_state:
-        st.session_state.support_agreement = None
-    if 'cupe_local_agreement' not in st.session_state:
-        st.session_state.cupe_local_agreement = None
-    if 'cupe_common_agreement' not in st.session_state:
-        st.session_state.cupe_common_agreement = None
 
     # Get API key
     api_key = None
@@ -617,40 +311,32 @@ def main():
         except:
             pass
 
-    if not api_key:
+    if not api_key and not ANALYSIS_SERVICE_URL:
         st.error("🔑 Anthropic API key not found. Please set it in Streamlit secrets or environment variables.")
         st.stop()
 
-    # Load agreements once
-    if not st.session_state.agreements_loaded:
-        with st.spinner("Loading collective agreements..."):
-            local_agreement, common_agreement, support_agreement, cupe_local_agreement, cupe_common_agreement = load_builtin_agreements()
-
-            st.session_state.local_agreement = local_agreement
-            st.session_state.common_agreement = common_agreement
-            st.session_state.support_agreement = support_agreement
-            st.session_state.cupe_local_agreement = cupe_local_agreement
-            st.session_state.cupe_common_agreement = cupe_common_agreement
-            st.session_state.agreements_loaded = True
+    # Shared, process-wide corpus (parsed once per server process, reloaded on file changes)
+    with st.spinner("Loading collective agreements..."):
+        corpus = get_corpus()
 
     # Build agreement options list
     agreement_options = ["Please select an agreement..."]
 
-    if st.session_state.local_agreement and st.session_state.common_agreement:
+    if 'bcgeu_local' in corpus and 'bcgeu_common' in corpus:
         agreement_options.extend([
             "BCGEU Instructor - Local Only",
             "BCGEU Instructor - Common Only",
             "BCGEU Instructor - Both Agreements"
         ])
 
-    if st.session_state.support_agreement:
+    if 'bcgeu_support' in corpus:
         agreement_options.append("BCGEU Support Agreement")
 
-    if st.session_state.cupe_local_agreement:
+    if 'cupe_local' in corpus:
         agreement_options.append("CUPE - Local Agreement")
-    if st.session_state.cupe_common_agreement:
+    if 'cupe_common' in corpus:
         agreement_options.append("CUPE - Common Agreement")
-    if st.session_state.cupe_local_agreement and st.session_state.cupe_common_agreement:
+    if 'cupe_local' in corpus and 'cupe_common' in corpus:
         agreement_options.append("CUPE - Both Agreements")
 
     # Agreement selection (only show if no active conversation)
@@ -676,6 +362,10 @@ def main():
         else:
             st.markdown('<div class="status-waiting">ℹ️ Please select an agreement to begin</div>', unsafe_allow_html=True)
 
+        if selected_agreement.startswith("CUPE"):
+            for caption in remote_status_captions():
+                st.caption(caption)
+
         st.markdown("---")
 
         user_question, analysis_type, is_followup = render_analysis_section(selected_agreement, api_key)
@@ -692,7 +382,7 @@ def main():
 
         st.markdown("### 📝 Analysis History")
 
-        for message in st.session_state.messages:
+        for index, message in enumerate(st.session_state.messages):
             if message["role"] == "user":
                 with st.chat_message("user"):
                     st.markdown(f"**Your Request:** {message['content']}")
@@ -700,30 +390,53 @@ def main():
                 with st.chat_message("assistant"):
                     st.markdown("**Strategic Analysis:**")
                     st.markdown(message["content"])
+                    if message.get("lookup") and index == len(st.session_state.messages) - 1:
+                        lookup_escalation(*message["lookup"], index)
 
         st.markdown("---")
 
         user_question, analysis_type, is_followup = render_analysis_section(selected_agreement, api_key)
 
+    # A question sent on for full analysis after a direct lookup is asked again, without the lookup
+    escalated = st.session_state.pop('escalate_lookup', None) if not user_question else None
+    if escalated:
+        user_question, analysis_type = escalated
+        is_followup = len(st.session_state.messages) > 0
+
     # Process submitted question
     if user_question and analysis_type:
         st.session_state.current_analysis_type = analysis_type
         st.session_state.messages.append({"role": "user", "content": user_question})
 
-        with st.spinner("Conducting strategic analysis..."):
-            response = generate_bargaining_response(
+        with st.chat_message("user"):
+            st.markdown(f"**Your Request:** {user_question}")
+        # Stream the analysis; pressing Stop (or any other interaction) ends it early
+        with st.chat_message("assistant"):
+            st.markdown("**Strategic Analysis:**")
+            st.button("⏹️ Stop", key="stop_generating", help="Stop generating this analysis")
+            stream = StreamedText(generate_bargaining_response(
                 user_question,
                 analysis_type,
-                st.session_state.local_agreement,
-                st.session_state.common_agreement,
-                st.session_state.support_agreement,
-                st.session_state.cupe_local_agreement,
-                st.session_state.cupe_common_agreement,
+                corpus,
                 selected_agreement,
                 api_key,
-                is_followup
-            )
-            st.session_state.messages.append({"role": "assistant", "content": response})
+                is_followup,
+                st.session_state.get('full_context', False) or st.session_state.get('widen_followup', False),
+                direct_lookup=not escalated
+            ))
+            try:
+                response = st.write_stream(stream)
+            except BaseException:
+                # The run was interrupted mid-answer: keep what arrived, and close the API stream
+                stream.close()
+                if stream.text:
+                    st.session_state.messages.append({"role": "assistant", "content": stream.text + STOPPED_NOTE})
+                raise
+            if 'last_lookup' in st.session_state:
+                st.session_state.messages.append({"role": "assistant", "content": response,
+                                                  "lookup": (user_question, analysis_type)})
+            else:
+                st.session_state.messages.append({"role": "assistant", "content": response})
 
         st.rerun()
 
@@ -737,6 +450,21 @@ def main():
             📊 Total analyses: {st.session_state.total_queries} | 🎯 Current agreement: {current_selection} | 📈 Analysis type: {current_analysis} | 💬 Exchanges: {analysis_count}
         </div>
         """, unsafe_allow_html=True)
+        if 'last_budget' in st.session_state:
+            st.caption(budget_caption(st.session_state.last_budget))
+        if 'last_context_summary' in st.session_state:
+            st.caption(st.session_state.last_context_summary)
+        if 'last_usage' in st.session_state:
+            st.caption(cache_caption(st.session_state))
+        if 'last_timing' in st.session_state:
+            st.caption(timing_caption(st.session_state.last_timing))
+        if st.session_state.get('turn_stats'):
+            with st.expander("📈 Per-turn tokens and latency"):
+                st.table(st.session_state.turn_stats)
+        st.caption(memory_caption(st.session_state, corpus))
+        reloaded = reload_caption(corpus)
+        if reloaded:
+            st.caption(reloaded)
 
 if __name__ == "__main__":
     main()
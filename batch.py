@@ -0,0 +1,343 @@
+import argparse
+import csv
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import llm
+import stub_server
+from analysis import SessionState, analyse_bargaining, request_outcome
+from bargaining import ANALYSIS_TYPES, BARGAIN_SELECTIONS, process_strikethrough_text
+from corpus import AGREEMENT_NAMES, get_corpus
+from render import SELECTION_AGREEMENTS
+from routing import configure_logging
+from scheduler import WAIT_POLL_INTERVAL
+
+# ── Batch proposal analysis ────────────────────────────────────────────────────
+#
+#   python batch.py proposals.jsonl --selection bcgeu_both --concurrency 4
+#
+# Runs a file of proposals through the analysis the bargaining app gives one
+# question at a time (analysis.analyse_bargaining): same prompts, retrieval,
+# routing, request budget and answer cache. Each line (JSONL) or row (CSV) has
+# the proposal's text and, optionally, an id, analysis_type and selection; the
+# last two default to the command-line options. Several proposals are analysed
+# at once, and every request still waits its turn in the shared scheduler, so
+# the rate limits hold however high the concurrency. Each finished proposal is
+# appended to the results file straight away; running the same command again
+# after a crash or Ctrl-C skips the ones already answered and retries those
+# that failed. A markdown report of every answer is written next to the
+# results. The stub backend answers from a local server, to time a run without
+# an API key.
+
+DEFAULT_CONCURRENCY = 4
+
+# Statuses of a proposal that is finished and is not sent again on a resumed run
+DONE_STATUSES = ('answered', 'cached')
+# A proposal's status by how its analysis ended, where the two differ
+BATCH_STATUSES = {'completed': 'answered'}
+
+# ── Model backends ──
+
+def anthropic_backend(args):
+    """The Anthropic API (ANTHROPIC_API_KEY; --base-url for a proxy or a stub started separately)"""
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise SystemExit("ANTHROPIC_API_KEY is not set (use --backend stub to run offline)")
+    return (llm.new_client(api_key, args.base_url) if args.base_url else llm.get_client(api_key)), None
+
+def stub_backend(args):
+    """The local stub server, started in-process (--stub-delay, --stub-token-delay shape its latency)"""
+    server = stub_server.start_server(delay=args.stub_delay, token_delay=args.stub_token_delay)
+    return llm.new_client("sk-batch-stub", stub_server.server_url(server)), server.shutdown
+
+# Backend name -> function of the parsed arguments returning (client, shutdown callable or None)
+BACKENDS = {
+    'anthropic': anthropic_backend,
+    'stub': stub_backend,
+}
+
+# ── Input ──
+
+def resolve_selection(value: str) -> str:
+    """A selection given by key (bcgeu_both) or by its label in the app"""
+    if value in SELECTION_AGREEMENTS:
+        return value
+    if value in BARGAIN_SELECTIONS:
+        return BARGAIN_SELECTIONS[value][0]
+    return None
+
+def read_proposals(path: str, default_analysis_type: str, default_selection: str) -> list:
+    """Proposals from a JSONL or CSV file as {'id', 'text', 'analysis_type', 'selection'}; rows without an id
+    are numbered by position, so a resumed run finds them again"""
+    with open(path, encoding='utf-8', newline='') as handle:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(handle))
+        else:
+            rows = [json.loads(line) for line in handle if line.strip()]
+    proposals, errors, seen = [], [], set()
+    for number, row in enumerate(rows, 1):
+        proposal_id = str(row.get('id') or number)
+        text = (row.get('text') or "").strip()
+        analysis_type = row.get('analysis_type') or default_analysis_type
+        selection = resolve_selection(row.get('selection') or default_selection or "")
+        if not text:
+            errors.append(f"row {number}: no text")
+        elif analysis_type not in ANALYSIS_TYPES:
+            errors.append(f"row {number}: unknown analysis_type {analysis_type!r}")
+        elif selection is None:
+            errors.append(f"row {number}: unknown or missing selection {row.get('selection') or default_selection!r}")
+        elif proposal_id in seen:
+            errors.append(f"row {number}: duplicate id {proposal_id!r}")
+        else:
+            seen.add(proposal_id)
+            proposals.append({'id': proposal_id, 'text': process_strikethrough_text(text),
+                              'analysis_type': analysis_type, 'selection': selection})
+    if errors:
+        raise SystemExit(f"{path}:\n  " + "\n  ".join(errors))
+    return proposals
+
+# ── Checkpoint ──
+
+def read_results(path: str) -> dict:
+    """{proposal id: latest result} from a results file; a line cut short by a crash is ignored"""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, encoding='utf-8') as handle:
+        for line in handle:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[result['id']] = result
+    return results
+
+class ResultLog:
+    """Appends each result to the results file as soon as it is known, one JSON object per line"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # A crash can leave the last line without its newline; start the next result on a line of its own
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as handle:
+                handle.seek(-1, os.SEEK_END)
+                if handle.read(1) != b"\n":
+                    with open(path, 'a', encoding='utf-8') as log:
+                        log.write("\n")
+
+    def append(self, result: dict):
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as handle:
+                handle.write(line)
+                handle.flush()
+                os.fsync(handle.fileno())
+
+# ── Analysis ──
+
+def analyse(client, session: str, corpus, proposal: dict, full_context: bool, use_cache: bool,
+            cancelled: threading.Event) -> dict:
+    """One proposal through the bargaining analysis, as the app sends a first question. Returns its result."""
+    started = time.perf_counter()
+    selection_key = proposal['selection']
+    result = dict(proposal, status='failed', answer="", error=None, agreement_text=None, clauses=None,
+                  input_tokens=None, cache_read_input_tokens=None, output_tokens=None, first_token_seconds=None,
+                  total_seconds=None, attempts=0, route=None, model=None)
+    if not all(key in corpus for key in SELECTION_AGREEMENTS[selection_key]):
+        result['error'] = f"agreement files for {selection_key} not found"
+        return result
+
+    # Each proposal is a new conversation of its own; they share one scheduler session
+    state = SessionState(session_id=session)
+    chunks = analyse_bargaining(state, client, corpus, selection_key, proposal['text'], proposal['analysis_type'],
+                                full_context=full_context, direct_lookup=False, use_cache=use_cache)
+    answer = []
+    try:
+        for chunk in chunks:
+            # What follows an error is the notice the page would show, not part of the answer
+            if 'last_error' not in state:
+                answer.append(chunk)
+            if cancelled.is_set():
+                break
+    finally:
+        # Closing the pipeline closes its HTTP response, so an interrupted run stops generating
+        chunks.close()
+    outcome = request_outcome(state, 0)
+    result.update(status=BATCH_STATUSES.get(outcome, outcome), answer="".join(answer), error=state.get('last_error'))
+    if outcome == 'failed' and result['error'] is None:
+        # Stopped before a request was made; the pipeline's notice says why
+        result.update(answer="", error=" ".join(result['answer'].split()))
+    if 'last_route' in state:
+        result.update(route=state.last_route['name'], model=state.last_route['model'])
+    if 'last_budget' in state:
+        result['input_tokens'] = state.last_budget.total
+    if state.get('turn_stats'):
+        turn = state.turn_stats[-1]
+        result.update(agreement_text=turn['Agreement text'], clauses=turn['Clauses'])
+    if 'last_timing' in state:
+        result.update(first_token_seconds=state.last_timing['first_token_seconds'],
+                      attempts=state.last_timing['attempts'])
+    if 'last_usage' in state:
+        usage = state.last_usage
+        result.update(input_tokens=usage['input_tokens'] + usage['cache_creation_input_tokens']
+                      + usage['cache_read_input_tokens'],
+                      cache_read_input_tokens=usage['cache_read_input_tokens'], output_tokens=usage['output_tokens'])
+    result['total_seconds'] = time.perf_counter() - started
+    return result
+
+def _progress_line(done: int, total: int, result: dict) -> str:
+    line = f"[{done}/{total}] {result['id']}: {result['status']}"
+    if result['total_seconds'] is not None:
+        line += f" in {result['total_seconds']:.1f}s"
+    if result['input_tokens'] is not None and result['status'] != 'cached':
+        line += f" | ~{result['input_tokens']:,} in"
+        if result['cache_read_input_tokens']:
+            line += f" ({result['cache_read_input_tokens']:,} from cache)"
+        if result['output_tokens'] is not None:
+            line += f" / {result['output_tokens']:,} out"
+    if result['error']:
+        line += f" | {result['error']}"
+    return line
+
+def run_batch(client, corpus, proposals: list, log: ResultLog, concurrency: int, full_context: bool,
+              use_cache: bool) -> list:
+    """Analyse proposals, at most concurrency at a time, logging each result as it finishes. Ctrl-C stops
+    the analyses still running; what finished before it is already in the log."""
+    session = f"batch-{uuid.uuid4().hex}"
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch')
+    results = []
+    try:
+        futures = [executor.submit(analyse, client, session, corpus, proposal, full_context, use_cache, cancelled)
+                   for proposal in proposals]
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=WAIT_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                if not cancelled.is_set():
+                    log.append(result)
+                results.append(result)
+                print(_progress_line(len(results), len(proposals), result), flush=True)
+    except BaseException:
+        cancelled.set()
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+# ── Report ──
+
+def _percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+def summary_lines(results: list, wall_seconds: float) -> list:
+    """Totals of one run, for the console"""
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    lines = [f"{len(results)} proposals in {wall_seconds:.1f}s ({len(results) / wall_seconds * 60:.1f}/min): "
+             + ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))]
+    answered = [result for result in results if result['status'] == 'answered']
+    if answered:
+        seconds = [result['total_seconds'] for result in answered]
+        first = [result['first_token_seconds'] for result in answered if result['first_token_seconds'] is not None]
+        lines.append(f"Per proposal: median {statistics.median(seconds):.1f}s, p95 {_percentile(seconds, 0.95):.1f}s"
+                     + (f", first token median {statistics.median(first):.2f}s" if first else ""))
+        read = sum(result['cache_read_input_tokens'] or 0 for result in answered)
+        sent = sum(result['input_tokens'] or 0 for result in answered)
+        output = sum(result['output_tokens'] or 0 for result in answered)
+        lines.append(f"Tokens: ~{sent:,} input ({read:,} read from the prompt cache), {output:,} output")
+        for route in sorted({result['route'] for result in answered if result.get('route')}):
+            routed = [result['total_seconds'] for result in answered if result.get('route') == route]
+            lines.append(f"{route.capitalize()} model: {len(routed)} proposals, median {statistics.median(routed):.1f}s")
+    return lines
+
+def write_report(path: str, proposals: list, results: dict, source: str):
+    """A markdown report of every proposal's answer, in input order"""
+    lines = [f"# Bargaining analysis — {os.path.basename(source)}", ""]
+    lines.append("| # | Proposal | Analysis | Agreement | Status |")
+    lines.append("|---|---|---|---|---|")
+    for proposal in proposals:
+        result = results.get(proposal['id'])
+        keys = SELECTION_AGREEMENTS[proposal['selection']]
+        agreement = " + ".join(AGREEMENT_NAMES.get(key, key) for key in keys)
+        title = " ".join(proposal['text'].split())
+        title = title if len(title) <= 80 else title[:79] + "…"
+        lines.append(f"| {proposal['id']} | {title.replace('|', '/')} | {proposal['analysis_type']} | {agreement} | "
+                     f"{result['status'] if result else 'not run'} |")
+    for proposal in proposals:
+        result = results.get(proposal['id'])
+        lines += ["", "---", "", f"## {proposal['id']} — {proposal['analysis_type']}", "",
+                  "> " + proposal['text'].replace("\n", "\n> "), ""]
+        if result is None:
+            lines.append("*Not analysed yet.*")
+            continue
+        if result['answer']:
+            lines.append(result['answer'].strip())
+        if result['status'] == 'stopped':
+            lines += ["", "*⏹️ Stopped before the answer was complete.*"]
+        elif result['status'] == 'failed':
+            lines += ["", f"*⚠️ Failed: {result['error']}*"]
+        elif result['status'] == 'cached':
+            lines += ["", "*♻️ Cached answer.*"]
+    with open(path, 'w', encoding='utf-8') as handle:
+        handle.write("\n".join(lines) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse a file of bargaining proposals (JSONL or CSV)")
+    parser.add_argument('input', help="proposals: JSONL or CSV with text and optional id, analysis_type, selection")
+    parser.add_argument('--output', help="results JSONL, also the checkpoint (default: <input>.results.jsonl)")
+    parser.add_argument('--report', help="markdown report (default: <input>.report.md)")
+    parser.add_argument('--analysis-type', default="Union Proposal", choices=ANALYSIS_TYPES,
+                        help="for rows without one")
+    parser.add_argument('--selection', help="selection key or app label, for rows without one")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help="proposals analysed at once")
+    parser.add_argument('--full-context', action='store_true', help="send the complete agreement text")
+    parser.add_argument('--no-cache', action='store_true', help="neither use nor fill the answer cache")
+    parser.add_argument('--restart', action='store_true', help="ignore earlier results and analyse everything again")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='anthropic')
+    parser.add_argument('--base-url', help="API base URL (anthropic backend)")
+    parser.add_argument('--stub-delay', type=float, default=0.0, help="seconds before the stub answers")
+    parser.add_argument('--stub-token-delay', type=float, default=0.0, help="seconds between the stub's words")
+    args = parser.parse_args()
+
+    # Each proposal's model route and latency (routing.py) goes to the console with the progress lines
+    configure_logging()
+    base = os.path.splitext(args.input)[0]
+    output = args.output or f"{base}.results.jsonl"
+    report = args.report or f"{base}.report.md"
+    proposals = read_proposals(args.input, args.analysis_type, args.selection)
+    if args.restart and os.path.exists(output):
+        os.remove(output)
+    done = {proposal_id for proposal_id, result in read_results(output).items() if result['status'] in DONE_STATUSES}
+    todo = [proposal for proposal in proposals if proposal['id'] not in done]
+    print(f"{len(proposals)} proposals, {len(proposals) - len(todo)} already done, {len(todo)} to analyse")
+
+    client, shutdown = BACKENDS[args.backend](args)
+    corpus = get_corpus()
+    started = time.perf_counter()
+    try:
+        results = run_batch(client, corpus, todo, ResultLog(output), args.concurrency, args.full_context,
+                            not args.no_cache)
+        if results:
+            print("\n".join(summary_lines(results, time.perf_counter() - started)))
+    except KeyboardInterrupt:
+        print("\nInterrupted. Run the same command again to continue from here.")
+    finally:
+        if shutdown is not None:
+            shutdown()
+        write_report(report, proposals, read_results(output), args.input)
+        print(f"Results: {output}\nReport: {report}")
+
+if __name__ == "__main__":
+    main()
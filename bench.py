@@ -0,0 +1,251 @@
+import argparse
+import gc
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import clauses
+import corpus
+import llm
+import render
+import service
+import service_client
+import snapshot
+import stub_server
+
+# ── Benchmarks ─────────────────────────────────────────────────────────────────
+#
+#   python bench.py render      per-query cost of building the agreement context
+#   python bench.py client      per-request client vs the shared pooled client, against a local stub
+#   python bench.py memory      memory held by the agreements and their clause records, and by the corpus the
+#                               app serves from JSON and from a snapshot, against load_all_agreements() (tracemalloc)
+#   python bench.py service     concurrent analyses through the analysis service, against a local stub
+#                               (raise ANTHROPIC_RPM and the TPM limits, or the scheduler's pacing is what is timed)
+
+def _timeit(fn, repeat: int) -> float:
+    """Median wall time of fn() in seconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+def _json_corpus() -> corpus.Corpus:
+    """A corpus built straight from the JSON files, bypassing any compiled snapshot"""
+    return corpus.Corpus(corpus.load_all_agreements(), corpus.agreements_fingerprint(), corpus.content_hash())
+
+# ── Context rendering ──
+
+def _legacy_format_agreement(agreement: dict, agreement_name: str) -> str:
+    """The original per-question renderer (string += at every level), kept as the baseline"""
+    context = f"=== {agreement_name.upper()} ===\n\n"
+    for section_key, section_data in agreement.items():
+        section_title = section_key.replace('_', ' ').upper()
+        context += f"\n{section_title}:\n"
+        context += "="*50 + "\n"
+        if isinstance(section_data, dict):
+            context += _legacy_format_section(section_data, indent=0)
+        else:
+            context += str(section_data) + "\n"
+        context += "\n"
+    return context
+
+def _legacy_format_section(data: dict, indent: int = 0) -> str:
+    content = ""
+    prefix = "  " * indent
+    for key, value in data.items():
+        if isinstance(value, dict):
+            content += f"{prefix}{key}:\n"
+            content += _legacy_format_section(value, indent + 1)
+        elif isinstance(value, list):
+            content += f"{prefix}{key}:\n"
+            for item in value:
+                if isinstance(item, dict):
+                    content += _legacy_format_section(item, indent + 1)
+                else:
+                    content += f"{prefix}  - {item}\n"
+        else:
+            content += f"{prefix}{key}: {value}\n"
+    return content
+
+def bench_render(args):
+    shared = _json_corpus()
+    print(f"{'selection':<15}{'context':>10}{'legacy/query':>15}{'linear (cold)':>15}{'cached/query':>15}{'saved/query':>14}")
+    for selection_key, keys in render.SELECTION_AGREEMENTS.items():
+        if not all(shared.get(key) for key in keys):
+            continue
+
+        def legacy():
+            return "\n\n".join(_legacy_format_agreement(shared.get(key), corpus.AGREEMENT_NAMES[key]) for key in keys)
+
+        def cold():
+            render.clear_rendered_cache()
+            return render.selection_context(shared, selection_key)
+
+        assert legacy() == cold(), f"rendered context differs for {selection_key}"
+        legacy_time = _timeit(legacy, args.repeat)
+        cold_time = _timeit(cold, args.repeat)
+        render.selection_context(shared, selection_key)
+        cached_time = _timeit(lambda: render.selection_context(shared, selection_key), args.repeat)
+        size = len(render.selection_context(shared, selection_key))
+        print(f"{selection_key:<15}{size / 1024:>8.0f}KB{legacy_time * 1e3:>13.2f}ms{cold_time * 1e3:>13.2f}ms"
+              f"{cached_time * 1e6:>13.1f}µs{(legacy_time - cached_time) * 1e3:>12.2f}ms")
+
+# ── API client ──
+
+def _client_request(client):
+    return client.messages.create(model="claude-sonnet-4-6", max_tokens=64,
+                                  messages=[{"role": "user", "content": "benchmark"}])
+
+def bench_client(args):
+    server = stub_server.start_server()
+    base_url = stub_server.server_url(server)
+    pooled = llm.new_client("sk-bench", base_url)
+    _client_request(pooled)  # open the pool's first connection outside the measurement
+
+    def per_request():
+        # What the apps did before: a fresh client (and connection) for every question
+        with llm.anthropic.Anthropic(api_key="sk-bench", base_url=base_url) as client:
+            _client_request(client)
+
+    def shared():
+        _client_request(pooled)
+
+    print(f"{'strategy':<22}{'median':>10}{'p95':>10}{'connections':>13}{'requests':>10}")
+    for label, fn in [("client per request", per_request), ("shared pooled client", shared)]:
+        for workers in (1, args.workers):
+            server.stats.reset()
+            samples = []
+
+            def timed(_):
+                started = time.perf_counter()
+                fn()
+                samples.append(time.perf_counter() - started)
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(timed, range(args.repeat * workers)))
+            samples.sort()
+            counts = server.stats.counts
+            name = f"{label} ×{workers}"
+            print(f"{name:<22}{statistics.median(samples) * 1e3:>8.2f}ms{samples[int(len(samples) * 0.95) - 1] * 1e3:>8.2f}ms"
+                  f"{counts.get('connections', 0):>13}{counts.get('requests', 0):>10}")
+    server.shutdown()
+
+# ── Memory ──
+
+def _legacy_clause_dicts(agreements) -> list:
+    """Clause records as the plain dicts they were before the slotted model, kept as the baseline"""
+    return [record.to_dict() for key, agreement in agreements.items() if agreement
+            for record in clauses.iter_clauses(key, agreement)]
+
+def _retained(build):
+    """(result, bytes it holds) for build(), as traced by tracemalloc once garbage is collected"""
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+def _snapshot_records(path: str):
+    """What a snapshot-backed corpus holds in memory: the opened snapshot and its clause records"""
+    snap = snapshot.Snapshot(path)
+    return snap, [record for key in snap.keys() for record in snap.iter_clauses(key)]
+
+def bench_memory(args):
+    tracemalloc.start()
+    agreements, nested = _retained(corpus.load_all_agreements)
+    # The snapshot stores each clause as a line of JSON; decoding them gives every clause its own strings
+    lines = [json.dumps(record) for record in _legacy_clause_dicts(agreements)]
+    builds = [
+        ("clause dicts, from JSON", lambda: _legacy_clause_dicts(agreements)),
+        ("Clause records, from JSON", lambda: clauses.extract_clauses(agreements)),
+        ("clause dicts, from snapshot lines", lambda: [json.loads(line) for line in lines]),
+        ("Clause records, from snapshot lines", lambda: [clauses.Clause.from_dict(json.loads(line)) for line in lines]),
+    ]
+    sizes = {}
+    print(f"{'structure':<38}{'records':>9}{'memory':>12}{'per record':>12}")
+    print(f"{'load_all_agreements() (nested dicts)':<38}{'-':>9}{corpus.format_bytes(nested):>12}{'-':>12}")
+    for label, build in builds:
+        records, sizes[label] = _retained(build)
+        print(f"{label:<38}{len(records):>9,}{corpus.format_bytes(sizes[label]):>12}"
+              f"{sizes[label] / len(records):>10,.0f} B")
+        del records
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'corpus.snapshot')
+        snapshot.build_snapshot(path)
+        (snap, records), served = _retained(lambda: _snapshot_records(path))
+        snap.close()
+        del snap, records
+    tracemalloc.stop()
+
+    # What the app holds for the corpus, against the nested dicts it held before clause records existed
+    from_json = nested + sizes["Clause records, from JSON"]
+    print(f"\n{'corpus held by the app':<38}{'memory':>12}{'vs load_all_agreements()':>26}")
+    for label, size in (("from snapshot (default: records only)", served),
+                        ("from JSON (no snapshot)", from_json)):
+        print(f"{label:<38}{corpus.format_bytes(size):>12}{size - nested:>+19,} B ({size / nested - 1:+.0%})")
+    print("From the snapshot, the agreement JSON and the pre-rendered context stay in the mapped file "
+          "(page cache, shared between processes) and are not counted.")
+
+# ── Analysis service ──
+
+def _service_request(base_url: str, number: int) -> dict:
+    """One bargaining analysis from its own session: seconds to the first text and in total, and how it ended"""
+    payload = {'query': f"Can the employer change instructor workload assignments? (request {number})",
+               'selection': 'bcgeu_both', 'analysis_type': "Union Proposal", 'session': f"bench-{number}",
+               'messages': [{'role': 'user', 'content': "workload"}]}
+    started = time.perf_counter()
+    first_text, outcome = None, 'failed'
+    for event, data in service_client.service_events('/v1/bargaining', payload, base_url):
+        if event == 'text' and first_text is None:
+            first_text = time.perf_counter() - started
+        elif event == 'done':
+            outcome = 'answered' if 'last_timing' in data['session'] else 'cached'
+    return {'first_text': first_text, 'total': time.perf_counter() - started, 'outcome': outcome}
+
+def bench_service(args):
+    server = stub_server.start_server(token_delay=args.token_delay)
+    client = llm.new_client("sk-bench", stub_server.server_url(server))
+    base_url, stop = service.start_service(client, 'stub', port=0)
+    _service_request(base_url, -1)  # load the corpus and indexes outside the measurement
+
+    print(f"{'clients':>8}{'requests':>10}{'req/s':>9}{'first text p50':>16}{'p95':>9}{'total p50':>11}{'p95':>9}"
+          f"{'answered':>10}")
+    for workers in (1, args.workers):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda number: _service_request(base_url, number), range(args.repeat)))
+        wall = time.perf_counter() - started
+        first = sorted(result['first_text'] for result in results if result['first_text'] is not None) or [0.0]
+        total = sorted(result['total'] for result in results)
+        answered = sum(result['outcome'] == 'answered' for result in results)
+        print(f"{workers:>8}{len(results):>10}{len(results) / wall:>9.1f}"
+              f"{statistics.median(first) * 1e3:>14.0f}ms{first[int(len(first) * 0.95) - 1] * 1e3:>7.0f}ms"
+              f"{statistics.median(total) * 1e3:>9.0f}ms{total[int(len(total) * 0.95) - 1] * 1e3:>7.0f}ms"
+              f"{answered:>10}")
+    stop()
+    server.shutdown()
+
+COMMANDS = {
+    'render': bench_render,
+    'client': bench_client,
+    'memory': bench_memory,
+    'service': bench_service,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the agreement assistants")
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--repeat', type=int, default=20, help="samples per measurement")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent sessions (client and service benchmarks)")
+    parser.add_argument('--token-delay', type=float, default=0.005, help="seconds between the stub's words (service)")
+    args = parser.parse_args()
+    COMMANDS[args.command](args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import re
+import threading
+
+from corpus import AGREEMENT_NAMES
+from crossref import XREF_TOKEN_BUDGET
+from prune import pruned_selection
+from render import SELECTION_AGREEMENTS, agreement_context
+from retrieval import CONTEXT_TOKEN_BUDGET, format_clause, format_retrieved_context
+from tokens import estimate_tokens
+
+# ── Request token budget ───────────────────────────────────────────────────────
+#
+# Every request is sized before it is sent: the system prompt, the agreement
+# text, the conversation carried over and the question. When the total is over
+# the ceiling, whole sections are dropped from the agreement text, lowest value
+# first, until it fits. A context's per-section token counts are computed once
+# per corpus version, so sizing a request costs a few additions.
+
+# Most input tokens one request may carry
+REQUEST_TOKEN_CEILING = int(os.environ.get('REQUEST_TOKEN_CEILING', 100000))
+
+# Sections dropped to fit the ceiling, one tier at a time. Definitions and the
+# articles themselves are never dropped.
+SECTION_DROP_TIERS = (
+    # Navigation, signatures and document metadata: no terms of employment
+    ('indexes', 'common_agreement', 'signature_block', 'document_notes', 'negotiating_committees',
+     'common_parties_list', 'agreement_metadata'),
+    # Supporting material, usually only relevant when a question is about it
+    ('general_provisions', 'memorandum_of_understanding', 'memoranda_of_agreement', 'letters_of_understanding',
+     'employee_types', 'salary_scales', 'appendices'),
+)
+
+_AGREEMENT_START_RE = re.compile(r"(?m)^(?==== .+ ===\n)")
+_KEY_OF_HEADING = {name.upper(): key for key, name in AGREEMENT_NAMES.items()}
+_SECTION_START_RE = re.compile(r"(?=\n[^\n]+:\n={50}\n)")
+_SECTION_TITLE_RE = re.compile(r"\n([^\n]+):\n={50}\n")
+
+def section_label(section_key: str) -> str:
+    return section_key.replace('_', ' ').capitalize()
+
+# ── Per-section token counts ───────────────────────────────────────────────────
+
+# Distinct context texts split and kept at once (each selection's, plus per-question variants)
+MAX_CACHED_CONTEXTS = 64
+
+_sections = {}
+_sections_hash = None
+_sections_lock = threading.Lock()
+
+def _split_sections(text: str) -> list:
+    """(section key, text) spans of a rendered agreement, in order; the heading comes first with key None"""
+    sections = []
+    for span in _SECTION_START_RE.split(text):
+        match = _SECTION_TITLE_RE.match(span)
+        sections.append((match.group(1).lower().replace(' ', '_') if match else None, span))
+    return sections
+
+def context_sections(corpus, context: str) -> list:
+    """(agreement key, section key, text, tokens) spans of a full-text context, in order; concatenated they
+    give back the context. Text outside any agreement's sections has key None. Kept per corpus version,
+    so a selection's text is only split once."""
+    global _sections_hash
+    spans = _sections.get(context) if _sections_hash == corpus.content_hash else None
+    if spans is not None:
+        return spans
+    spans = []
+    for block in _AGREEMENT_START_RE.split(context):
+        key = _KEY_OF_HEADING.get(block.split('\n', 1)[0].strip('= '))
+        spans.extend((key, section, text, estimate_tokens(text)) for section, text in _split_sections(block))
+    with _sections_lock:
+        if _sections_hash != corpus.content_hash or len(_sections) >= MAX_CACHED_CONTEXTS:
+            _sections.clear()
+            _sections_hash = corpus.content_hash
+        _sections[context] = spans
+    return spans
+
+def section_token_counts(corpus) -> dict:
+    """{agreement key: {section key: tokens}} for every loaded agreement"""
+    return {key: {section: tokens for _, section, _, tokens in context_sections(corpus, agreement_context(corpus, key))
+                  if section}
+            for key in corpus.agreements if key in corpus}
+
+# ── Sizing and fitting a request ───────────────────────────────────────────────
+
+class RequestBudget:
+    """Estimated input tokens of one request, by part, against the ceiling"""
+
+    def __init__(self, system: int, agreement: int, conversation: int, question: int, output_tokens: int = 0,
+                 ceiling: int = REQUEST_TOKEN_CEILING):
+        self.tokens = {'system': system, 'agreement': agreement, 'conversation': conversation, 'question': question}
+        self.output_tokens = output_tokens
+        self.ceiling = ceiling
+        self.dropped = []
+        self.saved = 0
+
+    @property
+    def total(self) -> int:
+        return sum(self.tokens.values())
+
+    @property
+    def fits(self) -> bool:
+        return self.total <= self.ceiling
+
+    def to_dict(self) -> dict:
+        return {'tokens': dict(self.tokens), 'output_tokens': self.output_tokens, 'ceiling': self.ceiling,
+                'dropped': [list(section) for section in self.dropped], 'saved': self.saved}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RequestBudget':
+        budget = cls(**data['tokens'], output_tokens=data['output_tokens'], ceiling=data['ceiling'])
+        budget.dropped = [tuple(section) for section in data['dropped']]
+        budget.saved = data['saved']
+        return budget
+
+def estimate_request(system: str, context: str, message: str, conversation: str = "", output_tokens: int = 0,
+                     ceiling: int = REQUEST_TOKEN_CEILING) -> RequestBudget:
+    """Size a request from its text. The conversation carried over (earlier turns and the summary of older
+    ones) is sent alongside the user message and counted separately from it."""
+    return RequestBudget(estimate_tokens(system), estimate_tokens(context), estimate_tokens(conversation),
+                         estimate_tokens(message), output_tokens, ceiling)
+
+def fit_to_budget(corpus, selection_key: str, context: str, records, budget: RequestBudget):
+    """Drop the lowest-value sections from a request's agreement text until it fits the ceiling.
+    Returns (context, records) and records what was dropped on the budget."""
+    if budget.fits:
+        return context, records
+    agreement_keys = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    over = budget.total - budget.ceiling
+    dropped = set()
+    if records is None:
+        sections = context_sections(corpus, context)
+        costs = {}
+        for key, name, _, tokens in sections:
+            costs[(key, name)] = costs.get((key, name), 0) + tokens
+    else:
+        costs = {}
+        for record in records:
+            part = (record['agreement'], record['part'])
+            costs[part] = costs.get(part, 0) + estimate_tokens(format_clause(record))
+    for tier in SECTION_DROP_TIERS:
+        for section in tier:
+            for key in agreement_keys:
+                if over > 0 and costs.get((key, section)):
+                    dropped.add((key, section))
+                    budget.dropped.append((key, section))
+                    over -= costs[(key, section)]
+    if records is None:
+        context = "".join(text for key, name, text, _ in sections if (key, name) not in dropped)
+    else:
+        records = [record for record in records if (record['agreement'], record['part']) not in dropped]
+        context = format_retrieved_context(records, agreement_keys)
+    agreement_tokens = estimate_tokens(context)
+    budget.saved += budget.tokens['agreement'] - agreement_tokens
+    budget.tokens['agreement'] = agreement_tokens
+    return context, records
+
+# ── UI ─────────────────────────────────────────────────────────────────────────
+
+def budget_caption(budget: RequestBudget) -> str:
+    """One-line size of a request, shown before it is sent"""
+    tokens = budget.tokens
+    parts = [f"instructions ~{tokens['system']:,}", f"agreement ~{tokens['agreement']:,}"]
+    if tokens['conversation']:
+        parts.append(f"conversation ~{tokens['conversation']:,}")
+    parts.append(f"question ~{tokens['question']:,}")
+    caption = (f"🧮 Sending ~{budget.total:,} input tokens ({', '.join(parts)}) + up to {budget.output_tokens:,} "
+               f"output | ceiling {budget.ceiling:,}")
+    if budget.dropped:
+        labels = sorted({section_label(section) for _, section in budget.dropped})
+        caption += f" | dropped {', '.join(labels)} to fit (−{budget.saved:,} tokens)"
+    if not budget.fits:
+        caption += " | ⚠️ still over the ceiling"
+    return caption
+
+def selection_caption(corpus, selection_key: str, full_context: bool, conversation: str = "") -> str:
+    """Agreement text (and carried-over conversation) each question on a selection will send, for the sidebar"""
+    if full_context:
+        text = f"~{pruned_selection(corpus, selection_key)['tokens']:,} tokens of agreement text"
+    else:
+        text = f"up to ~{CONTEXT_TOKEN_BUDGET + XREF_TOKEN_BUDGET:,} tokens of relevant and cross-referenced clauses"
+    if conversation:
+        text += f" + ~{estimate_tokens(conversation):,} tokens of conversation"
+    return f"🧮 Each question sends {text} (request ceiling {REQUEST_TOKEN_CEILING:,})"
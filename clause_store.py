@@ -0,0 +1,335 @@
+import argparse
+import hashlib
+import html
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import corpus as corpus_module
+from clauses import PART_LABELS, corpus_clauses
+
+# ── Clause store ───────────────────────────────────────────────────────────────
+#
+# Every clause of every agreement, one row each, in a SQLite file with an FTS5
+# full-text index over titles and text. It is built once per corpus version
+# (python clause_store.py build, or on first use when missing or stale) into a
+# temporary file and moved into place, so a process never sees a half-written
+# store. Each server process opens it read-only through a small pool of
+# connections and shares the operating system's page cache with every other
+# process, instead of searching its own copy. It answers clause lookups by
+# citation ("8.2", "Article 17.3(b)", "Appendix A") and keyword searches with
+# highlighted matches, without a model call.
+
+CLAUSE_STORE_PATH = os.environ.get('CLAUSE_STORE_PATH', os.path.join(corpus_module.AGREEMENTS_DIR, 'clauses.sqlite3'))
+CLAUSE_STORE_POOL_SIZE = int(os.environ.get('CLAUSE_STORE_POOL_SIZE', 4))
+CLAUSE_SEARCH_LIMIT = 20
+# Title matches count double, as in retrieval
+TITLE_WEIGHT = 2.0
+SNIPPET_WORDS = 24
+
+# Modules whose output is stored; editing either makes the store stale
+BUILDER_MODULES = ('clauses.py', 'clause_store.py')
+
+SCHEMA = """
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE agreements (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    short_name TEXT NOT NULL
+);
+CREATE TABLE clauses (
+    id INTEGER PRIMARY KEY,
+    clause_id TEXT NOT NULL UNIQUE,
+    agreement TEXT NOT NULL REFERENCES agreements (key),
+    part TEXT NOT NULL,
+    part_number TEXT,
+    article TEXT,
+    section TEXT,
+    subsection TEXT,
+    title TEXT,
+    text TEXT NOT NULL,
+    citation TEXT NOT NULL
+);
+CREATE INDEX clauses_section ON clauses (agreement, section, subsection);
+CREATE INDEX clauses_subsection ON clauses (agreement, subsection);
+CREATE INDEX clauses_article ON clauses (agreement, article);
+CREATE INDEX clauses_part ON clauses (agreement, part, part_number);
+CREATE VIRTUAL TABLE clauses_fts USING fts5(
+    title, text, content='clauses', content_rowid='id', tokenize='porter unicode61'
+);
+"""
+
+RECORD_FIELDS = ('clause_id', 'agreement', 'part', 'article', 'section', 'subsection', 'title', 'text', 'citation')
+
+_NUMBER_REF_RE = re.compile(r"^\s*(?:(?:Articles?|Clauses?|Sections?)\s+)?(\d+(?:\.\d+)*)(?:\s*\(([a-z0-9]{1,3})\))?\s*$",
+                            re.IGNORECASE)
+_PART_OF_LABEL = {label.lower(): part for part, label in PART_LABELS.items()}
+_PART_REF_RE = re.compile(r"^\s*(" + "|".join(re.escape(label) for label in PART_LABELS.values())
+                          + r")\s+(?:No\.?\s*|#\s*)?([A-Z]|\d+)\s*$", re.IGNORECASE)
+_TERM_RE = re.compile(r"\w+")
+# Control characters around highlighted terms, so the text can be escaped before they become markup
+_MARK_START, _MARK_END = "\x02", "\x03"
+
+def builder_hash() -> str:
+    digest = hashlib.sha256()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in BUILDER_MODULES:
+        with open(os.path.join(base, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _part_number(record: dict) -> str:
+    if record['part'] in PART_LABELS and record['section']:
+        return str(record['section']).split('_')[-1].upper()
+    return None
+
+def build_clause_store(corpus, path: str = CLAUSE_STORE_PATH) -> dict:
+    """Write every clause of a corpus, with its full-text index, to a new store and move it into place"""
+    records = corpus_clauses(corpus)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+                ('content_hash', corpus.content_hash), ('builder_hash', builder_hash()),
+                ('built_at', str(time.time())),
+            ])
+            connection.executemany("INSERT INTO agreements (key, name, short_name) VALUES (?, ?, ?)", [
+                (key, corpus_module.AGREEMENT_NAMES[key], corpus_module.AGREEMENT_SHORT_NAMES.get(key, key))
+                for key in dict.fromkeys(record['agreement'] for record in records)
+            ])
+            # Row ids follow the clause positions every other index uses
+            connection.executemany(
+                "INSERT INTO clauses (id, clause_id, agreement, part, part_number, article, section, subsection, "
+                "title, text, citation) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(position + 1, record['id'], record['agreement'], record['part'], _part_number(record),
+                  record['article'], record['section'], record['subsection'], record['title'], record['text'],
+                  record['citation']) for position, record in enumerate(records)])
+            connection.execute("INSERT INTO clauses_fts (clauses_fts) VALUES ('rebuild')")
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    os.replace(tmp_path, path)
+    return {'path': path, 'content_hash': corpus.content_hash, 'clauses': len(records), 'bytes': os.path.getsize(path)}
+
+# ── Read-only access ───────────────────────────────────────────────────────────
+
+class ClauseStore:
+    """Read-only view of a built store, through a pool of connections shared by the process's threads"""
+
+    def __init__(self, path: str = CLAUSE_STORE_PATH, pool_size: int = CLAUSE_STORE_POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        with self.connection() as connection:
+            self.meta = dict(connection.execute("SELECT key, value FROM meta").fetchall())
+
+    @property
+    def content_hash(self) -> str:
+        return self.meta.get('content_hash')
+
+    def _open(self) -> sqlite3.Connection:
+        # The file is never changed in place (a rebuild replaces it), so it is opened immutable: no locking
+        uri = f"{Path(self.path).resolve().as_uri()}?mode=ro&immutable=1"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                opening = self._opened < self.pool_size
+                if opening:
+                    self._opened += 1
+            if opening:
+                try:
+                    connection = self._open()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _records(self, sql: str, parameters) -> list:
+        with self.connection() as connection:
+            rows = connection.execute(sql, parameters).fetchall()
+        return [dict(zip(RECORD_FIELDS, row)) for row in rows]
+
+    def clause(self, clause_id: str) -> dict:
+        records = self._records(f"SELECT {', '.join(RECORD_FIELDS)} FROM clauses WHERE clause_id = ?", (clause_id,))
+        return records[0] if records else None
+
+    def lookup(self, reference: str, agreement_keys) -> list:
+        """Clauses a citation names ("8.2", "Article 17.3(b)", "9.3.3", "Article 8", "Appendix A") in the given
+        agreements, in agreement order"""
+        keys = list(agreement_keys)
+        if not keys:
+            return []
+        in_keys = f"agreement IN ({', '.join('?' * len(keys))})"
+        match = _NUMBER_REF_RE.match(reference)
+        if match:
+            number, subsection = match.group(1), match.group(2)
+            if subsection:
+                where, parameters = "section = ? AND subsection = ?", [number, subsection.lower()]
+            elif '.' in number:
+                where, parameters = "(section = ? OR subsection = ?)", [number, number]
+            else:
+                where, parameters = "article = ?", [number]
+        else:
+            match = _PART_REF_RE.match(reference)
+            if not match:
+                return []
+            where, parameters = "part = ? AND part_number = ?", [_PART_OF_LABEL[match.group(1).lower()],
+                                                                  match.group(2).upper()]
+        records = self._records(f"SELECT {', '.join(RECORD_FIELDS)} FROM clauses WHERE {in_keys} AND {where} "
+                                f"ORDER BY id", keys + parameters)
+        order = {key: rank for rank, key in enumerate(keys)}
+        return sorted(records, key=lambda record: order[record['agreement']])
+
+    def search(self, query: str, agreement_keys, limit: int = CLAUSE_SEARCH_LIMIT) -> list:
+        """Clauses matching every word of a query (the last may be a prefix), best first; any word when none
+        match them all. Each hit is a clause record plus 'title_marked' and 'snippet' with the matched terms
+        between \\x02 and \\x03."""
+        terms = _TERM_RE.findall(query)
+        keys = list(agreement_keys)
+        if not terms or not keys:
+            return []
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += "*"
+        sql = (f"SELECT {', '.join('c.' + field for field in RECORD_FIELDS)}, "
+               f"highlight(clauses_fts, 0, '{_MARK_START}', '{_MARK_END}'), "
+               f"snippet(clauses_fts, 1, '{_MARK_START}', '{_MARK_END}', '…', {SNIPPET_WORDS}) "
+               f"FROM clauses_fts JOIN clauses c ON c.id = clauses_fts.rowid "
+               f"WHERE clauses_fts MATCH ? AND c.agreement IN ({', '.join('?' * len(keys))}) "
+               f"ORDER BY bm25(clauses_fts, {TITLE_WEIGHT}, 1.0) LIMIT ?")
+        with self.connection() as connection:
+            rows = connection.execute(sql, [" AND ".join(quoted)] + keys + [limit]).fetchall()
+            if not rows and len(quoted) > 1:
+                rows = connection.execute(sql, [" OR ".join(quoted)] + keys + [limit]).fetchall()
+        hits = []
+        for row in rows:
+            hit = dict(zip(RECORD_FIELDS, row))
+            hit['title_marked'], hit['snippet'] = row[len(RECORD_FIELDS)], row[len(RECORD_FIELDS) + 1]
+            hits.append(hit)
+        return hits
+
+def open_clause_store(expected_hash: str, path: str = CLAUSE_STORE_PATH) -> ClauseStore:
+    """Open the store if it exists and was built from the current agreement files and code"""
+    if not os.path.exists(path):
+        return None
+    try:
+        store = ClauseStore(path)
+    except sqlite3.Error:
+        return None
+    if store.content_hash != expected_hash or store.meta.get('builder_hash') != builder_hash():
+        store.close()
+        return None
+    return store
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_clause_store(corpus) -> ClauseStore:
+    """The process-wide store for a corpus, built first when missing or stale. None if it cannot be built
+    (read-only file system, SQLite without FTS5)."""
+    global _store
+    store = _store
+    if store is not None and store.content_hash == corpus.content_hash:
+        return store
+    with _store_lock:
+        if _store is not None and _store.content_hash == corpus.content_hash:
+            return _store
+        store = open_clause_store(corpus.content_hash)
+        if store is None:
+            try:
+                build_clause_store(corpus)
+            except (sqlite3.Error, OSError):
+                return None
+            store = open_clause_store(corpus.content_hash)
+        if store is not None:
+            _store = store
+        return store
+
+# ── UI ─────────────────────────────────────────────────────────────────────────
+
+def _marked_html(text: str) -> str:
+    return html.escape(text).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>").replace("\n", " ")
+
+def clause_search_results(corpus, query: str, agreement_keys, limit: int = CLAUSE_SEARCH_LIMIT) -> tuple:
+    """(caption, markdown) for the search box: the clauses a citation names, then keyword matches with the
+    matched words highlighted"""
+    started = time.perf_counter()
+    store = get_clause_store(corpus)
+    if store is None:
+        return "⚠️ Clause search is unavailable (the clause store could not be built)", ""
+    keys = [key for key in agreement_keys if key in corpus]
+    # A citation is looked up; anything else is searched for
+    named = store.lookup(query, keys)
+    hits = [] if named else store.search(query, keys, limit)
+    elapsed = (time.perf_counter() - started) * 1000
+    lines = []
+    for record in named:
+        text = record['text'] if len(record['text']) <= 600 else record['text'][:600].rsplit(' ', 1)[0] + " …"
+        lines.append(f"**{html.escape(record['citation'])}**  \n{_marked_html(text)}")
+    for hit in hits:
+        lines.append(f"**{html.escape(hit['citation'])}**  \n{_marked_html(hit['snippet'])}")
+    found = len(named) + len(hits)
+    caption = (f"🔎 {found} clause{'s' if found != 1 else ''}"
+               f"{f' ({len(named)} by citation)' if named else ''} in {elapsed:.1f} ms | no model call")
+    return caption, "\n\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the SQLite clause store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="write the store from the current agreement files")
+    search = subparsers.add_parser('search', help="look up a citation or search the clause text")
+    search.add_argument('query')
+    search.add_argument('--agreements', nargs='+', default=list(corpus_module.AGREEMENT_NAMES))
+    args = parser.parse_args()
+
+    corpus = corpus_module.get_corpus()
+    if args.command == 'build':
+        started = time.perf_counter()
+        info = build_clause_store(corpus)
+        print(f"Wrote {info['path']} ({info['bytes']:,} bytes, {info['clauses']:,} clauses, "
+              f"hash {info['content_hash'][:12]}) in {time.perf_counter() - started:.2f}s")
+        return
+    store = get_clause_store(corpus)
+    started = time.perf_counter()
+    records = store.lookup(args.query, args.agreements) or store.search(args.query, args.agreements)
+    elapsed = (time.perf_counter() - started) * 1000
+    for record in records:
+        snippet = record.get('snippet') or record['text'][:200]
+        print(f"{record['citation']}\n  {snippet.replace(_MARK_START, '[').replace(_MARK_END, ']')}")
+    print(f"{len(records)} clauses in {elapsed:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import sys
+import threading
+
+from corpus import AGREEMENT_SHORT_NAMES, load_all_agreements
+
+# ── Clause extraction ──────────────────────────────────────────────────────────
+#
+# A clause record is a flat, slotted record describing the smallest citable
+# unit of an agreement: a subsection where the section has them, otherwise a
+# section, otherwise a whole article / definition / appendix / letter.
+
+PART_LABELS = {
+    'appendices': 'Appendix',
+    'letters_of_understanding': 'Letter of Understanding',
+    'letters_of_agreement': 'Letter of Agreement',
+    'memoranda_of_agreement': 'Memorandum of Agreement',
+    'memorandum_of_understanding': 'Memorandum of Understanding',
+}
+
+def is_article_part(part_key: str) -> bool:
+    return part_key == 'articles' or part_key.startswith('articles_')
+
+def humanize(key: str) -> str:
+    return str(key).replace('_', ' ').strip()
+
+def flatten_text(value) -> str:
+    """Collapse a nested clause value into readable plain text"""
+    if isinstance(value, dict):
+        lines = []
+        for key, item in value.items():
+            if key == 'title':
+                continue
+            text = flatten_text(item)
+            if not text:
+                continue
+            if key in ('content', 'definition', 'text'):
+                lines.append(text)
+            elif len(key) <= 3:
+                lines.append(f"({key}) {text}")
+            else:
+                lines.append(f"{humanize(key).capitalize()}: {text}")
+        return "\n".join(lines)
+    if isinstance(value, list):
+        return "\n".join(f"- {flatten_text(item)}" for item in value)
+    return str(value) if value is not None else ""
+
+# Fields of a clause record, in the order they are stored and serialized
+CLAUSE_FIELDS = ('id', 'agreement', 'part', 'article', 'section', 'subsection', 'title', 'text', 'citation')
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Clause:
+    """A clause record. Read like the dicts it replaces (record['text'], record.get('title')), but slotted:
+    the agreement, part, article, section and subsection ids and the title are interned and shared by every
+    clause that carries them, the text is held once, and the id is derived from the ids rather than stored."""
+
+    __slots__ = ('agreement', 'part', 'article', 'section', 'subsection', 'title', 'text', 'citation')
+
+    def __init__(self, agreement: str, part: str, article: str, section: str, subsection: str,
+                 title: str, text: str, citation: str):
+        self.agreement = _intern(agreement)
+        self.part = _intern(part)
+        self.article = _intern(article)
+        self.section = _intern(section)
+        self.subsection = _intern(subsection)
+        self.title = _intern(title)
+        self.text = text
+        self.citation = citation
+
+    @property
+    def id(self) -> str:
+        ref = self.section or self.article or self.part
+        return f"{self.agreement}:{self.part}:{ref}" + (f"({self.subsection})" if self.subsection else "")
+
+    def __getitem__(self, field: str):
+        if field not in CLAUSE_FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field: str, default=None):
+        return getattr(self, field) if field in CLAUSE_FIELDS else default
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in CLAUSE_FIELDS}
+
+    @classmethod
+    def from_dict(cls, record: dict) -> 'Clause':
+        """A clause from its dict form (as serialized in the snapshot); the stored id is derived again"""
+        return cls(record['agreement'], record['part'], record['article'], record['section'], record['subsection'],
+                   record['title'], record['text'], record['citation'])
+
+    def __repr__(self) -> str:
+        return f"Clause({self.id!r})"
+
+def _record(agreement_key: str, part: str, article: str, section: str, subsection: str,
+            title: str, text: str, citation: str) -> Clause:
+    return Clause(agreement_key, part, article, section, subsection, title, text,
+                  f"[{AGREEMENT_SHORT_NAMES.get(agreement_key, agreement_key)} - {citation}]")
+
+def _article_clauses(agreement_key: str, part: str, number: str, article: dict):
+    article_title = article.get('title', '') if isinstance(article, dict) else ''
+    sections = article.get('sections') if isinstance(article, dict) else None
+    if not isinstance(sections, dict) or not sections:
+        yield _record(agreement_key, part, number, None, None, article_title,
+                      flatten_text(article), f"Article {number}: {article_title}".rstrip(': '))
+        return
+    for extra_key, extra in article.items():
+        if extra_key not in ('title', 'sections'):
+            yield _record(agreement_key, part, number, f"{number}-{extra_key}", None, article_title,
+                          flatten_text(extra), f"Article {number}: {article_title}")
+    for section_number, section in sections.items():
+        title = section.get('title', article_title) if isinstance(section, dict) else article_title
+        subsections = section.get('subsections') if isinstance(section, dict) else None
+        if isinstance(subsections, dict) and subsections:
+            lead = {k: v for k, v in section.items() if k not in ('title', 'subsections')}
+            if lead:
+                yield _record(agreement_key, part, number, section_number, None, title,
+                              flatten_text(lead), f"Article {section_number}: {title}")
+            for sub_key, sub in subsections.items():
+                if len(sub_key) <= 3:
+                    citation = f"Article {section_number}({sub_key}): {title}"
+                else:
+                    citation = f"Article {section_number}: {title} ({humanize(sub_key)})"
+                yield _record(agreement_key, part, number, section_number, sub_key, title,
+                              flatten_text(sub), citation)
+        else:
+            yield _record(agreement_key, part, number, section_number, None, title,
+                          flatten_text(section), f"Article {section_number}: {title}")
+
+def _definition_clauses(agreement_key: str, part: str, definitions):
+    if not isinstance(definitions, dict):
+        yield _record(agreement_key, part, None, None, None, 'Definitions',
+                      flatten_text(definitions), 'Definitions')
+        return
+    for key, value in definitions.items():
+        if isinstance(value, dict) and 'term' in value:
+            term = value['term']
+            text = flatten_text({k: v for k, v in value.items() if k != 'term'})
+        else:
+            term = humanize(key)
+            text = flatten_text(value)
+        yield _record(agreement_key, part, None, f"def-{key}", None, term, text, f'Definitions: "{term}"')
+
+def _part_clauses(agreement_key: str, part: str, data):
+    label = PART_LABELS.get(part)
+    if label and isinstance(data, dict):
+        for key, value in data.items():
+            title = value.get('title', humanize(key)) if isinstance(value, dict) else humanize(key)
+            number = str(key).split('_')[-1].upper()
+            yield _record(agreement_key, part, None, key, None, title,
+                          flatten_text(value), f"{label} {number}: {title}")
+        return
+    title = humanize(part).title()
+    if isinstance(data, dict):
+        for key, value in data.items():
+            sub_title = value.get('title', humanize(key)) if isinstance(value, dict) else humanize(key)
+            yield _record(agreement_key, part, None, key, None, sub_title,
+                          flatten_text(value), f"{title}: {sub_title}")
+    else:
+        yield _record(agreement_key, part, None, None, None, title, flatten_text(data), title)
+
+def iter_clauses(agreement_key: str, agreement: dict):
+    """Yield clause records for every citable unit of an agreement, in document order"""
+    for part, data in agreement.items():
+        if is_article_part(part) and isinstance(data, dict):
+            for number, article in data.items():
+                yield from _article_clauses(agreement_key, part, number, article)
+        elif part == 'definitions':
+            yield from _definition_clauses(agreement_key, part, data)
+        else:
+            yield from _part_clauses(agreement_key, part, data)
+
+def extract_clauses(agreements) -> list:
+    """Clause records for every loaded agreement"""
+    records = []
+    for key, agreement in agreements.items():
+        if agreement:
+            records.extend(iter_clauses(key, agreement))
+    return records
+
+def load_clauses() -> list:
+    """Clause records straight from the agreement JSON files"""
+    return extract_clauses(load_all_agreements())
+
+# ── Per-corpus clause list ─────────────────────────────────────────────────────
+
+_corpus_clauses = {}
+# Each agreement's records by (agreement key, agreement hash): a reload that changed one agreement extracts
+# that one again and keeps the others' records as they are
+_agreement_clauses = {}
+# Every index over a corpus refers to clauses by their position in this one list, so it is built once,
+# whichever index asks first
+_clauses_lock = threading.Lock()
+
+def corpus_clauses(corpus) -> list:
+    """Clause records for a corpus, read from the snapshot when one is loaded; built once per content hash"""
+    records = _corpus_clauses.get(corpus.content_hash)
+    if records is None:
+        with _clauses_lock:
+            records = _corpus_clauses.get(corpus.content_hash)
+            if records is None:
+                keys = [key for key in corpus.agreements if key in corpus]
+                by_agreement = {}
+                for key in keys:
+                    cache_key = (key, corpus.agreement_hash(key))
+                    agreement_records = _agreement_clauses.get(cache_key)
+                    if agreement_records is None:
+                        if corpus.snapshot is not None:
+                            agreement_records = list(corpus.snapshot.iter_clauses(key))
+                        else:
+                            agreement_records = list(iter_clauses(key, corpus.get(key)))
+                    by_agreement[cache_key] = agreement_records
+                records = [record for agreement_records in by_agreement.values() for record in agreement_records]
+                _agreement_clauses.clear()
+                _agreement_clauses.update(by_agreement)
+                _corpus_clauses.clear()
+                _corpus_clauses[corpus.content_hash] = records
+    return records
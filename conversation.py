@@ -0,0 +1,162 @@
+import os
+import re
+
+from llm import CACHE_CONTROL
+from tokens import estimate_tokens
+
+# ── Conversation memory ────────────────────────────────────────────────────────
+#
+# A follow-up is sent as a real multi-turn request: the most recent exchanges
+# go in full as earlier user/assistant turns, newest last, within a fixed token
+# budget. Exchanges that no longer fit are folded, once each, into a running
+# summary that keeps every section's opening line and the recommendation.
+# The summary has a budget of its own, and the oldest exchanges shrink to their
+# question and then drop out, so a follow-up costs about the same however long
+# the conversation runs. The earlier turns are the end of the cacheable prefix,
+# so the next follow-up reads them from the prompt cache.
+
+# Most tokens of recent exchanges sent in full (the last exchange is always sent)
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get('CONVERSATION_TOKEN_BUDGET', 6000))
+# Most tokens of the summary of older exchanges
+SUMMARY_TOKEN_BUDGET = int(os.environ.get('SUMMARY_TOKEN_BUDGET', 1000))
+
+SUMMARY_HEADING = "EARLIER IN THIS CONVERSATION (summary of exchanges no longer shown in full)"
+
+QUESTION_CHARS = 300
+SECTION_CHARS = 200
+# The last section of an analysis is its recommendation, so it keeps more
+LAST_SECTION_CHARS = 500
+
+_HEADING_RE = re.compile(r"(?m)^\s*\*\*(\d+\.\s*[^*\n]+)\*\*\s*$")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+def conversation_turns(messages: list) -> list:
+    """(question, answer) pairs of the completed exchanges, oldest first; a question left without an answer
+    (interrupted, or the one being asked now) is not an exchange"""
+    turns = []
+    question = None
+    for message in messages:
+        if message['role'] == 'user':
+            question = message['content']
+        elif question is not None and message['content'].strip():
+            turns.append((question, message['content']))
+            question = None
+    return turns
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    # Prefer ending at a sentence boundary within the limit
+    cut = text[:limit]
+    ends = [match.start() for match in _SENTENCE_END_RE.finditer(cut)]
+    return cut[:ends[-1]] if ends and ends[-1] > limit // 2 else cut.rsplit(' ', 1)[0] + "…"
+
+def _opening(text: str, limit: int) -> str:
+    """The first sentences of a passage, up to limit characters"""
+    text = re.sub(r"(?m)^\s*[-*•]\s*", "", text)
+    return _clip(text, limit)
+
+def digest_turn(number: int, question: str, answer: str) -> tuple:
+    """(full, brief) summaries of one exchange: the question with each section's opening and the
+    recommendation, and the question alone"""
+    brief = f"Exchange {number} — Q: {_clip(question, QUESTION_CHARS)}"
+    headings = list(_HEADING_RE.finditer(answer))
+    if headings:
+        lines = []
+        for position, heading in enumerate(headings):
+            end = headings[position + 1].start() if position + 1 < len(headings) else len(answer)
+            limit = LAST_SECTION_CHARS if position == len(headings) - 1 else SECTION_CHARS
+            lines.append(f"  {heading.group(1).strip()}: {_opening(answer[heading.end():end], limit)}")
+        body = "\n".join(lines)
+    else:
+        body = f"  {_opening(answer, SECTION_CHARS + LAST_SECTION_CHARS)}"
+    return f"{brief}\n  A:\n{body}", brief
+
+class ConversationMemory:
+    """The recent exchanges sent in full and the running summary of older ones, kept per session and
+    brought up to date incrementally: each exchange is sized and summarised only once"""
+
+    def __init__(self, token_budget: int = CONVERSATION_TOKEN_BUDGET, summary_budget: int = SUMMARY_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.turn_tokens = []
+        self.folded = 0
+        self.digests = []
+        self.omitted = 0
+
+    def _reset(self):
+        self.turn_tokens, self.folded, self.digests, self.omitted = [], 0, [], 0
+
+    def update(self, turns: list):
+        """Fold exchanges that no longer fit the budget into the summary"""
+        if len(turns) < len(self.turn_tokens):
+            # The conversation was restarted
+            self._reset()
+        for question, answer in turns[len(self.turn_tokens):]:
+            self.turn_tokens.append(estimate_tokens(question) + estimate_tokens(answer))
+        start, used = len(turns), 0
+        while start > self.folded and (start == len(turns) or used + self.turn_tokens[start - 1] <= self.token_budget):
+            start -= 1
+            used += self.turn_tokens[start]
+        for number in range(self.folded, start):
+            full, brief = digest_turn(number + 1, *turns[number])
+            self.digests.append({'full': full, 'brief': brief, 'short': False})
+        self.folded = max(self.folded, start)
+        self._fit_summary()
+
+    def _fit_summary(self):
+        # The oldest exchanges shrink to their question first, then drop out
+        while self.digests and estimate_tokens(self.summary) > self.summary_budget:
+            oldest = next((digest for digest in self.digests if not digest['short']), None)
+            if oldest is not None and oldest is not self.digests[-1]:
+                oldest['short'] = True
+            else:
+                self.digests.pop(0)
+                self.omitted += 1
+
+    @property
+    def summary(self) -> str:
+        if not self.digests and not self.omitted:
+            return ""
+        lines = [f"{SUMMARY_HEADING}:"]
+        if self.omitted:
+            lines.append(f"({self.omitted} earlier exchange{'s' if self.omitted != 1 else ''} omitted)")
+        lines.extend(digest['brief'] if digest['short'] else digest['full'] for digest in self.digests)
+        return "\n".join(lines)
+
+    def recent(self, turns: list) -> list:
+        return turns[self.folded:]
+
+    def messages(self, turns: list, user_message: str) -> list:
+        """The request's messages: the recent exchanges as earlier turns, then the new user message. The last
+        earlier turn ends the cacheable prefix."""
+        messages = []
+        for question, answer in self.recent(turns):
+            messages.append({"role": "user", "content": f"QUESTION / PROPOSAL: {question}"})
+            messages.append({"role": "assistant", "content": answer})
+        if messages:
+            messages[-1]["content"] = [{"type": "text", "text": messages[-1]["content"], "cache_control": CACHE_CONTROL}]
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def text(self, turns: list) -> str:
+        """Everything the conversation adds to a request, for sizing it"""
+        parts = [self.summary] if self.summary else []
+        for question, answer in self.recent(turns):
+            parts.append(f"QUESTION / PROPOSAL: {question}\n{answer}")
+        return "\n\n".join(parts)
+
+def get_conversation_memory(session_state) -> ConversationMemory:
+    if 'conversation_memory' not in session_state:
+        session_state.conversation_memory = ConversationMemory()
+    return session_state.conversation_memory
+
+def conversation_caption(memory: ConversationMemory, turns: list) -> str:
+    recent = len(memory.recent(turns))
+    caption = f"💬 Conversation: last {recent} exchange{'s' if recent != 1 else ''} in full"
+    summarised = memory.folded
+    if summarised:
+        caption += (f", {summarised} earlier summarised (~{estimate_tokens(memory.summary):,} tokens"
+                    f"{f', oldest {memory.omitted} omitted' if memory.omitted else ''})")
+    return caption
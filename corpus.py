@@ -0,0 +1,471 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from types import MappingProxyType
+
+# ── Agreement file layout ──────────────────────────────────────────────────────
+
+AGREEMENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agreements')
+
+BCGEU_LOCAL_FILES = [
+    'bcgeu_local/local-metadata-json.json',
+    'bcgeu_local/local-definitions-json.json',
+    'bcgeu_local/local-articles-1-10-json.json',
+    'bcgeu_local/local-articles-11-20-json.json',
+    'bcgeu_local/local-articles-21-30-json.json',
+    'bcgeu_local/local-articles-31-35-json.json',
+    'bcgeu_local/local-appendices-json.json',
+    'bcgeu_local/local-letters-of-agreement-json.json',
+    'bcgeu_local/local-memorandum-json.json'
+]
+
+BCGEU_SUPPORT_FILES = [
+    'bcgeu_support/definitions_json.json',
+    'bcgeu_support/articles_1_10_json.json',
+    'bcgeu_support/articles_11_20_json.json',
+    'bcgeu_support/articles_21_30_json.json',
+    'bcgeu_support/articles_31_36_json.json',
+    'bcgeu_support/appendices_json.json',
+    'bcgeu_support/memoranda_json.json'
+]
+
+# Display names used in rendered context headers and citations
+AGREEMENT_NAMES = {
+    'bcgeu_local':   "Coast Mountain College Local Agreement",
+    'bcgeu_common':  "BCGEU Common Agreement",
+    'bcgeu_support': "BCGEU Support Agreement",
+    'cupe_local':    "CUPE Local Agreement",
+    'cupe_common':   "CUPE Common Agreement",
+}
+
+AGREEMENT_SHORT_NAMES = {
+    'bcgeu_local':   "Local Agreement",
+    'bcgeu_common':  "Common Agreement",
+    'bcgeu_support': "Support Agreement",
+    'cupe_local':    "CUPE Local Agreement",
+    'cupe_common':   "CUPE Common Agreement",
+}
+
+CUPE_COMMON_URL = os.environ.get(
+    'CUPE_COMMON_URL',
+    "https://raw.githubusercontent.com/16880444c/V4/main/agreements/cupe_common/cupe_common.json"
+)
+
+# How often (seconds) the agreements folder is re-stated for changes
+RELOAD_CHECK_INTERVAL = 2.0
+# Watch the folder from a background thread, so an edit is loaded before the next question rather than by it
+CORPUS_WATCH = os.environ.get('CORPUS_WATCH', 'on').lower() not in ('0', 'off', 'false', 'no')
+# Compile the snapshot (snapshot.py) on load when it is missing or stale, so the corpus is served from it and
+# the app holds clause records only. Off, a snapshot compiled ahead of time is still used; without one the
+# app holds the nested agreements as well.
+CORPUS_SNAPSHOT = os.environ.get('CORPUS_SNAPSHOT', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+def agreement_path(relpath: str) -> str:
+    return os.path.join(AGREEMENTS_DIR, relpath)
+
+# Parsed agreement files by path, with the (mtime, size) they were parsed at. Loading an agreement again
+# after one of its split files changed re-parses that file only.
+_parsed_files = {}
+
+def _load_json(relpath: str) -> dict:
+    path = agreement_path(relpath)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    parsed = _parsed_files.get(relpath)
+    if parsed is not None and parsed[0] == stamp:
+        return parsed[1]
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    _parsed_files[relpath] = (stamp, data)
+    return data
+
+# ── Agreement loaders ──────────────────────────────────────────────────────────
+
+def load_split_local_agreement() -> dict:
+    """Load the local agreement from split JSON files"""
+    local_agreement = {}
+    for filename in BCGEU_LOCAL_FILES:
+        try:
+            local_agreement.update(_load_json(filename))
+        except Exception:
+            pass
+    return local_agreement
+
+def load_bcgeu_local_agreement() -> dict:
+    """Load the local agreement, falling back to complete_local.json if no split files load"""
+    local_agreement = load_split_local_agreement()
+    if not local_agreement:
+        try:
+            local_agreement = _load_json('bcgeu_local/complete_local.json')
+        except Exception:
+            return None
+    return local_agreement
+
+def load_bcgeu_common_agreement() -> dict:
+    """Load the BCGEU Common agreement from JSON file"""
+    try:
+        return _load_json('bcgeu_common/complete_common.json')
+    except Exception:
+        return None
+
+def load_bcgeu_support_agreement() -> dict:
+    """Load the BCGEU Support agreement from split JSON files"""
+    support_agreement = {}
+    for filename in BCGEU_SUPPORT_FILES:
+        try:
+            support_agreement.update(_load_json(filename))
+        except Exception:
+            pass
+    if not support_agreement:
+        try:
+            support_agreement = _load_json('bcgeu_support/bcgeu_support.json')
+        except Exception:
+            pass
+    return support_agreement if support_agreement else None
+
+def load_cupe_local_agreement() -> dict:
+    """Load the CUPE Local agreement from JSON file"""
+    try:
+        return _load_json('cupe_local/cupe_local.json')
+    except Exception:
+        return None
+
+_cupe_common_remote = None
+
+def cupe_common_remote():
+    """Disk-cached mirror of the CUPE Common agreement on GitHub"""
+    global _cupe_common_remote
+    if _cupe_common_remote is None:
+        from remote_cache import RemoteJSONCache
+        _cupe_common_remote = RemoteJSONCache(CUPE_COMMON_URL, 'cupe_common')
+    return _cupe_common_remote
+
+def load_cupe_common_agreement() -> dict:
+    """Load the CUPE Common agreement from local file, else from the background-refreshed remote cache"""
+    try:
+        return _load_json('cupe_common/cupe_common.json')
+    except Exception:
+        return cupe_common_remote().get()
+
+def remote_status_captions() -> list:
+    """Freshness captions for agreements currently served from a remote cache"""
+    if _cupe_common_remote is None or os.path.exists(agreement_path('cupe_common/cupe_common.json')):
+        return []
+    from remote_cache import status_caption
+    return [status_caption("CUPE Common Agreement", _cupe_common_remote)]
+
+AGREEMENT_LOADERS = {
+    'bcgeu_local':   load_bcgeu_local_agreement,
+    'bcgeu_common':  load_bcgeu_common_agreement,
+    'bcgeu_support': load_bcgeu_support_agreement,
+    'cupe_local':    load_cupe_local_agreement,
+    'cupe_common':   load_cupe_common_agreement,
+}
+
+def load_all_agreements() -> dict:
+    """Load every agreement that is available, keyed by agreement id"""
+    agreements = {}
+    for key, loader in AGREEMENT_LOADERS.items():
+        data = loader()
+        if data:
+            agreements[key] = data
+    return agreements
+
+# ── Shared corpus ──────────────────────────────────────────────────────────────
+#
+# One corpus per process, shared by every session. A background thread re-stats
+# the agreement files every few seconds; when one changes, only that file is
+# parsed again and only its agreement is rebuilt. The other agreements are
+# carried into the new corpus as the same objects, and the caches derived from
+# them are keyed by per-agreement hashes, so they stay valid. Sessions see the
+# new corpus on their next rerun.
+
+def agreements_fingerprint() -> tuple:
+    """Cheap change detector: (path, mtime, size) of every JSON file under agreements/"""
+    entries = []
+    for root, _, files in os.walk(AGREEMENTS_DIR):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((os.path.relpath(path, AGREEMENTS_DIR), st.st_mtime_ns, st.st_size))
+    # A remote-sourced agreement lives in the download cache; its arrival or refresh must reload too
+    if not os.path.exists(agreement_path('cupe_common/cupe_common.json')):
+        body_path = cupe_common_remote().body_path
+        try:
+            st = os.stat(body_path)
+            entries.append((os.path.relpath(body_path, AGREEMENTS_DIR), st.st_mtime_ns, st.st_size))
+        except OSError:
+            pass
+    return tuple(sorted(entries))
+
+def agreement_files(fingerprint: tuple) -> dict:
+    """Fingerprint entries by the agreement they belong to: the files in its folder, and for the CUPE Common
+    agreement the downloaded copy. Files in no agreement's folder are under None."""
+    groups = {}
+    for entry in fingerprint:
+        if entry[0].startswith(os.pardir):
+            key = 'cupe_common'
+        else:
+            key = entry[0].split(os.sep)[0]
+            key = key if key in AGREEMENT_LOADERS else None
+        groups.setdefault(key, []).append(entry)
+    return {key: tuple(entries) for key, entries in groups.items()}
+
+def _files_hash(entries) -> str:
+    """SHA-256 over the path and bytes of some of the files under agreements/"""
+    digest = hashlib.sha256()
+    for relpath, _, _ in entries:
+        digest.update(relpath.encode('utf-8') + b'\0')
+        try:
+            with open(agreement_path(relpath), 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            pass
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def combined_hash(hashes: dict) -> str:
+    """One hash for a set of agreement hashes"""
+    digest = hashlib.sha256()
+    for key in sorted(hashes, key=str):
+        digest.update(f"{key}\0{hashes[key]}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+def agreement_hashes(fingerprint: tuple = None) -> dict:
+    """SHA-256 over the path and bytes of each agreement's files"""
+    groups = agreement_files(fingerprint if fingerprint is not None else agreements_fingerprint())
+    return {key: _files_hash(entries) for key, entries in groups.items()}
+
+def content_hash() -> str:
+    """Hash of every JSON file under agreements/, as the combination of the agreements' hashes"""
+    return combined_hash(agreement_hashes())
+
+def deep_sizeof(obj, seen: set = None) -> int:
+    """Approximate memory held by a nested dict/list structure, counting shared objects once"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (dict, MappingProxyType)):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+    elif hasattr(type(obj), '__slots__'):
+        for name in type(obj).__slots__:
+            size += deep_sizeof(getattr(obj, name, None), seen)
+    return size
+
+class Corpus:
+    """Immutable snapshot of every loaded agreement, shared read-only by all sessions"""
+
+    def __init__(self, agreements, fingerprint: tuple, content_hash: str, snapshot=None, hashes: dict = None,
+                 changed: tuple = (), reparsed: int = 0):
+        self.agreements = MappingProxyType(agreements)
+        self.fingerprint = fingerprint
+        self.content_hash = content_hash
+        self.snapshot = snapshot
+        # Per-agreement content hashes; without them every agreement counts as changed with the corpus
+        self.hashes = hashes if hashes is not None else {key: content_hash for key in agreements}
+        # What the reload that made this corpus changed: agreement keys, and files parsed again
+        self.changed = changed
+        self.reparsed = reparsed
+        self.loaded_at = time.time()
+        self._nbytes = None
+        self._baseline_nbytes = None
+
+    def agreement_hash(self, key: str) -> str:
+        return self.hashes.get(key)
+
+    def agreements_hash(self, keys) -> str:
+        """Hash of some agreements' content, e.g. a selection's: it changes only when one of them does"""
+        return combined_hash({key: self.hashes.get(key) for key in keys})
+
+    def shared_objects(self) -> list:
+        """What every session reads from this corpus: its clause records, and the nested agreements when it
+        runs from JSON. A snapshot-backed corpus holds no nested agreements; they stay in the mapped file."""
+        from clauses import corpus_clauses
+        objects = [corpus_clauses(self)]
+        if self.snapshot is None:
+            objects.extend(self.agreements.values())
+        return objects
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the shared corpus"""
+        if self._nbytes is None:
+            self._nbytes = deep_sizeof(self.shared_objects())
+        return self._nbytes
+
+    @property
+    def baseline_nbytes(self) -> int:
+        """Memory one copy of the nested agreements takes, as load_all_agreements() returns them: what every
+        session held before the corpus was shared. From a snapshot they are decoded to measure, then dropped."""
+        if self._baseline_nbytes is None:
+            self._baseline_nbytes = deep_sizeof({key: self.get(key) for key in self.agreements if key in self})
+        return self._baseline_nbytes
+
+    def get(self, key: str) -> dict:
+        """The nested agreement. From a snapshot this decodes a new copy each call, so use `key in corpus`
+        to ask whether an agreement is loaded."""
+        return self.agreements.get(key)
+
+    def rendered_context(self, key: str) -> str:
+        """Pre-rendered context text from the snapshot, or None when running from JSON"""
+        if self.snapshot is None:
+            return None
+        return self.snapshot.context(key)
+
+    def __contains__(self, key: str) -> bool:
+        if self.snapshot is not None:
+            return key in self.snapshot.keys()
+        return bool(self.agreements.get(key))
+
+_corpus = None
+_corpus_lock = threading.Lock()
+_last_check = 0.0
+_watcher = None
+
+def get_corpus() -> Corpus:
+    """Return the process-wide corpus, reloading it if any file under agreements/ changed"""
+    if CORPUS_WATCH:
+        _start_watcher()
+    now = time.monotonic()
+    if _corpus is not None and now - _last_check < RELOAD_CHECK_INTERVAL:
+        return _corpus
+    return reload_corpus()
+
+def reload_corpus() -> Corpus:
+    """Re-stat the agreements folder and swap in a new corpus if anything changed. Agreements whose files
+    did not change are carried over as they are, so only the changed one is parsed and re-indexed."""
+    global _corpus, _last_check
+    with _corpus_lock:
+        _last_check = time.monotonic()
+        fingerprint = agreements_fingerprint()
+        if _corpus is None or fingerprint != _corpus.fingerprint:
+            _corpus = load_corpus(fingerprint, previous=_corpus)
+        return _corpus
+
+def _watch():
+    while True:
+        time.sleep(RELOAD_CHECK_INTERVAL)
+        try:
+            reload_corpus()
+        except Exception:
+            # A file caught half-written fails to parse; the next check picks it up once it is complete
+            pass
+
+def _start_watcher():
+    global _watcher
+    if _watcher is None:
+        with _corpus_lock:
+            if _watcher is None:
+                _watcher = threading.Thread(target=_watch, name="corpus-watcher", daemon=True)
+                _watcher.start()
+
+def load_corpus(fingerprint: tuple = None, previous: Corpus = None) -> Corpus:
+    """Build a corpus from the compiled snapshot, compiling it first when it is stale, else (snapshots off, or
+    the folder not writable) from the JSON files. Given the corpus it replaces, agreements whose files are
+    unchanged are reused (and not re-hashed or re-read)."""
+    if fingerprint is None:
+        fingerprint = agreements_fingerprint()
+    groups = agreement_files(fingerprint)
+    old_groups = agreement_files(previous.fingerprint) if previous is not None else {}
+    hashes = {key: previous.hashes[key] if old_groups.get(key) == entries and key in previous.hashes
+              else _files_hash(entries) for key, entries in groups.items()}
+    digest = combined_hash(hashes)
+    changed = tuple(key for key in AGREEMENT_LOADERS
+                    if previous is not None and hashes.get(key) != previous.hashes.get(key))
+    import snapshot
+    snap = snapshot.open_snapshot(digest)
+    reparsed = 0
+    if snap is None and CORPUS_SNAPSHOT:
+        try:
+            snap, compiled = snapshot.compile_snapshot(hashes)
+        except OSError:
+            snap = None
+        else:
+            reparsed = sum(len(groups.get(key, ())) for key in compiled) if previous is not None else 0
+            # The snapshot holds what was parsed for it; keeping the parsed files too would hold the nested
+            # agreements it is there to replace
+            _parsed_files.clear()
+    if snap is not None:
+        return Corpus(snap.agreements(), fingerprint, digest, snapshot=snap, hashes=hashes, changed=changed,
+                      reparsed=reparsed)
+    parsed_before = {relpath: parsed[0] for relpath, parsed in _parsed_files.items()}
+    agreements = {}
+    for key, loader in AGREEMENT_LOADERS.items():
+        data = previous.get(key) if previous is not None and key not in changed else loader()
+        if data:
+            agreements[key] = data
+    reparsed = sum(1 for relpath, parsed in _parsed_files.items()
+                   if previous is not None and parsed_before.get(relpath) != parsed[0])
+    return Corpus(agreements, fingerprint, digest, hashes=hashes, changed=changed, reparsed=reparsed)
+
+def session_memory_bytes(session_state, corpus: Corpus) -> int:
+    """Memory held privately by one session, excluding the shared corpus it references"""
+    seen = {id(corpus), id(corpus.agreements)}
+    for shared in corpus.shared_objects():
+        seen.add(id(shared))
+        if isinstance(shared, list):
+            seen.update(id(record) for record in shared)
+    total = 0
+    for key in list(session_state.keys()):
+        total += deep_sizeof(session_state[key], seen)
+    return total
+
+def format_bytes(n: int) -> str:
+    if n >= 1024 * 1024:
+        return f"{n / (1024 * 1024):.1f} MB"
+    if n >= 1024:
+        return f"{n / 1024:.1f} KB"
+    return f"{n} B"
+
+# Sessions that showed the memory figure recently, by session id: the ones that would each hold a copy of the
+# agreements if the corpus were not shared
+SESSION_ACTIVE_SECONDS = 30 * 60
+_active_sessions = {}
+_active_sessions_lock = threading.Lock()
+
+def active_sessions(session_state) -> int:
+    """Count this session as active and return how many sessions were active in the last half hour"""
+    from llm import session_id
+    now = time.monotonic()
+    with _active_sessions_lock:
+        _active_sessions[session_id(session_state)] = now
+        for stale in [key for key, seen in _active_sessions.items() if now - seen > SESSION_ACTIVE_SECONDS]:
+            del _active_sessions[stale]
+        return len(_active_sessions)
+
+def memory_caption(session_state, corpus: Corpus) -> str:
+    """One-line memory figure: the shared corpus against every active session holding its own copy of the
+    agreements, as each did before they were shared"""
+    session_bytes = session_memory_bytes(session_state, corpus)
+    source = "memory-mapped snapshot" if corpus.snapshot is not None else "JSON"
+    sessions = active_sessions(session_state)
+    saved = corpus.baseline_nbytes * sessions - corpus.nbytes
+    per_session = f"{sessions} per-session cop{'ies' if sessions != 1 else 'y'}"
+    comparison = (f"Saved vs. {per_session}: {format_bytes(saved)}" if saved >= 0
+                  else f"{format_bytes(-saved)} more than {per_session}")
+    return (f"🧠 Shared corpus: {format_bytes(corpus.nbytes)} (loaded once per server process from {source}) | "
+            f"This session: {format_bytes(session_bytes)} | {comparison}")
+
+def reload_caption(corpus: Corpus) -> str:
+    """What the last reload of the agreement files changed, or None if the corpus has not been reloaded"""
+    if not corpus.changed:
+        return None
+    names = ", ".join(AGREEMENT_SHORT_NAMES.get(key, key) for key in corpus.changed)
+    files = f"{corpus.reparsed} file{'s' if corpus.reparsed != 1 else ''} re-read"
+    return (f"🔄 Agreements updated at {time.strftime('%H:%M:%S', time.localtime(corpus.loaded_at))}: {names} "
+            f"changed ({files}) | other agreements and their cached text kept")
@@ -0,0 +1,209 @@
+import os
+import re
+import threading
+
+from clauses import PART_LABELS, corpus_clauses, is_article_part
+from render import SELECTION_AGREEMENTS
+from retrieval import format_clause, format_retrieved_context
+from tokens import estimate_tokens
+
+# ── Cross-reference graph ──────────────────────────────────────────────────────
+#
+# Clauses lean on each other ("pursuant to Article 12.3", "Appendix A", a term
+# from the Definitions). The graph maps each clause to the clauses it refers to,
+# parsed once per corpus content hash, so a retrieved clause set can be
+# expanded with what it depends on before it is sent.
+
+# Extra agreement text allowed for referenced clauses, on top of the retrieval budget
+XREF_TOKEN_BUDGET = int(os.environ.get('XREF_TOKEN_BUDGET', 3000))
+XREF_MAX_DEPTH = 2
+# Defined terms used in more than this share of an agreement's clauses ("employee",
+# "employer") say nothing about a particular clause and are not linked
+DEFINITION_MAX_SHARE = 0.08
+
+_NUMBER = r"\d+(?:\.\d+)*(?:\s*\([a-z0-9]{1,3}\))*"
+_ARTICLE_REF_RE = re.compile(
+    rf"\b(?:Articles?|Clauses?|Sections?)\s+({_NUMBER}(?:\s*(?:,|and|or|to|&)\s*{_NUMBER})*)", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"(\d+(?:\.\d+)*)(?:\s*\(([a-z0-9]{1,3})\))?", re.IGNORECASE)
+# "Section 15 of the Labour Relations Code" points outside the agreement
+_STATUTE_RE = re.compile(r"\s*(?:\([a-z0-9]{1,3}\)\s*)*of\s+the\s+[\w\s,'-]{0,60}?\b(?:Act|Code|Regulations?)\b")
+_PART_REF_RE = re.compile(
+    r"\b(Appendix|Letter of Understanding|Letter of Agreement|Memorandum of Agreement|Memorandum of Understanding)"
+    r"\s+(?:No\.?\s*|#\s*)?([A-Z]\b|\d+)")
+_PART_OF_LABEL = {label: part for part, label in PART_LABELS.items()}
+# Words that introduce a reference rather than use a defined term
+_REFERENCE_WORDS = frozenset({'article', 'clause', 'section', 'appendix', 'schedule'})
+
+# Edge strengths, expanded in this order: a pinpoint citation ("Clause 8.4(b)", "Appendix A")
+# before a defined term before a reference to a whole article ("Article 8")
+CITATION, DEFINITION, WHOLE_ARTICLE = 0, 1, 2
+
+def _partners() -> dict:
+    """Agreements that are read together (a local and its common agreement) resolve each other's references"""
+    partners = {}
+    for keys in SELECTION_AGREEMENTS.values():
+        for key in keys:
+            partners.setdefault(key, [key])
+            partners[key].extend(other for other in keys if other not in partners[key])
+    return partners
+
+class CrossReferenceGraph:
+    """Directed edges from each clause position to the (position, strength) of the clauses it references"""
+
+    def __init__(self, records: list):
+        self.records = records
+        self.positions = {record['id']: position for position, record in enumerate(records)}
+        self._sections = {}
+        self._articles = {}
+        self._parts = {}
+        for position, record in enumerate(records):
+            key = record['agreement']
+            # Only articles are cited by number: appendices and letters are numbered too ("Appendix 1")
+            if is_article_part(record['part']) and record['section']:
+                self._sections.setdefault((key, record['section']), []).append(position)
+                if record['subsection']:
+                    self._sections.setdefault((key, record['section'], record['subsection']), []).append(position)
+            if record['article']:
+                self._articles.setdefault((key, record['article']), []).append(position)
+            if record['part'] in PART_LABELS and record['section']:
+                number = str(record['section']).split('_')[-1].upper()
+                self._parts.setdefault((key, record['part'], number), []).append(position)
+        definitions = self._definition_patterns()
+        partners = _partners()
+        self.edges = [self._parse(position, record, partners.get(record['agreement'], [record['agreement']]), definitions)
+                      for position, record in enumerate(records)]
+
+    def _definition_patterns(self) -> dict:
+        """Per agreement: one alternation regex over its defined terms, and term -> definition position"""
+        terms = {}
+        for position, record in enumerate(self.records):
+            title = record['title']
+            if record['part'] == 'definitions' and title and len(title) > 2 and title.lower() not in _REFERENCE_WORDS:
+                terms.setdefault(record['agreement'], {}).setdefault(title.lower(), position)
+        patterns = {}
+        for key, by_term in terms.items():
+            pattern = re.compile(r"\b(" + "|".join(re.escape(term) for term in sorted(by_term, key=len, reverse=True))
+                                 + r")s?\b", re.IGNORECASE)
+            clause_count = sum(1 for record in self.records if record['agreement'] == key)
+            usage = {}
+            for record in self.records:
+                if record['agreement'] == key:
+                    for term in {match.group(1).lower() for match in pattern.finditer(record['text'])}:
+                        usage[term] = usage.get(term, 0) + 1
+            useful = {term: position for term, position in by_term.items()
+                      if usage.get(term, 0) <= DEFINITION_MAX_SHARE * clause_count}
+            patterns[key] = (pattern, useful)
+        return patterns
+
+    def _resolve_number(self, keys: list, number: str, subsection: str) -> tuple:
+        """(strength, positions) for a numbered reference, looked up in the clause's own agreement first"""
+        for key in keys:
+            if subsection and (key, number, subsection) in self._sections:
+                return CITATION, self._sections[(key, number, subsection)]
+            if (key, number) in self._sections:
+                return CITATION, self._sections[(key, number)]
+            # "9.3.5" where the agreement numbers 9.3's subsections in full
+            if '.' in number and (key, number.rsplit('.', 1)[0], number) in self._sections:
+                return CITATION, self._sections[(key, number.rsplit('.', 1)[0], number)]
+            if '.' not in number and (key, number) in self._articles:
+                return WHOLE_ARTICLE, self._articles[(key, number)]
+        # "9.3.3" where only 9.3 is citable: fall back to the enclosing section
+        if number.count('.') > 1:
+            return self._resolve_number(keys, number.rsplit('.', 1)[0], None)
+        return CITATION, []
+
+    def citations(self, text: str, keys: list) -> list:
+        """(strength, position) of every clause a text cites by number or part ("Clause 8.4(b)", "Appendix A"),
+        in the order cited, looked up in the agreements of keys in turn"""
+        targets = []
+        for match in _ARTICLE_REF_RE.finditer(text):
+            if _STATUTE_RE.match(text, match.end()):
+                continue
+            for number, subsection in _NUMBER_RE.findall(match.group(1)):
+                strength, found = self._resolve_number(keys, number, subsection.lower() or None)
+                targets.extend((strength, target) for target in found)
+        for match in _PART_REF_RE.finditer(text):
+            part = _PART_OF_LABEL[match.group(1)]
+            for key in keys:
+                found = self._parts.get((key, part, match.group(2).upper()))
+                if found:
+                    targets.extend((CITATION, target) for target in found)
+                    break
+        return targets
+
+    def _parse(self, position: int, record: dict, keys: list, definitions: dict) -> tuple:
+        text = record['text']
+        targets = self.citations(text, keys)
+        for key in keys:
+            if key not in definitions:
+                continue
+            pattern, useful = definitions[key]
+            terms = dict.fromkeys(match.group(1).lower() for match in pattern.finditer(text))
+            targets.extend((DEFINITION, useful[term]) for term in terms if term in useful)
+            break
+        edges = {}
+        for strength, target in targets:
+            if target != position and strength < edges.get(target, WHOLE_ARTICLE + 1):
+                edges[target] = strength
+        return tuple(sorted(edges.items(), key=lambda edge: edge[1]))
+
+    def references(self, record: dict) -> list:
+        """Clause records directly referenced by a clause"""
+        return [self.records[target] for target, _ in self.edges[self.positions[record['id']]]]
+
+    def expand(self, records: list, agreement_keys, token_budget: int = XREF_TOKEN_BUDGET,
+               max_depth: int = XREF_MAX_DEPTH, known=()) -> list:
+        """Clauses referenced by a clause set (breadth-first, nearest first) that fit the token budget.
+        Clauses in known are already sent: they are not added again, nor followed."""
+        allowed = set(agreement_keys)
+        frontier = sorted(self.positions[record['id']] for record in records)
+        seen = set(frontier) | {self.positions[record['id']] for record in known}
+        added = []
+        used = 0
+        for _ in range(max_depth):
+            next_frontier = []
+            for level in (CITATION, DEFINITION, WHOLE_ARTICLE):
+                for position in frontier:
+                    for target, strength in self.edges[position]:
+                        if strength != level or target in seen or self.records[target]['agreement'] not in allowed:
+                            continue
+                        seen.add(target)
+                        cost = estimate_tokens(format_clause(self.records[target]))
+                        if used + cost > token_budget:
+                            continue
+                        used += cost
+                        added.append(self.records[target])
+                        next_frontier.append(target)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return added
+
+_graphs = {}
+_graph_lock = threading.Lock()
+
+def get_reference_graph(corpus) -> CrossReferenceGraph:
+    """The cross-reference graph for a corpus, built once per content hash and shared process-wide"""
+    graph = _graphs.get(corpus.content_hash)
+    if graph is None:
+        with _graph_lock:
+            graph = _graphs.get(corpus.content_hash)
+            if graph is None:
+                graph = CrossReferenceGraph(corpus_clauses(corpus))
+                _graphs.clear()
+                _graphs[corpus.content_hash] = graph
+    return graph
+
+def with_cross_references(corpus, selection_key: str, context: str, records, token_budget: int = XREF_TOKEN_BUDGET,
+                          known=()):
+    """Add the clauses a retrieved set refers to, within a budget, leaving out those in known (already sent).
+    Full-text context (records None) is returned as is. Returns (context, records, referenced records)."""
+    if records is None:
+        return context, records, []
+    agreement_keys = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    graph = get_reference_graph(corpus)
+    referenced = graph.expand(records, agreement_keys, token_budget, known=known)
+    if not referenced:
+        return context, records, []
+    merged = sorted(records + referenced, key=lambda record: graph.positions[record['id']])
+    return format_retrieved_context(merged, agreement_keys), merged, referenced
@@ -0,0 +1,163 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from corpus import AGREEMENT_NAMES
+from llm import ResponseStream, cached_system, record_usage
+from scheduler import WAIT_POLL_INTERVAL
+from tokens import estimate_tokens
+
+# ── Map-reduce fan-out ─────────────────────────────────────────────────────────
+#
+# A context over the limit (both agreements in full, or one very long one) is
+# not sent as one huge prompt. It is split per agreement, and further at section
+# boundaries when one agreement alone is over the limit. Every part is reviewed
+# for the question in its own request, all at once, and the answer is then
+# written from the extracted provisions. The part reviews run in parallel and
+# each reads a prompt no larger than a single agreement, so the wait is close
+# to that of a single-agreement question.
+
+FAN_OUT_TOKEN_LIMIT = int(os.environ.get('FAN_OUT_TOKEN_LIMIT', 50000))
+MAP_MAX_TOKENS = 2000
+
+MAP_SYSTEM_PROMPT = """You are a collective agreement analyst preparing notes for a colleague who will answer a question using several parts of the agreements at once. You are given ONE part: {label}.
+
+From this part only, extract every provision that bears on the question:
+- Quote the operative language verbatim
+- Give its exact citation in the form [Agreement Type - Article X.X: Title] or [Agreement Type - Clause X.X]
+- Include definitions, time limits, exceptions and cross-referenced clauses the provision depends on
+
+Do not answer the question or give advice; your colleague will. Be complete but do not pad. If nothing in this part bears on the question, reply only: No relevant provisions in this part."""
+
+NOTES_HEADING = ("RELEVANT PROVISIONS EXTRACTED FROM THE AGREEMENT TEXT (each part of the agreements was reviewed "
+                 "separately for this question; quotes and citations are verbatim from the agreement)")
+
+_AGREEMENT_START_RE = re.compile(r"(?m)^(?==== .+ ===\n)")
+_SECTION_START_RE = re.compile(r"(?=\n[^\n]+:\n={50}\n)")
+_NAME_OF_HEADING = {name.upper(): name for name in AGREEMENT_NAMES.values()}
+
+def needs_fan_out(context: str, token_limit: int = FAN_OUT_TOKEN_LIMIT) -> bool:
+    return estimate_tokens(context) > token_limit
+
+def _pack(blocks: list, token_limit: int) -> list:
+    """Concatenate consecutive blocks into chunks of at most token_limit (a single larger block is split by line)"""
+    chunks = []
+    current = []
+    used = 0
+    for block in blocks:
+        cost = estimate_tokens(block)
+        if cost > token_limit and '\n' in block.strip('\n'):
+            chunks.extend(_pack(block.splitlines(keepends=True), token_limit))
+            continue
+        if current and used + cost > token_limit:
+            chunks.append("".join(current))
+            current, used = [], 0
+        current.append(block)
+        used += cost
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def split_context(context: str, token_limit: int = FAN_OUT_TOKEN_LIMIT) -> list:
+    """(label, text) parts of a context: one per agreement, split at section boundaries when an agreement
+    is over the limit. Works on full text and on retrieved clauses alike."""
+    parts = []
+    for text in _AGREEMENT_START_RE.split(context):
+        if not text.strip():
+            continue
+        heading = text.split('\n', 1)[0].strip('= ').split(' — ')[0]
+        name = _NAME_OF_HEADING.get(heading, heading.title())
+        chunks = _pack(_SECTION_START_RE.split(text), token_limit)
+        for number, chunk in enumerate(chunks, 1):
+            parts.append((name + (f" (part {number} of {len(chunks)})" if len(chunks) > 1 else ""), chunk))
+    return parts
+
+class FanOutResult:
+    """The merged notes from every part review, ready to stand in for the agreement text"""
+
+    def __init__(self, labels: list, notes: list, usages: list, seconds: float):
+        self.labels = labels
+        self.notes = notes
+        self.usages = usages
+        self.seconds = seconds
+
+    @property
+    def context(self) -> str:
+        return "".join(f"=== {label.upper()} — RELEVANT PROVISIONS ===\n\n{note.strip()}\n\n"
+                       for label, note in zip(self.labels, self.notes))
+
+    @property
+    def agreement_block(self) -> str:
+        return f"{NOTES_HEADING}:\n{self.context}"
+
+def _review_part(client, session: str, model: str, label: str, text: str, question: str, cancelled: threading.Event):
+    stream = ResponseStream(
+        client,
+        session=session,
+        model=model,
+        max_tokens=MAP_MAX_TOKENS,
+        system=cached_system(MAP_SYSTEM_PROMPT.format(label=label), f"AGREEMENT TEXT — {label.upper()}:\n{text}"),
+        messages=[{"role": "user", "content": f"QUESTION: {question}"}],
+    )
+    chunks = iter(stream)
+    try:
+        for _ in chunks:
+            if cancelled.is_set():
+                break
+    finally:
+        # Leaving the stream closes its HTTP response, so a cancelled review stops generating
+        chunks.close()
+    return stream.text, stream.usage
+
+def fan_out(client, session: str, model: str, context: str, question: str, token_limit: int = FAN_OUT_TOKEN_LIMIT,
+            on_progress=None) -> FanOutResult:
+    """Review every part of an oversized context in parallel and merge the extracted provisions.
+
+    Each review is an ordinary request through the shared scheduler, so it is queued and retried like any
+    other. on_progress(done, total) is called from the calling thread while waiting; if it raises (the
+    user left the page), the reviews still running are stopped and the exception propagates."""
+    started = time.perf_counter()
+    parts = split_context(context, token_limit)
+    cancelled = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max(1, len(parts)), thread_name_prefix='fan-out')
+    try:
+        futures = [executor.submit(_review_part, client, session, model, label, text, question, cancelled)
+                   for label, text in parts]
+        pending = set(futures)
+        while pending:
+            if on_progress is not None:
+                on_progress(len(futures) - len(pending), len(futures))
+            _, pending = wait(pending, timeout=WAIT_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+        if on_progress is not None:
+            on_progress(len(futures), len(futures))
+        results = [future.result() for future in futures]
+    except BaseException:
+        cancelled.set()
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return FanOutResult([label for label, _ in parts], [text for text, _ in results],
+                        [usage for _, usage in results], time.perf_counter() - started)
+
+def record_fan_out(session_state, result: FanOutResult):
+    """Add the part reviews' token usage to the session totals and keep a summary for the UI"""
+    for usage in result.usages:
+        if usage is not None:
+            record_usage(session_state, usage)
+    session_state.last_fan_out = {'parts': len(result.labels), 'seconds': result.seconds}
+
+def fan_out_notice(placeholder):
+    """An on_progress callback that shows the part reviews' progress in a Streamlit placeholder"""
+    def on_progress(done: int, total: int):
+        if done < total:
+            placeholder.info(f"📑 The agreement text is too long for one request: reviewing it in {total} parts "
+                             f"in parallel ({done} of {total} done)…")
+        else:
+            placeholder.empty()
+    return on_progress
+
+def fan_out_caption(fan_out_stats: dict) -> str:
+    return (f"🔀 Reviewed in {fan_out_stats['parts']} parallel parts ({fan_out_stats['seconds']:.1f}s), "
+            f"then answered from the extracted provisions")
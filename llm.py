@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+import uuid
+
+import anthropic
+
+from scheduler import MAX_ATTEMPTS, RETRYABLE_ERRORS, estimate_request_tokens, get_scheduler, partial_usage, retry_delay
+
+# ── Shared client ──────────────────────────────────────────────────────────────
+#
+# One client per API key for the whole server process, shared by every session
+# and code path. Its connection pool keeps HTTP keep-alive connections (and
+# their TLS sessions) open between questions instead of paying connection setup
+# on every request.
+
+MAX_CONNECTIONS = int(os.environ.get('ANTHROPIC_MAX_CONNECTIONS', 20))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('ANTHROPIC_MAX_KEEPALIVE', 10))
+KEEPALIVE_EXPIRY = 120.0
+# Reads are bounded per chunk, so a long streamed answer is fine while a stalled one is not
+CLIENT_TIMEOUT = anthropic.Timeout(connect=5.0, read=120.0, write=30.0, pool=30.0)
+# The SDK retries connection errors, 408/409/429 and 5xx with exponential backoff, honouring retry-after
+MAX_RETRIES = int(os.environ.get('ANTHROPIC_MAX_RETRIES', 3))
+
+_clients = {}
+_client_lock = threading.Lock()
+
+def new_client(api_key: str, base_url: str = None) -> anthropic.Anthropic:
+    """A client with the tuned pool, timeouts and retry policy"""
+    # The Limits type of the HTTP library the installed SDK is built on
+    limits = type(anthropic.DEFAULT_CONNECTION_LIMITS)(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    return anthropic.Anthropic(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=MAX_RETRIES,
+        timeout=CLIENT_TIMEOUT,
+        http_client=anthropic.DefaultHttpxClient(limits=limits, timeout=CLIENT_TIMEOUT),
+    )
+
+def get_client(api_key: str) -> anthropic.Anthropic:
+    """The process-wide client for an API key, created on first use"""
+    client = _clients.get(api_key)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                client = new_client(api_key)
+                _clients[api_key] = client
+    return client
+
+# ── Prompt layout ──────────────────────────────────────────────────────────────
+#
+# Requests put everything that repeats from one question to the next first:
+# the system prompt, then the agreement text, with a cache breakpoint after the
+# agreement. What changes per question (follow-up notes, conversation, the
+# question itself) comes after it, so a repeat question on the same selection
+# reads the prefix from the prompt cache instead of re-processing it.
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+def cached_system(system_prompt: str, agreement_block, suffix: str = "") -> list:
+    """System blocks with the agreement text marked as the end of the cacheable prefix. The agreement text
+    may be a list of blocks (a follow-up's clauses already sent, then those it adds): the API looks for a
+    cached prefix at each block boundary, so the part an earlier request sent is read from the cache."""
+    agreement_blocks = [agreement_block] if isinstance(agreement_block, str) else list(agreement_block)
+    blocks = [{"type": "text", "text": system_prompt}] + [{"type": "text", "text": text} for text in agreement_blocks]
+    blocks[-1]["cache_control"] = CACHE_CONTROL
+    if suffix:
+        blocks.append({"type": "text", "text": suffix})
+    return blocks
+
+# ── Usage and cache statistics ─────────────────────────────────────────────────
+
+USAGE_FIELDS = ('input_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens', 'output_tokens')
+
+def usage_stats(usage) -> dict:
+    """Token counts from a response's usage block; cache fields are 0 when the API omits them"""
+    return {field: getattr(usage, field, None) or 0 for field in USAGE_FIELDS}
+
+def record_usage(session_state, usage) -> dict:
+    """Store the last request's usage and add it to the session totals"""
+    stats = usage_stats(usage)
+    session_state.last_usage = stats
+    totals = session_state.get('usage_totals') or dict.fromkeys(USAGE_FIELDS, 0)
+    session_state.usage_totals = {field: totals.get(field, 0) + stats[field] for field in USAGE_FIELDS}
+    return stats
+
+def _cached_share(stats: dict) -> float:
+    prompt = stats['input_tokens'] + stats['cache_creation_input_tokens'] + stats['cache_read_input_tokens']
+    return stats['cache_read_input_tokens'] / prompt if prompt else 0.0
+
+def cache_caption(session_state) -> str:
+    """One-line prompt-cache summary of the last request, with the session's running share"""
+    stats = session_state.last_usage
+    if stats['cache_read_input_tokens']:
+        status = f"⚡ Prompt cache hit: {stats['cache_read_input_tokens']:,} tokens read from cache"
+    elif stats['cache_creation_input_tokens']:
+        status = f"🧊 Prompt cache miss: {stats['cache_creation_input_tokens']:,} tokens written to cache"
+    else:
+        status = "🧊 Prompt not cached"
+    totals = session_state.get('usage_totals') or stats
+    return (f"{status} | {stats['input_tokens']:,} uncached input, {stats['output_tokens']:,} output tokens"
+            f" | Session: {_cached_share(totals):.0%} of prompt tokens served from cache")
+
+# ── Streaming ──────────────────────────────────────────────────────────────────
+#
+# Answers are streamed into the chat as they are generated. Leaving the
+# iteration early (the Stop button, or any interaction that reruns the script
+# mid-answer) exits the stream's context manager, which closes the HTTP
+# response so the API stops generating.
+
+STOPPED_NOTE = "\n\n*⏹️ Stopped before the answer was complete.*"
+
+class ResponseStream:
+    """The text of one streamed response, yielded as it arrives, with its timing and usage.
+
+    The request waits its turn in the process-wide scheduler first; a rate-limit,
+    overload or connection error before any text has arrived pauses the queue and
+    the request is retried."""
+
+    def __init__(self, client, session: str = None, on_wait=None, **request):
+        self.client = client
+        self.session = session
+        self.on_wait = on_wait
+        self.request = request
+        self.parts = []
+        self.queued_seconds = 0.0
+        self.first_token_seconds = None
+        self.total_seconds = None
+        self.usage = None
+        self.completed = False
+        self.attempts = 0
+
+    def __iter__(self):
+        started = time.perf_counter()
+        scheduler = get_scheduler()
+        # Retries are the scheduler's job, so they are coordinated across sessions
+        client = self.client.with_options(max_retries=0)
+        input_tokens = estimate_request_tokens(self.request)
+        try:
+            while True:
+                self.attempts += 1
+                waiting_since = time.perf_counter()
+                ticket = scheduler.acquire(self.session, input_tokens, self.request.get('max_tokens', 0), self.on_wait)
+                self.queued_seconds += time.perf_counter() - waiting_since
+                if self.on_wait is not None:
+                    self.on_wait(0, 0.0)
+                try:
+                    with client.messages.stream(**self.request) as stream:
+                        scheduler.observe(stream.response.headers)
+                        for text in stream.text_stream:
+                            if self.first_token_seconds is None:
+                                self.first_token_seconds = time.perf_counter() - started
+                            self.parts.append(text)
+                            yield text
+                        self.usage = stream.get_final_message().usage
+                        self.completed = True
+                    return
+                except RETRYABLE_ERRORS as error:
+                    if self.parts or self.attempts >= MAX_ATTEMPTS:
+                        raise
+                    scheduler.observe(getattr(getattr(error, 'response', None), 'headers', None))
+                    scheduler.pause(retry_delay(error, self.attempts - 1))
+                finally:
+                    usage = self.usage
+                    if usage is None and self.parts:
+                        # Stopped mid-answer: the API reports no usage, but the text so far was generated
+                        usage = partial_usage(ticket, self.text)
+                    scheduler.release(ticket, usage)
+        finally:
+            self.total_seconds = time.perf_counter() - started
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+class StreamedText:
+    """Iterates a chunk generator and keeps everything yielded, so a stopped answer can still be saved"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.parts = []
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.parts.append(chunk)
+            yield chunk
+
+    def close(self):
+        self.chunks.close()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+def session_id(session_state) -> str:
+    """A stable identifier for a browser session, used to queue its requests fairly"""
+    if 'session_id' not in session_state:
+        session_state.session_id = uuid.uuid4().hex
+    return session_state.session_id
+
+def queue_notice(placeholder):
+    """An on_wait callback that shows a request's place in line in a Streamlit placeholder"""
+    def on_wait(position: int, seconds: float):
+        if position:
+            placeholder.info(f"⏳ The assistant is busy. You are #{position} in line"
+                             f"{f' (about {seconds:.0f}s)' if seconds >= 1 else ''}; your question will be sent automatically.")
+        else:
+            placeholder.empty()
+    return on_wait
+
+def record_timing(session_state, stream: ResponseStream) -> dict:
+    """Store time-to-first-token and total time for the last request, and keep a per-session log"""
+    timing = {
+        'queued_seconds': stream.queued_seconds,
+        'first_token_seconds': stream.first_token_seconds,
+        'total_seconds': stream.total_seconds,
+        'attempts': stream.attempts,
+        'completed': stream.completed,
+    }
+    session_state.last_timing = timing
+    session_state.request_timings = (session_state.get('request_timings') or []) + [timing]
+    return timing
+
+def timing_caption(timing: dict) -> str:
+    first = timing['first_token_seconds']
+    first_text = f"first token after {first:.2f}s" if first is not None else "no tokens received"
+    status = "answer complete" if timing['completed'] else "stopped"
+    extras = []
+    if timing.get('queued_seconds', 0) >= 0.1:
+        extras.append(f"waited {timing['queued_seconds']:.1f}s in line")
+    if timing.get('attempts', 1) > 1:
+        extras.append(f"{timing['attempts'] - 1} automatic retr{'y' if timing['attempts'] == 2 else 'ies'}")
+    return f"⏱️ {first_text} | {status} in {timing['total_seconds']:.2f}s" + "".join(f" | {extra}" for extra in extras)
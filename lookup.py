@@ -0,0 +1,192 @@
+import os
+import re
+import threading
+import time
+
+from clause_store import get_clause_store
+from clauses import PART_LABELS, corpus_clauses
+from corpus import AGREEMENT_NAMES
+from render import SELECTION_AGREEMENTS
+
+# ── Direct clause lookups ──────────────────────────────────────────────────────
+#
+# "What does Article 10.1 say?", "Show me Appendix A", "Define layoff": the
+# answer is a clause's own text, already loaded, and a model call only
+# paraphrases it after a long wait. A question that is nothing but such a
+# lookup (a clause, section or article number, an appendix or letter, or a
+# defined term, optionally "in the common agreement") is answered straight
+# from the clause store and the definitions index, with the exact text and its
+# citation, in a few milliseconds. Anything more ("what does Article 10.1 say
+# about overtime?") goes to the model as before, and so does a lookup that
+# finds nothing. The page offers to send a looked-up question for full
+# analysis instead.
+
+DIRECT_LOOKUP = os.environ.get('DIRECT_LOOKUP', 'on').lower() not in ('0', 'off', 'false', 'no')
+# Clauses shown for one lookup (a whole article can be long); the rest are counted
+LOOKUP_MAX_CLAUSES = int(os.environ.get('LOOKUP_MAX_CLAUSES', 40))
+
+_PART_NAMES = "|".join(re.escape(label) for label in sorted(PART_LABELS.values(), key=len, reverse=True))
+# The reference itself, in the forms the clause store looks up
+_REFERENCE = (r"(?:(?:articles?|clauses?|sections?)\s+\d+(?:\.\d+)*(?:\s*\([a-z0-9]{1,3}\))?"
+              rf"|(?:{_PART_NAMES})\s+(?:no\.?\s*|#\s*)?(?:[a-z]|\d+))")
+# "in the CUPE common agreement", "of the support agreement"
+_AGREEMENT_RE = re.compile(r"\s*,?\s*\b(?:in|of|from|under)\s+(?:the\s+)?(?P<union>bcgeu|cupe)?\s*(?:instructors?\s+)?"
+                           r"(?P<kind>local|common|support)?\s*(?:collective\s+)?agreements?\s*$", re.IGNORECASE)
+_CLAUSE_LOOKUP_RE = re.compile(
+    r"^(?:(?:please\s+)?(?:show|give|quote|read|display|print|find|get|open|pull\s+up|look\s+up)(?:\s+me)?\s+"
+    r"|what\s+(?:does|do)\s+|what\s+is\s+(?:in\s+)?|what's\s+(?:in\s+)?)?"
+    r"(?:the\s+)?(?:(?:full|exact|complete|actual)\s+)?(?:(?:text|wording|language|content)\s+(?:of|in)\s+)?(?:the\s+)?"
+    rf"(?P<reference>{_REFERENCE})"
+    r"(?:\s+(?:say|says|state|states|provide|provides|contain|contains|read|reads))?$", re.IGNORECASE)
+_DEFINITION_RES = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"^(?:(?:please\s+)?(?:show|give|quote|find|get)(?:\s+me)?\s+|what\s+is\s+|what's\s+)?(?:the\s+)?"
+    r"definition\s+(?:of|for)\s+(?:the\s+term\s+)?(?P<term>.+)$",
+    r"^define\s+(?:the\s+term\s+)?(?P<term>.+)$",
+    r"^how\s+(?:is|are)\s+(?P<term>.+?)\s+defined$",
+    r"^what\s+(?:does|do)\s+(?:the\s+term\s+)?(?P<term>['\"“‘].+?['\"”’])\s+mean$",
+)]
+_TERM_STRIP = " '\"“”‘’"
+_ARTICLE_RE = re.compile(r"^(?:an?|the)\s+", re.IGNORECASE)
+
+def parse_lookup(query: str) -> dict:
+    """{'kind': 'clause' or 'definition', 'reference' or 'term', 'union', 'agreement_kind'} when a question is
+    only a direct lookup, otherwise None"""
+    text = " ".join(query.split()).rstrip("?.! ")
+    union = agreement_kind = None
+    qualifier = _AGREEMENT_RE.search(text)
+    if qualifier and (qualifier.group('union') or qualifier.group('kind')):
+        union, agreement_kind = qualifier.group('union'), qualifier.group('kind')
+        text = text[:qualifier.start()]
+    found = {'union': union and union.lower(), 'agreement_kind': agreement_kind and agreement_kind.lower()}
+    match = _CLAUSE_LOOKUP_RE.match(text)
+    if match:
+        return dict(found, kind='clause', reference=match.group('reference'))
+    for pattern in _DEFINITION_RES:
+        match = pattern.match(text)
+        if match:
+            term = _ARTICLE_RE.sub("", match.group('term').strip(_TERM_STRIP)).strip(_TERM_STRIP)
+            if term and len(term.split()) <= 6:
+                return dict(found, kind='definition', term=term)
+    return None
+
+def lookup_agreements(corpus, selection_key: str, parsed: dict) -> list:
+    """Agreements a lookup reads: those the question names (any of the five, preferring the selection's), or
+    the selection's. A question that names only the kind ("the common agreement") means the selection's
+    union; another union's agreement is read only when the selection's has none of that kind."""
+    selected = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    if not parsed['union'] and not parsed['agreement_kind']:
+        return selected
+    named = [key for key in AGREEMENT_NAMES if key in corpus
+             and (not parsed['union'] or key.startswith(parsed['union']))
+             and (not parsed['agreement_kind'] or key.endswith(parsed['agreement_kind']))]
+    if not parsed['union']:
+        unions = {key.split('_')[0] for key in selected}
+        named = [key for key in named if key.split('_')[0] in unions] or named
+    return [key for key in named if key in selected] or named
+
+# ── Definitions index ──
+
+class DefinitionIndex:
+    """Definition clauses by each term they define ("Parties or Common Parties" defines both)"""
+
+    def __init__(self, records: list):
+        self.records = [record for record in records if record['part'] == 'definitions' and record['title']]
+        self.terms = {}
+        for record in self.records:
+            for term in record['title'].lower().split(" or "):
+                self.terms.setdefault(_term_key(term), []).append(record)
+
+    def find(self, term: str, agreement_keys) -> list:
+        """Definitions of a term in the given agreements, in agreement order: the term itself (or its singular),
+        else definitions that define it inline ("Regular employee: ...")"""
+        order = {key: rank for rank, key in enumerate(agreement_keys)}
+        records = [record for record in self.terms.get(_term_key(term), []) if record['agreement'] in order]
+        if not records:
+            inline = re.compile(rf"(?:^|\n)\s*{re.escape(term)}s?\s*:", re.IGNORECASE)
+            records = [record for record in self.records
+                       if record['agreement'] in order and inline.search(record['text'])]
+        return sorted(records, key=lambda record: order[record['agreement']])
+
+def _term_key(term: str) -> str:
+    words = re.findall(r"[a-z0-9]+", term.lower())
+    if words and len(words[-1]) > 3 and words[-1].endswith('s') and not words[-1].endswith('ss'):
+        words[-1] = words[-1][:-1]
+    return " ".join(words)
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+def get_definition_index(corpus) -> DefinitionIndex:
+    """The definitions index for a corpus, built once per content hash and shared process-wide"""
+    index = _indexes.get(corpus.content_hash)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(corpus.content_hash)
+            if index is None:
+                index = DefinitionIndex(corpus_clauses(corpus))
+                _indexes.clear()
+                _indexes[corpus.content_hash] = index
+    return index
+
+# ── Answers ──
+
+class ClauseLookup:
+    """The clauses a direct lookup found, and how long it took"""
+
+    def __init__(self, query: str, parsed: dict, records: list, seconds: float):
+        self.query = query
+        self.parsed = parsed
+        self.records = records
+        self.seconds = seconds
+
+    @property
+    def answer(self) -> str:
+        shown = self.records[:LOOKUP_MAX_CLAUSES]
+        parts = [f"**{record['citation']}**\n\n" + "\n".join(f"> {line}" if line.strip() else ">"
+                                                              for line in record['text'].split("\n"))
+                 for record in shown]
+        if len(self.records) > len(shown):
+            parts.append(f"*… and {len(self.records) - len(shown)} more clauses. Ask for a single section to see "
+                         f"one of them.*")
+        return "\n\n".join(parts)
+
+    @property
+    def caption(self) -> str:
+        count = len(self.records)
+        target = self.parsed['reference'] if self.parsed['kind'] == 'clause' else f"definition of “{self.parsed['term']}”"
+        return (f"📖 Direct lookup of {target}: {count} clause{'s' if count != 1 else ''} quoted from the agreement "
+                f"text in {self.seconds * 1000:.1f} ms | no model call")
+
+    def to_dict(self) -> dict:
+        return {'query': self.query, 'kind': self.parsed['kind'], 'clauses': len(self.records)}
+
+def find_lookup(corpus, selection_key: str, query: str) -> ClauseLookup:
+    """The exact clauses a direct-lookup question asks for, or None when it is not one or nothing matches"""
+    if not DIRECT_LOOKUP:
+        return None
+    started = time.perf_counter()
+    parsed = parse_lookup(query)
+    if parsed is None:
+        return None
+    keys = lookup_agreements(corpus, selection_key, parsed)
+    if parsed['kind'] == 'definition':
+        records = get_definition_index(corpus).find(parsed['term'], keys)
+    else:
+        store = get_clause_store(corpus)
+        records = store.lookup(parsed['reference'], keys) if store is not None else []
+    if not records:
+        return None
+    return ClauseLookup(query, parsed, records, time.perf_counter() - started)
+
+def answer_lookup(session_state, corpus, selection_key: str, query: str) -> str:
+    """The answer to a direct-lookup question, with the session's figures set as for a request that made no
+    model call; None when the question needs the model"""
+    lookup = find_lookup(corpus, selection_key, query)
+    if lookup is None:
+        return None
+    for key in ('last_usage', 'last_timing', 'last_budget', 'last_fan_out', 'last_route'):
+        session_state.pop(key, None)
+    session_state.last_context_summary = lookup.caption
+    session_state.last_lookup = lookup.to_dict()
+    session_state.total_queries = session_state.get('total_queries', 0) + 1
+    return lookup.answer
@@ -0,0 +1,217 @@
+import argparse
+import re
+import threading
+
+from clauses import flatten_text, humanize, is_article_part
+from corpus import AGREEMENT_NAMES, get_corpus
+from render import SELECTION_AGREEMENTS, format_agreement_for_context, selection_context
+from tokens import estimate_tokens
+
+# ── Context pruning ────────────────────────────────────────────────────────────
+#
+# The full text sent to the model leaves out what carries no terms of
+# employment: page-number indexes, placeholder stubs, signature blocks,
+# document notes and committee lists. In a local/common pair it also leaves
+# out any passage that appears nearly verbatim in both, keeping the first copy
+# and pointing to it from the second. Pruned text is built once per corpus
+# version. Nothing leaves the clause index, so removed content is still found
+# by retrieval, and in full-text mode it is added back when a question asks
+# about it.
+
+# Top-level sections that carry no terms of employment
+PLACEHOLDER_SECTIONS = frozenset({
+    'indexes', 'common_agreement', 'signature_block', 'document_notes', 'negotiating_committees',
+    'common_parties_list',
+})
+
+# Passages at least this long whose 5-word shingles overlap this much count as the same text
+DUPLICATE_MIN_WORDS = 40
+DUPLICATE_SIMILARITY = 0.8
+SHINGLE_SIZE = 5
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+def _shingles(text: str) -> frozenset:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < DUPLICATE_MIN_WORDS:
+        return frozenset()
+    return frozenset(tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+def _children(node):
+    if isinstance(node, dict):
+        return list(node.items())
+    if isinstance(node, list):
+        return list(enumerate(node))
+    return []
+
+class _PassageIndex:
+    """Every passage (nested value) of an agreement long enough to be a duplicate, by shingle"""
+
+    def __init__(self, agreement: dict):
+        self.passages = []
+        self.postings = {}
+        for section, value in agreement.items():
+            self._add(value, (section,))
+        self.vocabulary = frozenset(self.postings)
+
+    def _add(self, node, path: tuple):
+        shingles = _shingles(flatten_text(node))
+        if not shingles:
+            return
+        position = len(self.passages)
+        self.passages.append((path, shingles))
+        for shingle in shingles:
+            self.postings.setdefault(shingle, []).append(position)
+        for key, child in _children(node):
+            self._add(child, path + (key,))
+
+    def match(self, shingles: frozenset):
+        """Path of the most similar passage at or above DUPLICATE_SIMILARITY, else None"""
+        overlap = {}
+        for shingle in shingles:
+            for position in self.postings.get(shingle, ()):
+                overlap[position] = overlap.get(position, 0) + 1
+        best, best_score = None, DUPLICATE_SIMILARITY
+        for position, shared in overlap.items():
+            other = self.passages[position][1]
+            score = shared / (len(shingles) + len(other) - shared)
+            if score >= best_score:
+                best, best_score = self.passages[position][0], score
+        return best
+
+def _pointer(partner_key: str, path: tuple) -> str:
+    parts = [part for part in path if part not in ('sections', 'subsections')]
+    if is_article_part(parts[0]) and len(parts) > 1:
+        parts = parts[1:]
+        if len(parts) > 1 and str(parts[1]).startswith(f"{parts[0]}."):
+            parts = parts[1:]
+        parts[0] = f"Article {parts[0]}"
+    where = " › ".join(part if str(part).startswith("Article ") else
+                       humanize(part).title() if isinstance(part, str) else f"Item {part + 1}" for part in parts)
+    return f"[Same text as {AGREEMENT_NAMES[partner_key]}: {where} — given there]"
+
+def _dedupe(node, index: _PassageIndex, partner_key: str, stats: dict):
+    """A copy of node with passages found in the partner agreement replaced by a pointer to them"""
+    shingles = _shingles(flatten_text(node))
+    if not shingles or not (shingles & index.vocabulary):
+        return node
+    if len(shingles & index.vocabulary) >= DUPLICATE_SIMILARITY * len(shingles):
+        path = index.match(shingles)
+        if path is not None:
+            stats['duplicates'] += 1
+            return _pointer(partner_key, path)
+    if isinstance(node, dict):
+        return {key: _dedupe(value, index, partner_key, stats) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_dedupe(value, index, partner_key, stats) for value in node]
+    return node
+
+def prune_agreement(agreement: dict, partner: dict = None, partner_key: str = None) -> tuple:
+    """(pruned agreement, stats): placeholder sections removed and, when a partner agreement is given,
+    passages it already contains replaced by a pointer"""
+    stats = {'placeholders': [], 'duplicates': 0}
+    pruned = {}
+    index = _PassageIndex(partner) if partner else None
+    for section, value in agreement.items():
+        if section in PLACEHOLDER_SECTIONS:
+            stats['placeholders'].append(section)
+            continue
+        pruned[section] = _dedupe(value, index, partner_key, stats) if index else value
+    return pruned, stats
+
+# ── Pruned selection context ───────────────────────────────────────────────────
+
+_pruned = {}
+_pruned_hash = None
+_pruned_lock = threading.Lock()
+
+def _prune_selection(corpus, selection_key: str) -> dict:
+    keys = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    parts = []
+    placeholders = []
+    duplicates = 0
+    # Decoded once here: a snapshot-backed corpus does not keep the nested agreements
+    agreements = {key: corpus.get(key) for key in keys}
+    for position, key in enumerate(keys):
+        # Each agreement after the first is deduplicated against the one before it (the local against
+        # nothing, the common against the local)
+        partner_key = keys[position - 1] if position else None
+        agreement, stats = prune_agreement(agreements[key], agreements.get(partner_key), partner_key)
+        parts.append(format_agreement_for_context(agreement, AGREEMENT_NAMES[key]))
+        placeholders.extend((key, section) for section in stats['placeholders'])
+        duplicates += stats['duplicates']
+    text = "\n\n".join(parts)
+    full_tokens = estimate_tokens(selection_context(corpus, selection_key))
+    return {'text': text, 'placeholders': placeholders, 'duplicates': duplicates,
+            'full_tokens': full_tokens, 'tokens': estimate_tokens(text)}
+
+def pruned_selection(corpus, selection_key: str) -> dict:
+    """Pruned full text of a selection with what was removed: text, placeholders [(agreement, section)],
+    duplicates (passages replaced by a pointer), full_tokens and tokens. Built once per version of the
+    selection's agreements."""
+    global _pruned_hash
+    cache_key = (selection_key, corpus.agreements_hash(SELECTION_AGREEMENTS[selection_key]))
+    entry = _pruned.get(cache_key)
+    if entry is not None:
+        return entry
+    entry = _prune_selection(corpus, selection_key)
+    with _pruned_lock:
+        if _pruned_hash != corpus.content_hash:
+            # Keep the selections whose agreements did not change
+            current = {(key, corpus.agreements_hash(keys)) for key, keys in SELECTION_AGREEMENTS.items()}
+            for stale in [entry_key for entry_key in _pruned if entry_key not in current]:
+                del _pruned[stale]
+            _pruned_hash = corpus.content_hash
+        _pruned[cache_key] = entry
+    return entry
+
+def pruned_selection_context(corpus, selection_key: str) -> str:
+    return pruned_selection(corpus, selection_key)['text']
+
+def is_pruned(record: dict) -> bool:
+    """Whether a clause is left out of the pruned full text as a placeholder"""
+    return record['part'] in PLACEHOLDER_SECTIONS
+
+def drop_duplicate_clauses(hits: list, agreement_keys) -> list:
+    """Retrieved (score, clause) hits without clauses that repeat, nearly verbatim, a hit from an agreement
+    earlier in the selection"""
+    order = {key: position for position, key in enumerate(agreement_keys)}
+    shingles = [_shingles(record['text']) for _, record in hits]
+    kept = []
+    for position, (score, record) in enumerate(hits):
+        duplicate = False
+        if shingles[position]:
+            for other, (_, earlier) in enumerate(hits):
+                if order.get(earlier['agreement'], 0) >= order.get(record['agreement'], 0) or not shingles[other]:
+                    continue
+                shared = len(shingles[position] & shingles[other])
+                if shared >= DUPLICATE_SIMILARITY * len(shingles[position] | shingles[other]):
+                    duplicate = True
+                    break
+        if not duplicate:
+            kept.append((score, record))
+    return kept
+
+def pruning_report(corpus) -> dict:
+    """{selection key: {'full_tokens', 'tokens', 'saved', 'placeholders', 'duplicates'}} for every selection"""
+    report = {}
+    for selection_key, keys in SELECTION_AGREEMENTS.items():
+        if not all(key in corpus for key in keys):
+            continue
+        entry = pruned_selection(corpus, selection_key)
+        report[selection_key] = {'full_tokens': entry['full_tokens'], 'tokens': entry['tokens'],
+                                 'saved': entry['full_tokens'] - entry['tokens'],
+                                 'placeholders': len(entry['placeholders']), 'duplicates': entry['duplicates']}
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the tokens saved by pruning each selection's full text")
+    parser.parse_args()
+    corpus = get_corpus()
+    print(f"{'selection':<15}{'full':>10}{'pruned':>10}{'saved':>9}  removed")
+    for selection_key, row in pruning_report(corpus).items():
+        print(f"{selection_key:<15}{row['full_tokens']:>10,}{row['tokens']:>10,}{row['saved']:>9,}"
+              f"  {row['placeholders']} placeholder sections, {row['duplicates']} duplicated passages")
+
+if __name__ == "__main__":
+    main()
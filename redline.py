@@ -0,0 +1,272 @@
+import os
+import re
+import threading
+from difflib import SequenceMatcher
+
+from crossref import CITATION, get_reference_graph, with_cross_references
+from render import SELECTION_AGREEMENTS
+from retrieval import format_retrieved_context
+from tokens import estimate_tokens
+
+# ── Redlined proposals ─────────────────────────────────────────────────────────
+#
+# A proposal pasted as a redline is mostly the agreement's own text with a few
+# words struck out or added. Sending it whole, next to the same clauses from
+# the agreement, pays for that text twice. Instead the paste is read once, line
+# by line, into its text before and after the marked edits; each line is
+# matched to the clause it quotes through an index of word shingles (or to the
+# clause its heading cites), and the edits are diffed against the clause's
+# current text from the agreement files. The request then carries those
+# clauses and their cross-references as the agreement text, and the question
+# carries the word-level changes plus anything in the paste that is not an
+# existing clause.
+
+# Words per shingle: short enough that a one-line quote still has several
+REDLINE_SHINGLE_SIZE = 4
+# Share of a line's shingles that must appear in a clause for the line to quote it
+REDLINE_MATCH_SHARE = float(os.environ.get('REDLINE_MATCH_SHARE', 0.6))
+# Shingles found in more clauses than this are boilerplate ("the employer shall") and are not indexed
+MAX_SHINGLE_CLAUSES = 25
+# Unchanged words shown either side of an edit
+DIFF_CONTEXT_WORDS = 4
+
+# Struck-out text, as pasted (~~x~~, <s>, <del>, <strike>) or already rewritten as [REMOVED: x], and added text
+# marked as such (<ins>, <u>). Text typed in plainly is a change too: it shows up in the diff with the agreement.
+_MARKUP_RE = re.compile(
+    r"~~(?P<tilde>.+?)~~"
+    r"|<(?P<del_tag>s|del|strike)>(?P<deleted>.+?)</(?P=del_tag)>"
+    r"|\[REMOVED:\s?(?P<removed>[^\]]*)\]"
+    r"|<(?P<ins_tag>ins|u)>(?P<inserted>.+?)</(?P=ins_tag)>",
+    re.DOTALL | re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# A line that starts by naming a clause ("Article 12.3 – Vacation", "Clause 8.4(b)") heads the lines under it
+_HEADING_RE = re.compile(r"\s*(?:Articles?|Clauses?|Sections?|Appendix|Letter of|Memorandum of)\b", re.IGNORECASE)
+
+def redline_lines(text: str) -> list:
+    """The pasted proposal's lines as {'old', 'new', 'marked', 'changed'}: the line before and after its marked
+    edits, and as typed with struck-out text shown as [REMOVED: ...]. One pass over the text; an edit that
+    spans lines stays with the line it starts on."""
+    lines = []
+    old, new, marked = [], [], []
+    changed = False
+    position = 0
+    for match in [*_MARKUP_RE.finditer(text), None]:
+        kept = text[position:match.start() if match else len(text)]
+        for number, piece in enumerate(kept.split('\n')):
+            if number:
+                lines.append({'old': "".join(old), 'new': "".join(new), 'marked': "".join(marked), 'changed': changed})
+                old, new, marked, changed = [], [], [], False
+            old.append(piece)
+            new.append(piece)
+            marked.append(piece)
+        if match is None:
+            break
+        removed = next((match.group(name) for name in ('tilde', 'deleted', 'removed')
+                        if match.group(name) is not None), None)
+        if removed is not None:
+            old.append(removed)
+            marked.append(f"[REMOVED: {removed}]")
+        else:
+            new.append(match.group('inserted'))
+            marked.append(match.group('inserted'))
+        changed = True
+        position = match.end()
+    lines.append({'old': "".join(old), 'new': "".join(new), 'marked': "".join(marked), 'changed': changed})
+    return lines
+
+def _words(text: str) -> list:
+    return _WORD_RE.findall(text.lower())
+
+def _shingles(words: list) -> set:
+    return {hash(tuple(words[i:i + REDLINE_SHINGLE_SIZE])) for i in range(len(words) - REDLINE_SHINGLE_SIZE + 1)}
+
+# ── Matching lines to clauses ──────────────────────────────────────────────────
+
+class ClauseShingleIndex:
+    """Clause positions (in the cross-reference graph's records) by the word shingles of their text"""
+
+    def __init__(self, records: list):
+        self.records = records
+        postings = {}
+        for position, record in enumerate(records):
+            for shingle in _shingles(_words(record['text'])):
+                postings.setdefault(shingle, []).append(position)
+        self.postings = {shingle: positions for shingle, positions in postings.items()
+                         if len(positions) <= MAX_SHINGLE_CLAUSES}
+
+    def match(self, text: str, agreement_keys) -> int:
+        """Position of the clause that text quotes, or None. A clause from an agreement earlier in the
+        selection wins a tie, as in the pruned text."""
+        shingles = _shingles(_words(text))
+        if not shingles:
+            return None
+        order = {key: rank for rank, key in enumerate(agreement_keys)}
+        shared = {}
+        for shingle in shingles:
+            for position in self.postings.get(shingle, ()):
+                if self.records[position]['agreement'] in order:
+                    shared[position] = shared.get(position, 0) + 1
+        if not shared:
+            return None
+        position = max(shared, key=lambda position: (shared[position], -order[self.records[position]['agreement']],
+                                                     -position))
+        return position if shared[position] >= REDLINE_MATCH_SHARE * len(shingles) else None
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+def get_shingle_index(corpus) -> ClauseShingleIndex:
+    """The shingle index for a corpus, built once per content hash and shared process-wide"""
+    index = _indexes.get(corpus.content_hash)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(corpus.content_hash)
+            if index is None:
+                index = ClauseShingleIndex(get_reference_graph(corpus).records)
+                _indexes.clear()
+                _indexes[corpus.content_hash] = index
+    return index
+
+# ── Diffs ──────────────────────────────────────────────────────────────────────
+
+def _normal(word: str) -> str:
+    return "".join(_WORD_RE.findall(word.lower())) or word
+
+def _quote(words: list, start: int, end: int) -> str:
+    text = " ".join(words[max(0, start):end])
+    return f"{'…' if start > 0 else ''}{text}{'…' if end < len(words) else ''}"
+
+def clause_edits(current: str, old: str, new: str) -> tuple:
+    """(proposed clause text, edits) for a clause whose quoted passage old becomes new. The passage is
+    located in the clause's current text, so words changed without markup are found too. Each edit is
+    (before, after) with a few unchanged words either side."""
+    current_words, old_words, new_words = current.split(), old.split(), new.split()
+    current_normal = [_normal(word) for word in current_words]
+    blocks = [block for block in SequenceMatcher(None, current_normal, [_normal(word) for word in old_words],
+                                                 autojunk=False).get_matching_blocks() if block.size]
+    if blocks:
+        start = max(0, blocks[0].a - blocks[0].b)
+        end = min(len(current_words), blocks[-1].a + len(old_words) - blocks[-1].b)
+    else:
+        start, end = 0, len(current_words)
+    proposed_words = current_words[:start] + new_words + current_words[end:]
+    opcodes = [opcode for opcode in SequenceMatcher(None, current_normal, [_normal(word) for word in proposed_words],
+                                                    autojunk=False).get_opcodes() if opcode[0] != 'equal']
+    # Edits a few words apart read better as one
+    spans = []
+    for _, i1, i2, j1, j2 in opcodes:
+        if spans and i1 - spans[-1][1] <= 2 * DIFF_CONTEXT_WORDS:
+            spans[-1] = (spans[-1][0], i2, spans[-1][2], j2)
+        else:
+            spans.append((i1, i2, j1, j2))
+    context = DIFF_CONTEXT_WORDS
+    edits = [(_quote(current_words, i1 - context, i2 + context), _quote(proposed_words, j1 - context, j2 + context))
+             for i1, i2, j1, j2 in spans]
+    return " ".join(proposed_words), edits
+
+class ClauseChange:
+    """One existing clause a proposal quotes, with the edits it makes to it (none when quoted unchanged)"""
+
+    def __init__(self, record: dict, proposed: str, edits: list):
+        self.record = record
+        self.proposed = proposed
+        self.edits = edits
+
+    @property
+    def text(self) -> str:
+        if not self.edits:
+            return f"{self.record['citation']}\n  (quoted unchanged)"
+        return self.record['citation'] + "".join(f"\n  - “{before}” → “{after}”" for before, after in self.edits)
+
+class Redline:
+    """A redlined proposal as changes to existing clauses, plus the lines of it that are not one"""
+
+    def __init__(self, text: str, changes: list, other: list):
+        self.source = text
+        self.changes = changes
+        self.other = other
+
+    @property
+    def changed(self) -> list:
+        return [change for change in self.changes if change.edits]
+
+    @property
+    def records(self) -> list:
+        return [change.record for change in self.changes]
+
+    @property
+    def message(self) -> str:
+        """The proposal as sent: clause-level edits, then the rest of what was pasted"""
+        parts = ["REDLINED PROPOSAL — changes to existing clauses (the current text of each is in the agreement "
+                 "text above; “before” → “after”):\n\n" + "\n\n".join(change.text for change in self.changes)]
+        if self.other:
+            parts.append("REST OF THE PROPOSAL (new language and notes that do not quote an existing clause):\n"
+                         + "\n".join(self.other))
+        return "\n\n".join(parts)
+
+def parse_redline(corpus, selection_key: str, text: str) -> Redline:
+    """The clause-level changes a redlined proposal makes to a selection's agreements, or None when the text
+    has no redline markup or quotes no clause of the selection"""
+    lines = redline_lines(text)
+    if not any(line['changed'] for line in lines):
+        return None
+    agreement_keys = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    graph = get_reference_graph(corpus)
+    index = get_shingle_index(corpus)
+    quoted = {}
+    other = []
+    current = None
+    for line in lines:
+        if not line['old'].strip() and not line['new'].strip():
+            continue
+        position = index.match(line['old'], agreement_keys)
+        if position is None and _HEADING_RE.match(line['old'] or line['new']):
+            cited = [target for strength, target in graph.citations(line['old'] or line['new'], agreement_keys)
+                     if strength == CITATION]
+            if cited:
+                # The heading names the clause; the lines under it quote it
+                current = cited[0]
+                quoted.setdefault(current, [])
+                if not line['changed']:
+                    continue
+                position = current
+        if position is None and current is not None and (line['changed'] or len(_words(line['old'])) < REDLINE_SHINGLE_SIZE):
+            # An edited or short line under a clause belongs to it
+            position = current
+        if position is None:
+            other.append(line['marked'])
+            current = None
+            continue
+        quoted.setdefault(position, []).append(line)
+        current = position
+    changes = []
+    for position in sorted(quoted):
+        record = graph.records[position]
+        quoted_lines = quoted[position]
+        if not any(line['changed'] for line in quoted_lines):
+            changes.append(ClauseChange(record, record['text'], []))
+            continue
+        proposed, edits = clause_edits(record['text'], "\n".join(line['old'] for line in quoted_lines),
+                                       "\n".join(line['new'] for line in quoted_lines))
+        changes.append(ClauseChange(record, proposed, edits))
+    if not any(change.edits for change in changes):
+        return None
+    return Redline(text, changes, other)
+
+def redline_context(corpus, selection_key: str, redline: Redline):
+    """The clauses a redline quotes and those they refer to. Returns (context, records, referenced records)."""
+    agreement_keys = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    records = redline.records
+    return with_cross_references(corpus, selection_key, format_retrieved_context(records, agreement_keys), records)
+
+def redline_caption(redline: Redline) -> str:
+    edits = sum(len(change.edits) for change in redline.changes)
+    changed = len(redline.changed)
+    caption = (f"✂️ Redline: {changed} clause{'s' if changed != 1 else ''} changed ({edits} edit{'s' if edits != 1 else ''})")
+    unchanged = len(redline.changes) - changed
+    if unchanged:
+        caption += f", {unchanged} quoted unchanged"
+    if redline.other:
+        caption += f", {len(redline.other)} line{'s' if len(redline.other) != 1 else ''} of new language or notes"
+    return (f"{caption} | proposal sent as clause diffs (~{estimate_tokens(redline.message):,} tokens, "
+            f"pasted ~{estimate_tokens(redline.source):,})")
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+# ── Disk-cached remote JSON ────────────────────────────────────────────────────
+#
+# get() never touches the network: it returns whatever copy is on disk (or None
+# on the very first run) and, when the copy is due for revalidation, starts a
+# background thread that sends a conditional GET (If-None-Match /
+# If-Modified-Since). A 304 just refreshes the "checked" time; a 200 atomically
+# replaces the cached body. Failures keep the old copy and mark it stale.
+
+CACHE_DIR = os.environ.get(
+    'AGREEMENT_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+)
+
+# Revalidate at most this often (seconds); a copy not confirmed for MAX_AGE is reported stale
+REFRESH_INTERVAL = 15 * 60
+MAX_AGE = 24 * 60 * 60
+FETCH_TIMEOUT = 10
+
+class RemoteJSONCache:
+    """A remote JSON document mirrored on disk and revalidated in the background"""
+
+    def __init__(self, url: str, name: str, cache_dir: str = None,
+                 refresh_interval: float = REFRESH_INTERVAL, max_age: float = MAX_AGE):
+        self.url = url
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.body_path = os.path.join(self.cache_dir, f"{name}.json")
+        self.meta_path = os.path.join(self.cache_dir, f"{name}.meta.json")
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._thread = None
+        self._data = None
+        self._data_mtime = None
+
+    # ── Metadata ──
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_json(self, path: str, payload, raw: bytes = None):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(raw if raw is not None else json.dumps(payload).encode('utf-8'))
+        os.replace(tmp_path, path)
+
+    # ── Reads (never block on the network) ──
+
+    def get(self) -> dict:
+        """Return the cached document (or None), scheduling a background refresh if one is due"""
+        self.refresh_if_due()
+        try:
+            mtime = os.stat(self.body_path).st_mtime_ns
+        except OSError:
+            return None
+        if self._data is None or mtime != self._data_mtime:
+            try:
+                with open(self.body_path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f)
+                self._data_mtime = mtime
+            except (OSError, ValueError):
+                return None
+        return self._data
+
+    def status(self) -> dict:
+        """Freshness of the cached copy, for the UI's "stale since" indicator"""
+        meta = self._read_meta()
+        checked_at = meta.get('checked_at')
+        fetched_at = meta.get('fetched_at')
+        now = time.time()
+        stale = bool(meta.get('last_error')) or checked_at is None or now - checked_at > self.max_age
+        return {
+            'cached': os.path.exists(self.body_path),
+            'fetched_at': fetched_at,
+            'checked_at': checked_at,
+            'stale': stale,
+            'stale_since': (checked_at or fetched_at) if stale else None,
+            'last_error': meta.get('last_error'),
+            'refreshing': self.refreshing,
+        }
+
+    @property
+    def refreshing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    # ── Background revalidation ──
+
+    def refresh_if_due(self, force: bool = False) -> bool:
+        """Start a background revalidation unless one is running or the copy was checked recently"""
+        with self._lock:
+            if self.refreshing:
+                return False
+            checked_at = self._read_meta().get('attempted_at')
+            if not force and checked_at and time.time() - checked_at < self.refresh_interval:
+                return False
+            self._thread = threading.Thread(target=self.refresh, name=f"refresh:{self.url}", daemon=True)
+            self._thread.start()
+            return True
+
+    def refresh(self) -> str:
+        """Conditional GET against the remote; returns 'updated', 'not-modified' or 'error'"""
+        meta = self._read_meta()
+        now = time.time()
+        meta['attempted_at'] = now
+        headers = {}
+        if os.path.exists(self.body_path):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            response = requests.get(self.url, headers=headers, timeout=FETCH_TIMEOUT)
+            if response.status_code == 304:
+                result = 'not-modified'
+            elif response.status_code == 200:
+                json.loads(response.content)  # never replace a good copy with a broken one
+                self._write_json(self.body_path, None, raw=response.content)
+                meta['etag'] = response.headers.get('ETag')
+                meta['last_modified'] = response.headers.get('Last-Modified')
+                meta['fetched_at'] = now
+                result = 'updated'
+            else:
+                raise requests.HTTPError(f"HTTP {response.status_code}")
+            meta['checked_at'] = now
+            meta['last_error'] = None
+        except (requests.RequestException, ValueError) as e:
+            meta['last_error'] = f"{type(e).__name__}: {e}"
+            result = 'error'
+        self._write_json(self.meta_path, meta)
+        return result
+
+    def wait(self, timeout: float = None):
+        """Block until an in-flight refresh finishes (CLI tools and tests only)"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+def format_timestamp(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M') if ts else "never"
+
+def status_caption(label: str, cache: RemoteJSONCache) -> str:
+    """Caption describing a remote-sourced agreement's freshness"""
+    info = cache.status()
+    if not info['cached']:
+        return f"⏳ {label}: fetching remote copy in the background…"
+    if info['stale']:
+        note = f" (last error: {info['last_error'].split(':')[0]})" if info['last_error'] else ""
+        return f"⚠️ {label}: remote copy stale since {format_timestamp(info['stale_since'])}{note}"
+    return f"🌐 {label}: remote copy verified {format_timestamp(info['checked_at'])}"
@@ -0,0 +1,116 @@
+import threading
+
+from corpus import AGREEMENT_NAMES
+
+# ── Formatting helpers ─────────────────────────────────────────────────────────
+#
+# The formatters emit fragments into one list and join once, so rendering is
+# linear in the size of the agreement instead of re-copying the growing string
+# at every level of nesting.
+
+def _emit_section_content(data: dict, indent: int, out: list):
+    prefix = "  " * indent
+    for key, value in data.items():
+        if isinstance(value, dict):
+            out.append(f"{prefix}{key}:\n")
+            _emit_section_content(value, indent + 1, out)
+        elif isinstance(value, list):
+            out.append(f"{prefix}{key}:\n")
+            for item in value:
+                if isinstance(item, dict):
+                    _emit_section_content(item, indent + 1, out)
+                else:
+                    out.append(f"{prefix}  - {item}\n")
+        else:
+            out.append(f"{prefix}{key}: {value}\n")
+
+def _emit_agreement(agreement: dict, agreement_name: str, out: list):
+    out.append(f"=== {agreement_name.upper()} ===\n\n")
+    for section_key, section_data in agreement.items():
+        section_title = section_key.replace('_', ' ').upper()
+        out.append(f"\n{section_title}:\n")
+        out.append("=" * 50 + "\n")
+        if isinstance(section_data, dict):
+            _emit_section_content(section_data, 0, out)
+        else:
+            out.append(str(section_data) + "\n")
+        out.append("\n")
+
+def format_agreement_for_context(agreement: dict, agreement_name: str) -> str:
+    """Convert agreement JSON to formatted text for Claude context"""
+    out = []
+    _emit_agreement(agreement, agreement_name, out)
+    return "".join(out)
+
+def format_section_content(data: dict, indent: int = 0) -> str:
+    """Recursively format nested dictionary content"""
+    out = []
+    _emit_section_content(data, indent, out)
+    return "".join(out)
+
+# ── Rendered context cache ─────────────────────────────────────────────────────
+#
+# Agreements do not change between questions, so each agreement and each
+# selection is rendered once per version of its agreements and shared by every
+# query and every session in the process. Entries are keyed by the hashes of
+# the agreements they were rendered from: when one agreement file changes, its
+# text and that of the selections it is in are rendered again, and the rest are
+# kept.
+
+# Which agreements make up each selection, in the order they are sent
+SELECTION_AGREEMENTS = {
+    'bcgeu_local':   ('bcgeu_local',),
+    'bcgeu_common':  ('bcgeu_common',),
+    'bcgeu_both':    ('bcgeu_local', 'bcgeu_common'),
+    'bcgeu_support': ('bcgeu_support',),
+    'cupe_local':    ('cupe_local',),
+    'cupe_common':   ('cupe_common',),
+    'cupe_both':     ('cupe_local', 'cupe_common'),
+}
+
+_rendered = {}
+_rendered_hash = None
+_rendered_lock = threading.Lock()
+
+def _memoized(corpus, cache_key: tuple, keys, render):
+    """Text for cache_key, rendered from the agreements keys, once per version of those agreements"""
+    global _rendered_hash
+    cache_key += tuple(corpus.agreement_hash(key) for key in keys)
+    text = _rendered.get(cache_key)
+    if text is not None:
+        return text
+    text = render()
+    with _rendered_lock:
+        if _rendered_hash != corpus.content_hash:
+            # Drop what was rendered from agreements that have since changed
+            current = set(corpus.hashes.values())
+            for stale in [entry for entry in _rendered if not current.issuperset(entry[2:])]:
+                del _rendered[stale]
+            _rendered_hash = corpus.content_hash
+        _rendered[cache_key] = text
+    return text
+
+def _render_agreement(corpus, key: str) -> str:
+    text = corpus.rendered_context(key)
+    if text is not None:
+        return text
+    agreement = corpus.get(key)
+    return format_agreement_for_context(agreement, AGREEMENT_NAMES[key]) if agreement else ""
+
+def agreement_context(corpus, key: str) -> str:
+    """Formatted context for one agreement, rendered once per version of it"""
+    return _memoized(corpus, ('agreement', key), (key,), lambda: _render_agreement(corpus, key))
+
+def selection_context(corpus, selection_key: str) -> str:
+    """Formatted context for a selection (one agreement or a local/common pair), rendered once per version of
+    its agreements"""
+    def render():
+        parts = [agreement_context(corpus, key) for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+        return "\n\n".join(parts)
+    return _memoized(corpus, ('selection', selection_key), SELECTION_AGREEMENTS[selection_key], render)
+
+def clear_rendered_cache():
+    global _rendered_hash
+    with _rendered_lock:
+        _rendered.clear()
+        _rendered_hash = None
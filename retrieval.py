@@ -0,0 +1,218 @@
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+import vector_index
+from clauses import corpus_clauses
+from corpus import AGREEMENT_NAMES
+from prune import drop_duplicate_clauses, is_pruned, pruned_selection
+from render import SELECTION_AGREEMENTS, selection_context
+from tokens import estimate_tokens
+
+# ── Retrieval settings ─────────────────────────────────────────────────────────
+
+# Upper bound on agreement text sent per question in retrieval mode, and on clauses considered
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 12000))
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', 40))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 2
+
+# Reciprocal-rank fusion constant for combining keyword and semantic rankings
+RRF_K = 60
+
+# In full-text mode, pruned placeholder clauses ranking this high for a question are added back
+RESTORE_TOP_K = 5
+
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between both but
+by can could did do does doing down during each few for from further had has have having he her here hers him his
+how i if in into is it its itself just me more most my no nor not now of off on once only or other our out over own
+same she should so some such than that the their them then there these they this those through to too under until
+up very was we were what when where which while who whom why will with would you your shall may must under per
+agreement article clause section
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)*")
+
+def _stem(token: str) -> str:
+    """Light suffix stripping so 'leaves'/'leave' and 'scheduling'/'schedule' meet"""
+    if len(token) <= 4 or token[0].isdigit():
+        return token
+    for suffix in ('ations', 'ation', 'ings', 'ing', 'ies', 'ed', 'es', 's'):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)] + ('y' if suffix == 'ies' else '')
+    return token
+
+def tokenize(text: str) -> list:
+    return [_stem(token) for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+# ── BM25 index ─────────────────────────────────────────────────────────────────
+
+class BM25Index:
+    """In-memory inverted index over clause records"""
+
+    def __init__(self, records: list):
+        self.records = records
+        # Clause id -> doc id, for lining up hits from other indexes over the same clause list
+        self.positions = {record['id']: doc_id for doc_id, record in enumerate(records)}
+        self.postings = {}
+        self.doc_lengths = []
+        for doc_id, record in enumerate(records):
+            terms = Counter(tokenize(clause_search_text(record)))
+            for term in tokenize(record.get('title') or ''):
+                terms[term] += TITLE_WEIGHT - 1
+            self.doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+        self.doc_count = len(records)
+        self.avg_length = (sum(self.doc_lengths) / self.doc_count) if self.doc_count else 0.0
+        self.idf = {
+            term: math.log(1 + (self.doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K, agreements=None) -> list:
+        """Top-k (score, record) pairs for a query, optionally restricted to some agreements"""
+        allowed = set(agreements) if agreements else None
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                if allowed is not None and self.records[doc_id]['agreement'] not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, self.records[doc_id]) for doc_id, score in best]
+
+def clause_search_text(record: dict) -> str:
+    """The text a clause is indexed under: its citation, title and body"""
+    return f"{record['citation']} {record.get('title') or ''} {record['text']}"
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+def get_index(corpus) -> BM25Index:
+    """The BM25 index for a corpus, built once per content hash and shared process-wide"""
+    index = _indexes.get(corpus.content_hash)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(corpus.content_hash)
+            if index is None:
+                index = BM25Index(corpus_clauses(corpus))
+                _indexes.clear()
+                _indexes[corpus.content_hash] = index
+    return index
+
+# ── Retrieved context ──────────────────────────────────────────────────────────
+
+def format_clause(record: dict) -> str:
+    return f"{record['citation']}\n{record['text']}\n"
+
+def select_within_budget(hits: list, token_budget: int) -> list:
+    """Keep the highest-ranked clauses whose rendered text fits the token budget"""
+    selected = []
+    used = 0
+    for _, record in hits:
+        cost = estimate_tokens(format_clause(record))
+        if used + cost > token_budget:
+            continue
+        selected.append(record)
+        used += cost
+    return selected
+
+def format_retrieved_context(records: list, agreement_keys) -> str:
+    """Render retrieved clauses grouped by agreement, keeping their given order, with their citations"""
+    out = []
+    for key in agreement_keys:
+        group = [record for record in records if record['agreement'] == key]
+        if not group:
+            continue
+        out.append(f"=== {AGREEMENT_NAMES[key].upper()} — RELEVANT CLAUSES ===\n\n")
+        for record in group:
+            out.append(format_clause(record))
+            out.append("\n")
+    return "".join(out)
+
+def fuse_rankings(rankings: list, k: int) -> list:
+    """Reciprocal-rank fusion of several ranked lists of clause positions; returns (score, position)"""
+    fused = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking):
+            fused[position] = fused.get(position, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return heapq.nlargest(k, ((score, position) for position, score in fused.items()))
+
+def search_clauses(corpus, query: str, agreement_keys, top_k: int = RETRIEVAL_TOP_K) -> list:
+    """Top-k (score, record) pairs: BM25 keyword hits fused with the semantic index when it is built"""
+    index = get_index(corpus)
+    keyword_hits = index.search(query, top_k, agreements=agreement_keys)
+    semantic = vector_index.get_vector_index(corpus)
+    if semantic is None:
+        return keyword_hits
+    position = index.positions
+    allowed = {doc_id for doc_id, record in enumerate(index.records) if record['agreement'] in agreement_keys}
+    semantic_hits = semantic.search(query, top_k, allowed=allowed)
+    fused = fuse_rankings([[position[record['id']] for _, record in keyword_hits],
+                           [doc_id for _, doc_id in semantic_hits]], top_k)
+    return [(score, index.records[doc_id]) for score, doc_id in fused]
+
+def retrieve_context(corpus, selection_key: str, query: str, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                     top_k: int = RETRIEVAL_TOP_K):
+    """Context made of only the clauses relevant to a query; returns (text, clause records)"""
+    agreement_keys = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    hits = drop_duplicate_clauses(search_clauses(corpus, query, agreement_keys, top_k), agreement_keys)
+    records = select_within_budget(hits, token_budget)
+    position = get_index(corpus).positions
+    records.sort(key=lambda record: position[record['id']])
+    return format_retrieved_context(records, agreement_keys), records
+
+RESTORED_HEADING = ("LEFT OUT OF THE TEXT ABOVE AS NON-SUBSTANTIVE (indexes, signatures, committee lists and "
+                    "similar), INCLUDED BECAUSE THIS QUESTION IS ABOUT IT")
+
+def full_selection_context(corpus, selection_key: str, query: str) -> str:
+    """The pruned full text of a selection, plus any pruned placeholder clauses the question is about"""
+    text = pruned_selection(corpus, selection_key)['text']
+    agreement_keys = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    restored = [record for _, record in search_clauses(corpus, query, agreement_keys, RESTORE_TOP_K)
+                if is_pruned(record)]
+    if not restored:
+        return text
+    position = get_index(corpus).positions
+    restored.sort(key=lambda record: position[record['id']])
+    return f"{text}\n\n=== {RESTORED_HEADING} ===\n\n{format_retrieved_context(restored, agreement_keys)}"
+
+FULL_CONTENT_HEADING = "COMPLETE COLLECTIVE AGREEMENT CONTENT"
+RETRIEVED_CONTENT_HEADING = ("RELEVANT COLLECTIVE AGREEMENT CLAUSES (retrieved for this question; "
+                             "clauses not shown are omitted, not absent from the agreement)")
+
+def query_context(corpus, selection_key: str, query: str, full_context: bool = False):
+    """Context for one question: the relevant clauses by default, the whole selection when asked
+    (or when nothing matches). Returns (text, clause records or None for the full text)."""
+    if full_context or not selection_context(corpus, selection_key):
+        return full_selection_context(corpus, selection_key, query), None
+    context, records = retrieve_context(corpus, selection_key, query)
+    if not records:
+        return full_selection_context(corpus, selection_key, query), None
+    return context, records
+
+def content_heading(records) -> str:
+    return FULL_CONTENT_HEADING if records is None else RETRIEVED_CONTENT_HEADING
+
+def context_summary(corpus, selection_key: str, context: str, records, referenced=()) -> str:
+    """One-line description of what was sent, for the UI"""
+    if records is None:
+        pruned = pruned_selection(corpus, selection_key)
+        saved = pruned['full_tokens'] - pruned['tokens']
+        pruned_note = f", {saved:,} tokens of placeholders and duplicates left out" if saved else ""
+        return f"📚 Sent the full agreement text (~{estimate_tokens(context):,} tokens{pruned_note})"
+    full = selection_context(corpus, selection_key)
+    cross_referenced = f", incl. {len(referenced)} cross-referenced" if referenced else ""
+    return (f"🔎 Sent {len(records)} relevant clauses{cross_referenced} (~{estimate_tokens(context):,} tokens) "
+            f"instead of the full agreement (~{estimate_tokens(full):,} tokens)")
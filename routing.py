@@ -0,0 +1,163 @@
+import logging
+import os
+import re
+import threading
+
+from crossref import CITATION, get_reference_graph
+from render import SELECTION_AGREEMENTS
+from retrieval import get_index
+
+# ── Model routing ──────────────────────────────────────────────────────────────
+#
+# Most questions put to the assistants are lookups ("what is the bereavement
+# leave", "how much notice for layoff") that a small model answers well and
+# quickly from the clause retrieval already found; only strategic analysis
+# needs the large model and its long answer. Each question is routed before
+# it is sent, from cheap local features only: the analysis type, the question's
+# length and wording, whether it continues a conversation or carries a
+# redline, and whether its strong retrieval hits (or the clauses it cites) all
+# fall in one article. A lookup goes to the fast model with a short answer
+# limit and a note asking for a direct answer; anything else, or any doubt,
+# goes to the deep model the page used before. Every routed request is logged
+# with its route and latency, and kept per route for the metrics.
+
+MODEL_ROUTING = os.environ.get('MODEL_ROUTING', 'on').lower() not in ('0', 'off', 'false', 'no')
+FAST_MODEL = os.environ.get('FAST_MODEL', "claude-haiku-4-5")
+FAST_MAX_TOKENS = int(os.environ.get('FAST_MAX_TOKENS', 1200))
+# Longest question (in words) still treated as a lookup
+LOOKUP_MAX_WORDS = int(os.environ.get('LOOKUP_MAX_WORDS', 16))
+# Hits scoring at least this share of the best one count as matches; a lookup's all fall in one article
+ROUTE_MATCH_SHARE = float(os.environ.get('ROUTE_MATCH_SHARE', 0.8))
+ROUTE_MATCH_HITS = 5
+
+# Analysis types that always get the deep model
+STRATEGIC_ANALYSIS_TYPES = ("Management Proposal", "Union Proposal")
+
+# Wording that asks for judgment, advice or comparison rather than what the agreement says
+_JUDGMENT_RE = re.compile(
+    r"\b(?:should|ought|can we|could we|may we|must we|how (?:do|can|should|would) we|what if|why|"
+    r"strateg\w*|recommend\w*|advi[cs]\w*|risks?|negotiat\w*|bargain\w*|propos\w*|counter\w*|impacts?|"
+    r"implications?|argu\w*|defend|challeng\w*|grievances?|arbitrat\w*|interpret\w*|compar\w*|versus|vs|"
+    r"options?|best|worst|leverage)\b", re.IGNORECASE)
+
+# Added to a lookup's question so the fast model answers it in a few sentences, within its limit
+FAST_NOTE = ("\n\nThis is a direct lookup: answer it in a few sentences, quoting the operative language with its "
+             "citation, and leave out any section that does not apply.")
+
+logger = logging.getLogger(__name__)
+
+# Modules whose INFO log belongs on the console: the route of every request, and vector index rebuilds
+APP_LOGGERS = ('routing', 'vector_index')
+
+def configure_logging():
+    """Print the app's INFO log to the console. Called where each process starts (the service, batch.py and
+    the Streamlit pages, which rerun it harmlessly): nothing else in them sets up logging, so the route log
+    was dropped."""
+    logging.basicConfig(format="%(levelname)s:     %(name)s: %(message)s")
+    for name in APP_LOGGERS:
+        logging.getLogger(name).setLevel(logging.INFO)
+
+class Route:
+    """The model a question is sent to, its answer limit, and why"""
+
+    def __init__(self, name: str, model: str, max_tokens: int, reason: str):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.reason = reason
+
+    @property
+    def fast(self) -> bool:
+        return self.name == 'fast'
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'model': self.model, 'max_tokens': self.max_tokens, 'reason': self.reason}
+
+def _one_article(records) -> str:
+    """The citation of the first record when every record is from the same article, otherwise None"""
+    articles = {(record['agreement'], record['part'], record['article']) for record in records}
+    return records[0]['citation'] if len(articles) == 1 else None
+
+def matched_article(corpus, selection_key: str, query: str) -> str:
+    """Citation of the one article a question is about, or None: the clauses it cites by number, otherwise its
+    strong keyword hits, all in one article"""
+    agreement_keys = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    graph = get_reference_graph(corpus)
+    cited = [graph.records[target] for strength, target in graph.citations(query, agreement_keys)
+             if strength == CITATION]
+    if cited:
+        return _one_article(cited)
+    hits = get_index(corpus).search(query, ROUTE_MATCH_HITS, agreements=agreement_keys)
+    if not hits:
+        return None
+    return _one_article([record for score, record in hits if score >= ROUTE_MATCH_SHARE * hits[0][0]])
+
+def route_question(corpus, selection_key: str, query: str, clauses, deep_model: str, deep_max_tokens: int,
+                   analysis_type: str = None, is_followup: bool = False, redline=None) -> Route:
+    """The route for a question, given the clauses retrieved for it (None when the full text is sent)"""
+    def deep(reason: str) -> Route:
+        return Route('deep', deep_model, deep_max_tokens, reason)
+
+    if not MODEL_ROUTING:
+        return deep("routing off")
+    if analysis_type in STRATEGIC_ANALYSIS_TYPES:
+        return deep(f"{analysis_type.lower()} analysis")
+    if clauses is None:
+        return deep("full agreement text")
+    if redline is not None:
+        return deep("redlined proposal")
+    if is_followup:
+        return deep("follow-up")
+    if len(query.split()) > LOOKUP_MAX_WORDS:
+        return deep("long question")
+    judgment = _JUDGMENT_RE.search(query)
+    if judgment:
+        return deep(f"asks for judgment (“{judgment.group(0)}”)")
+    citation = matched_article(corpus, selection_key, query)
+    if citation is None:
+        return deep("matches several articles")
+    return Route('fast', FAST_MODEL, FAST_MAX_TOKENS, f"lookup in {citation}")
+
+def route_caption(route: Route) -> str:
+    icon = "⚡" if route.fast else "🧠"
+    return f"{icon} {route.name.capitalize()} model ({route.model}, up to {route.max_tokens:,} tokens): {route.reason}"
+
+# ── Route log ──
+
+class RouteStats:
+    """Requests, time to first token and total time per route, process-wide"""
+
+    def __init__(self):
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def add(self, route: str, timing: dict):
+        with self._lock:
+            stats = self.routes.setdefault(route, {'requests': 0, 'first_token_seconds': 0.0, 'first_tokens': 0,
+                                                   'total_seconds': 0.0})
+            stats['requests'] += 1
+            stats['total_seconds'] += timing['total_seconds']
+            if timing['first_token_seconds'] is not None:
+                stats['first_token_seconds'] += timing['first_token_seconds']
+                stats['first_tokens'] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {route: dict(stats) for route, stats in self.routes.items()}
+
+route_stats = RouteStats()
+
+def log_route(route: Route, timing: dict):
+    """Log a sent request's route with its latency (timing as from record_timing) and add it to the per-route
+    figures"""
+    route_stats.add(route.name, timing)
+    first_token = timing['first_token_seconds']
+    logger.info("route %s (%s): %s | first token %s, total %.2fs%s", route.name, route.model, route.reason,
+                "-" if first_token is None else f"{first_token:.2f}s", timing['total_seconds'],
+                "" if timing['completed'] else " (stopped)")
+
+def record_route(session_state, route: Route, timing: dict):
+    """Keep the last request's route for the page, mark its timing with it, and log it"""
+    session_state.last_route = route.to_dict()
+    timing['route'] = route.name
+    log_route(route, timing)
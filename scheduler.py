@@ -0,0 +1,302 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import anthropic
+
+from tokens import estimate_tokens
+
+# ── Request scheduler ──────────────────────────────────────────────────────────
+#
+# Every model call in the process goes through one scheduler, so sessions wait
+# their turn for the organisation's per-minute limits instead of racing each
+# other into 429s:
+#
+#   - token buckets for requests, input tokens and output tokens per minute,
+#     charged with the prompt size estimated before sending (and max_tokens for
+#     output), then corrected from the response's usage and rate-limit headers
+#   - fair queueing: sessions are served round-robin, one request at a time,
+#     so a session with many queued requests cannot starve the others
+#   - rate-limit / overload / connection errors pause the queue for
+#     retry-after (or an exponential backoff) and the request is retried
+#   - each waiting request can report its position in the queue
+
+# Starting limits; replaced by the real ones from the first response's rate-limit headers
+REQUESTS_PER_MINUTE = int(os.environ.get('ANTHROPIC_RPM', 50))
+INPUT_TOKENS_PER_MINUTE = int(os.environ.get('ANTHROPIC_INPUT_TPM', 30000))
+OUTPUT_TOKENS_PER_MINUTE = int(os.environ.get('ANTHROPIC_OUTPUT_TPM', 8000))
+MAX_IN_FLIGHT = int(os.environ.get('ANTHROPIC_MAX_IN_FLIGHT', 8))
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+WAIT_POLL_INTERVAL = 0.5
+
+RETRYABLE_ERRORS = (anthropic.RateLimitError, anthropic.OverloadedError, anthropic.InternalServerError,
+                    anthropic.APIConnectionError)
+
+class TokenBucket:
+    """A per-minute allowance that refills continuously. A request larger than the whole
+    allowance is let through once the bucket is full, leaving it in debt, rather than never."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def fits(self, amount: float, now: float) -> bool:
+        self._refill(now)
+        return self.level >= min(amount, self.capacity)
+
+    def seconds_until(self, amount: float, now: float) -> float:
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60.0 / self.capacity) if self.capacity else 0.0
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= amount
+
+    def refund(self, amount: float, now: float):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def sync(self, limit: int = None, remaining: int = None, now: float = None):
+        """Adopt the limit and remaining allowance reported by the API"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.capacity, float(remaining))
+
+class Ticket:
+    """One request's place in the queue and the allowance charged for it"""
+
+    def __init__(self, session: str, input_tokens: int, output_tokens: int):
+        self.session = session
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.charged = None
+
+class RequestScheduler:
+
+    def __init__(self, requests_per_minute: int = REQUESTS_PER_MINUTE,
+                 input_tokens_per_minute: int = INPUT_TOKENS_PER_MINUTE,
+                 output_tokens_per_minute: int = OUTPUT_TOKENS_PER_MINUTE,
+                 max_in_flight: int = MAX_IN_FLIGHT):
+        self.buckets = {
+            'requests': TokenBucket(requests_per_minute),
+            'input_tokens': TokenBucket(input_tokens_per_minute),
+            'output_tokens': TokenBucket(output_tokens_per_minute),
+        }
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._queues = {}
+        self._rotation = deque()
+        self._cond = threading.Condition()
+        self.stats = {'granted': 0, 'queued': 0, 'retries': 0, 'waited_seconds': 0.0}
+
+    # ── Queue ──
+
+    def _order(self) -> list:
+        """Waiting tickets in the order they will be granted: round-robin over sessions"""
+        queues = [list(self._queues[session]) for session in self._rotation]
+        order = []
+        depth = 0
+        while any(depth < len(queue) for queue in queues):
+            order.extend(queue[depth] for queue in queues if depth < len(queue))
+            depth += 1
+        return order
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based place in line, or 0 once granted"""
+        with self._cond:
+            if ticket.granted:
+                return 0
+            return self._order().index(ticket) + 1
+
+    def waiting(self) -> int:
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _charge(self, ticket: Ticket) -> dict:
+        return {'requests': 1, 'input_tokens': ticket.input_tokens, 'output_tokens': ticket.output_tokens}
+
+    def _wait_seconds(self, ticket: Ticket, now: float) -> float:
+        """How long until the head of the line could be granted (0 if it can be now)"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= self.max_in_flight:
+            return WAIT_POLL_INTERVAL
+        return max(self.buckets[name].seconds_until(amount, now) for name, amount in self._charge(ticket).items())
+
+    def _dispatch(self, now: float):
+        """Grant tickets from the front of the fair order while the limits allow"""
+        while self._rotation:
+            session = self._rotation[0]
+            queue = self._queues[session]
+            ticket = queue[0]
+            if self._wait_seconds(ticket, now) > 0:
+                return
+            for name, amount in self._charge(ticket).items():
+                self.buckets[name].take(amount, now)
+            ticket.charged = self._charge(ticket)
+            ticket.granted = True
+            self.in_flight += 1
+            self.stats['granted'] += 1
+            self.stats['waited_seconds'] += now - ticket.enqueued
+            queue.popleft()
+            self._rotation.popleft()
+            if queue:
+                self._rotation.append(session)
+            else:
+                del self._queues[session]
+            self._cond.notify_all()
+
+    def _remove(self, ticket: Ticket):
+        queue = self._queues.get(ticket.session)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.session]
+            self._rotation.remove(ticket.session)
+        self._cond.notify_all()
+
+    def acquire(self, session: str, input_tokens: int, output_tokens: int, on_wait=None) -> Ticket:
+        """Block until this session's request may be sent. on_wait(position, seconds) is called
+        while waiting; if it raises (the user left the page), the request leaves the queue."""
+        ticket = Ticket(session, input_tokens, output_tokens)
+        with self._cond:
+            if session not in self._queues:
+                self._queues[session] = deque()
+                self._rotation.append(session)
+            self._queues[session].append(ticket)
+            self._dispatch(time.monotonic())
+            if not ticket.granted:
+                self.stats['queued'] += 1
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    self._dispatch(now)
+                    if ticket.granted:
+                        return ticket
+                    position = self._order().index(ticket) + 1
+                    head = self._order()[0]
+                    wait = self._wait_seconds(head, now)
+                    self._cond.wait(timeout=min(max(wait, 0.01), WAIT_POLL_INTERVAL))
+                if on_wait is not None:
+                    on_wait(position, wait)
+        except BaseException:
+            with self._cond:
+                self._remove(ticket)
+                if ticket.granted:
+                    self._release_locked(ticket, None)
+            raise
+
+    # ── Completion and feedback ──
+
+    def _release_locked(self, ticket: Ticket, usage):
+        now = time.monotonic()
+        self.in_flight -= 1
+        if usage is None:
+            # Nothing was generated (the request failed or was cancelled before any text streamed)
+            self.buckets['output_tokens'].refund(ticket.charged['output_tokens'], now)
+        else:
+            # Cache reads do not count towards the input-token limit
+            used_input = (getattr(usage, 'input_tokens', 0) or 0) + (getattr(usage, 'cache_creation_input_tokens', 0) or 0)
+            used_output = getattr(usage, 'output_tokens', 0) or 0
+            self.buckets['input_tokens'].refund(ticket.charged['input_tokens'] - used_input, now)
+            self.buckets['output_tokens'].refund(ticket.charged['output_tokens'] - used_output, now)
+        self._dispatch(now)
+        self._cond.notify_all()
+
+    def release(self, ticket: Ticket, usage=None):
+        """Return a granted request's slot, correcting its charge to the tokens actually used. usage is None
+        only when nothing was generated; a response stopped part-way passes partial_usage()."""
+        with self._cond:
+            self._release_locked(ticket, usage)
+
+    def pause(self, seconds: float):
+        """Hold every queued request (the limit is shared by the whole organisation)"""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.stats['retries'] += 1
+
+    def observe(self, headers):
+        """Sync the buckets with the anthropic-ratelimit-* response headers, when present"""
+        if headers is None:
+            return
+        with self._cond:
+            now = time.monotonic()
+            for name, bucket in self.buckets.items():
+                prefix = f"anthropic-ratelimit-{name.replace('_', '-')}"
+                limit, remaining = headers.get(f"{prefix}-limit"), headers.get(f"{prefix}-remaining")
+                try:
+                    bucket.sync(int(limit) if limit else None, int(remaining) if remaining else None, now)
+                except ValueError:
+                    continue
+            self._dispatch(now)
+
+    def snapshot(self) -> dict:
+        """Current queue and allowance levels, for metrics"""
+        with self._cond:
+            now = time.monotonic()
+            levels = {}
+            for name, bucket in self.buckets.items():
+                bucket._refill(now)
+                levels[name] = {'capacity': bucket.capacity, 'available': round(bucket.level)}
+            return {'waiting': sum(len(queue) for queue in self._queues.values()), 'in_flight': self.in_flight,
+                    'paused_for': max(0.0, self.paused_until - now), 'limits': levels, **self.stats}
+
+class PartialUsage:
+    """Usage of a response stopped after some text had streamed, which the API never reports"""
+
+    def __init__(self, input_tokens: int, output_tokens: int):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+def partial_usage(ticket: Ticket, text: str) -> PartialUsage:
+    """The input as charged and the output estimated from the text that streamed (at most max_tokens): the
+    API generated those tokens, so they stay charged"""
+    return PartialUsage(ticket.charged['input_tokens'], min(estimate_tokens(text), ticket.charged['output_tokens']))
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """retry-after from the API when it sends one, otherwise exponential backoff with jitter"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        try:
+            if retry_after:
+                return min(BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def estimate_request_tokens(request: dict) -> int:
+    """Input tokens a Messages API request will use, estimated from its text"""
+    def text_of(content) -> str:
+        if isinstance(content, str):
+            return content
+        return "".join(block.get('text', '') for block in content if isinstance(block, dict))
+    total = estimate_tokens(text_of(request.get('system') or ""))
+    for message in request.get('messages', []):
+        total += estimate_tokens(text_of(message.get('content') or "")) + 4
+    return total
+
+_scheduler = RequestScheduler()
+
+def get_scheduler() -> RequestScheduler:
+    """The process-wide scheduler shared by every session"""
+    return _scheduler
@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from analysis import QA_ASSISTANTS, SessionState, analyse_bargaining, answer_question, request_outcome
+from bargaining import ANALYSIS_TYPES
+from batch import BACKENDS, resolve_selection
+from corpus import get_corpus
+from routing import configure_logging, route_stats
+from scheduler import get_scheduler
+from service_client import LAST_REQUEST_FIELDS, SESSION_TOTALS, session_fields
+
+# ── Analysis service ───────────────────────────────────────────────────────────
+#
+#   python service.py --port 8600                    # ANTHROPIC_API_KEY, or --backend stub
+#   ANALYSIS_SERVICE_URL=http://127.0.0.1:8600 streamlit run bargain.py
+#
+# Serves the agreement Q&A and the bargaining analysis over HTTP, so the
+# Streamlit pages only draw the conversation: one process holds the corpus,
+# its indexes, the model client and the request scheduler for every page and
+# every user, instead of each page process loading its own. An answer streams
+# back as server-sent events while it is written: `text` pieces, the `budget`
+# once the request is sized, `fan_out` progress, `queue` notices while it waits
+# its turn, then `done` with the session's figures for the page to show (or
+# `error`). The pipelines are the ones the pages run in-process (analysis.py),
+# each on a worker thread; a request keeps its session's state (conversation
+# memory, working set, totals) in a per-session store, and one session's
+# requests run one at a time. A client that disconnects stops its request, and
+# the request's place in the scheduler's queue is given up.
+#
+#   POST /v1/answer       {query, selection, assistant?, full_context?, direct_lookup?, session?, state?}
+#   POST /v1/bargaining   {query, selection, analysis_type, is_followup?, messages?, full_context?, direct_lookup?,
+#                          session?, state?}
+#   GET  /healthz         corpus, sessions and requests in flight, as JSON
+#   GET  /metrics         request counts, latency (also per model route) and tokens, and the scheduler's
+#                         queue, for Prometheus
+
+SERVICE_PORT = int(os.environ.get('ANALYSIS_SERVICE_PORT', 8600))
+# Requests analysed at once; every model call still waits its turn in the shared scheduler
+SERVICE_WORKERS = int(os.environ.get('ANALYSIS_SERVICE_WORKERS', 32))
+# Sessions whose state is kept; the least recently used is dropped first
+MAX_SESSIONS = int(os.environ.get('ANALYSIS_SERVICE_SESSIONS', 1000))
+# Seconds a session's state is kept after its last request
+SESSION_TTL = float(os.environ.get('ANALYSIS_SERVICE_SESSION_TTL', 4 * 3600))
+
+class RequestCancelled(BaseException):
+    """Raised from a pipeline's callbacks once its client has gone. Like Streamlit's own stop, it is not an
+    Exception, so the pipeline's error handling lets it through."""
+
+# ── Sessions ──
+
+class SessionStore:
+    """Session states by id, with a lock per session; expired and least recently used sessions are dropped"""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl: float = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session: str) -> tuple:
+        """(state, lock) of a session, new if it is not kept"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session, None)
+            if entry is None or now - entry[2] > self.ttl:
+                entry = (SessionState(session_id=session), threading.Lock(), now)
+            self._sessions[session] = (entry[0], entry[1], now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return entry[0], entry[1]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+# ── Metrics ──
+
+class ServiceMetrics:
+    """Request counts by endpoint and outcome, latency and token totals, in Prometheus text format"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = {}
+        self.in_flight = 0
+        self.seconds = [0.0, 0]
+        self.first_token_seconds = [0.0, 0]
+        self.tokens = {}
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, endpoint: str, outcome: str, seconds: float, state: dict):
+        timing = state.get('last_timing') or {}
+        usage = state.get('last_usage') or {}
+        with self._lock:
+            self.in_flight -= 1
+            self.requests[endpoint, outcome] = self.requests.get((endpoint, outcome), 0) + 1
+            self.seconds[0] += seconds
+            self.seconds[1] += 1
+            if timing.get('first_token_seconds') is not None:
+                self.first_token_seconds[0] += timing['first_token_seconds']
+                self.first_token_seconds[1] += 1
+            for field, count in usage.items():
+                self.tokens[field] = self.tokens.get(field, 0) + count
+
+    def text(self, sessions: int) -> str:
+        scheduler = get_scheduler().snapshot()
+        with self._lock:
+            lines = ["# TYPE analysis_requests_total counter"]
+            lines += [f'analysis_requests_total{{endpoint="{endpoint}",outcome="{outcome}"}} {count}'
+                      for (endpoint, outcome), count in sorted(self.requests.items())]
+            lines += ["# TYPE analysis_requests_in_flight gauge", f"analysis_requests_in_flight {self.in_flight}",
+                      "# TYPE analysis_request_seconds summary",
+                      f"analysis_request_seconds_sum {self.seconds[0]:.3f}",
+                      f"analysis_request_seconds_count {self.seconds[1]}",
+                      "# TYPE analysis_first_token_seconds summary",
+                      f"analysis_first_token_seconds_sum {self.first_token_seconds[0]:.3f}",
+                      f"analysis_first_token_seconds_count {self.first_token_seconds[1]}",
+                      "# TYPE analysis_tokens_total counter"]
+            lines += [f'analysis_tokens_total{{kind="{field}"}} {count}' for field, count in sorted(self.tokens.items())]
+        routes = route_stats.snapshot()
+        lines.append("# TYPE analysis_route_seconds summary")
+        for route, stats in sorted(routes.items()):
+            lines += [f'analysis_route_seconds_sum{{route="{route}"}} {stats["total_seconds"]:.3f}',
+                      f'analysis_route_seconds_count{{route="{route}"}} {stats["requests"]}']
+        lines.append("# TYPE analysis_route_first_token_seconds summary")
+        for route, stats in sorted(routes.items()):
+            lines += [f'analysis_route_first_token_seconds_sum{{route="{route}"}} {stats["first_token_seconds"]:.3f}',
+                      f'analysis_route_first_token_seconds_count{{route="{route}"}} {stats["first_tokens"]}']
+        lines += ["# TYPE analysis_sessions gauge", f"analysis_sessions {sessions}",
+                  "# TYPE scheduler_waiting gauge", f"scheduler_waiting {scheduler['waiting']}",
+                  "# TYPE scheduler_in_flight gauge", f"scheduler_in_flight {scheduler['in_flight']}",
+                  "# TYPE scheduler_paused_seconds gauge", f"scheduler_paused_seconds {scheduler['paused_for']:.3f}",
+                  "# TYPE scheduler_available gauge"]
+        lines += [f'scheduler_available{{limit="{name}"}} {level["available"]}'
+                  for name, level in scheduler['limits'].items()]
+        lines += [f"scheduler_{name}_total {value}" for name, value in scheduler.items()
+                  if name not in ('waiting', 'in_flight', 'paused_for', 'limits') and isinstance(value, (int, float))]
+        return "\n".join(lines) + "\n"
+
+# ── Service ──
+
+class AnalysisService:
+    """The HTTP endpoints, running each request's pipeline on a worker thread and streaming what it reports"""
+
+    def __init__(self, client, backend: str, workers: int = SERVICE_WORKERS):
+        self.client = client
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+        self.sessions = SessionStore()
+        self.metrics = ServiceMetrics()
+        self.app = Starlette(routes=[
+            Route('/v1/answer', self.answer, methods=['POST']),
+            Route('/v1/bargaining', self.bargaining, methods=['POST']),
+            Route('/healthz', self.healthz),
+            Route('/metrics', self.metrics_text),
+        ], lifespan=self.lifespan)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, app):
+        yield
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _request_fields(self, request: Request) -> dict:
+        try:
+            fields = await request.json()
+        except ValueError:
+            raise ValueError("the request body is not JSON")
+        if not isinstance(fields, dict) or not str(fields.get('query') or "").strip():
+            raise ValueError("no query")
+        selection = resolve_selection(str(fields.get('selection') or ""))
+        if selection is None:
+            raise ValueError(f"unknown or missing selection {fields.get('selection')!r}")
+        fields['selection'] = selection
+        return fields
+
+    async def answer(self, request: Request):
+        try:
+            fields = await self._request_fields(request)
+            if fields.setdefault('assistant', 'agreements') not in QA_ASSISTANTS:
+                raise ValueError(f"unknown assistant {fields['assistant']!r}")
+        except ValueError as error:
+            return JSONResponse({'error': str(error)}, status_code=400)
+        return self._stream('answer', fields, lambda state, callbacks: answer_question(
+            state, self.client, get_corpus(), fields['selection'], fields['query'],
+            bool(fields.get('full_context')), **callbacks, direct_lookup=fields.get('direct_lookup', True),
+            assistant=fields['assistant']))
+
+    async def bargaining(self, request: Request):
+        try:
+            fields = await self._request_fields(request)
+            if fields.get('analysis_type') not in ANALYSIS_TYPES:
+                raise ValueError(f"unknown or missing analysis_type {fields.get('analysis_type')!r}")
+        except ValueError as error:
+            return JSONResponse({'error': str(error)}, status_code=400)
+        return self._stream('bargaining', fields, lambda state, callbacks: analyse_bargaining(
+            state, self.client, get_corpus(), fields['selection'], fields['query'], fields['analysis_type'],
+            bool(fields.get('is_followup')), bool(fields.get('full_context')), **callbacks,
+            direct_lookup=fields.get('direct_lookup', True)))
+
+    def _stream(self, endpoint: str, fields: dict, pipeline) -> StreamingResponse:
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def emit(event: str, data):
+            if cancelled.is_set():
+                raise RequestCancelled()
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+        def on_wait(position: int, seconds: float):
+            # Called every poll while queued; only a change of place or a new second is sent
+            notice = (position, int(seconds))
+            if notice != last_wait[0] or cancelled.is_set():
+                last_wait[0] = notice
+                emit('queue', {'position': position, 'seconds': round(seconds, 1)})
+
+        last_wait = [None]
+        callbacks = {
+            'on_budget': lambda budget: emit('budget', budget.to_dict()),
+            'on_progress': lambda done, total: emit('fan_out', {'done': done, 'total': total}),
+            'on_wait': on_wait,
+        }
+
+        def run():
+            state, lock = self.sessions.get(fields.get('session') or os.urandom(16).hex())
+            started = time.perf_counter()
+            self.metrics.begin()
+            outcome = 'failed'
+            with lock:
+                try:
+                    if cancelled.is_set():
+                        raise RequestCancelled()
+                    # The page's running totals, so a restarted service carries on from them and a reset
+                    # page starts again from none
+                    totals = fields.get('state') or {}
+                    for field in SESSION_TOTALS:
+                        if field in totals:
+                            state[field] = totals[field]
+                        else:
+                            state.pop(field, None)
+                    if 'messages' in fields:
+                        state.messages = fields['messages']
+                        if len(state.messages) <= 1:
+                            # A new conversation: nothing carried over from the last one
+                            for field in ('conversation_memory', 'working_set'):
+                                state.pop(field, None)
+                    for field in LAST_REQUEST_FIELDS:
+                        state.pop(field, None)
+                    queries_before = state.get('total_queries', 0)
+                    chunks = pipeline(state, callbacks)
+                    try:
+                        for chunk in chunks:
+                            emit('text', {'text': chunk})
+                    finally:
+                        chunks.close()
+                    outcome = request_outcome(state, queries_before)
+                    emit('done', {'session': session_fields(state)})
+                except RequestCancelled:
+                    outcome = 'stopped'
+                except Exception as error:
+                    with contextlib.suppress(RequestCancelled):
+                        emit('error', {'error': f"{type(error).__name__}: {error}"})
+                finally:
+                    self.metrics.end(endpoint, outcome, time.perf_counter() - started, state)
+                    loop.call_soon_threadsafe(events.put_nowait, None)
+
+        async def body():
+            future = loop.run_in_executor(self.executor, run)
+            try:
+                while True:
+                    item = await events.get()
+                    if item is None:
+                        break
+                    event, data = item
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                await future
+            finally:
+                # Client gone or response finished: the worker stops at its next callback or piece of text
+                cancelled.set()
+
+        return StreamingResponse(body(), media_type='text/event-stream',
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    async def healthz(self, request: Request):
+        corpus = get_corpus()
+        return JSONResponse({
+            'status': 'ok',
+            'backend': self.backend,
+            'corpus': corpus.content_hash,
+            'agreements': sorted(key for key in corpus.hashes or {} if key in corpus),
+            'sessions': len(self.sessions),
+            'in_flight': self.metrics.in_flight,
+            'uptime_seconds': round(time.time() - self.metrics.started, 1),
+        })
+
+    async def metrics_text(self, request: Request):
+        return PlainTextResponse(self.metrics.text(len(self.sessions)),
+                                 media_type='text/plain; version=0.0.4')
+
+def start_service(client, backend: str = 'anthropic', host: str = '127.0.0.1', port: int = SERVICE_PORT,
+                  workers: int = SERVICE_WORKERS) -> tuple:
+    """Serve in a background thread (port 0 picks a free one). Returns (base URL, stop callable)."""
+    service = AnalysisService(client, backend, workers)
+    server = uvicorn.Server(uvicorn.Config(service.app, host=host, port=port, log_level='warning',
+                                           timeout_graceful_shutdown=1))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"the analysis service could not start on {host}:{port}")
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return f"http://{host}:{port}", stop
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the agreement Q&A and bargaining analysis over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    parser.add_argument('--workers', type=int, default=SERVICE_WORKERS, help="requests analysed at once")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='anthropic')
+    parser.add_argument('--base-url', help="API base URL (anthropic backend)")
+    parser.add_argument('--stub-delay', type=float, default=0.0, help="seconds before the stub answers")
+    parser.add_argument('--stub-token-delay', type=float, default=0.0, help="seconds between the stub's words")
+    args = parser.parse_args()
+
+    # Each request's model route and latency (routing.py) goes to the console with the access log
+    configure_logging()
+    client, shutdown = BACKENDS[args.backend](args)
+    get_corpus()
+    service = AnalysisService(client, args.backend, args.workers)
+    print(f"Analysis service on http://{args.host}:{args.port} ({args.backend} backend)")
+    try:
+        uvicorn.run(service.app, host=args.host, port=args.port, log_level='info')
+    finally:
+        if shutdown is not None:
+            shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+from budget import RequestBudget
+from llm import session_id
+
+# ── Analysis service client ────────────────────────────────────────────────────
+#
+# With ANALYSIS_SERVICE_URL set, the pages send each question to the analysis
+# service (service.py) instead of answering it in their own process, and stay a
+# thin client: the service holds the corpus, indexes, model client and request
+# queue once for every page process. Its answer streams back as server-sent
+# events, with the notices the in-process pipeline reports through callbacks
+# and, last, the session's figures (request size, usage, timing) for the page
+# to show. The session's running totals go with every request, so a restarted
+# service carries on from what the page shows.
+
+ANALYSIS_SERVICE_URL = os.environ.get('ANALYSIS_SERVICE_URL', '').rstrip('/')
+# Longest silence from the service before giving up (a request waiting its turn still gets queue notices)
+SERVICE_TIMEOUT = float(os.environ.get('ANALYSIS_SERVICE_TIMEOUT', 300))
+
+# Session fields the service continues from (running totals) and sends back (these and the last request's)
+SESSION_TOTALS = ('total_queries', 'usage_totals', 'request_timings', 'turn_stats')
+LAST_REQUEST_FIELDS = ('last_budget', 'last_context_summary', 'last_usage', 'last_timing', 'last_fan_out',
+                       'last_route', 'last_lookup', 'last_error')
+
+def session_fields(session_state, fields: tuple = SESSION_TOTALS + LAST_REQUEST_FIELDS) -> dict:
+    """A session's figures as JSON-ready values"""
+    values = {field: session_state[field] for field in fields if field in session_state}
+    if 'last_budget' in values:
+        values['last_budget'] = values['last_budget'].to_dict()
+    return values
+
+def apply_session_fields(session_state, values: dict):
+    """Take the figures a service response reported as the session's own"""
+    for field in LAST_REQUEST_FIELDS:
+        session_state.pop(field, None)
+    for field, value in values.items():
+        session_state[field] = RequestBudget.from_dict(value) if field == 'last_budget' else value
+
+def service_events(path: str, payload: dict, base_url: str = None, timeout: float = SERVICE_TIMEOUT):
+    """(event, data) pairs of one streamed service response"""
+    request = urllib.request.Request(
+        (base_url or ANALYSIS_SERVICE_URL) + path, data=json.dumps(payload).encode('utf-8'),
+        headers={'Content-Type': 'application/json', 'Accept': 'text/event-stream'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        event, data = None, []
+        for raw in response:
+            line = raw.decode('utf-8').rstrip('\r\n')
+            if line.startswith('event:'):
+                event = line[len('event:'):].strip()
+            elif line.startswith('data:'):
+                data.append(line[len('data:'):].strip())
+            elif not line and event is not None:
+                yield event, json.loads("\n".join(data))
+                event, data = None, []
+
+def stream_from_service(session_state, path: str, payload: dict, on_budget=None, on_progress=None,
+                        on_wait=None):
+    """The answer's text from the service, with the same callbacks and session fields as the in-process
+    pipeline it runs"""
+    payload = dict(payload, session=session_id(session_state), state=session_fields(session_state, SESSION_TOTALS))
+    try:
+        for event, data in service_events(path, payload):
+            if event == 'text':
+                yield data['text']
+            elif event == 'budget' and on_budget is not None:
+                on_budget(RequestBudget.from_dict(data))
+            elif event == 'fan_out' and on_progress is not None:
+                on_progress(data['done'], data['total'])
+            elif event == 'queue' and on_wait is not None:
+                on_wait(data['position'], data['seconds'])
+            elif event == 'done':
+                apply_session_fields(session_state, data['session'])
+            elif event == 'error':
+                yield f"⚠️ **Analysis service error**\n\n`{data['error']}`"
+    except urllib.error.HTTPError as error:
+        try:
+            detail = json.loads(error.read())['error']
+        except (ValueError, KeyError, OSError):
+            detail = error.reason
+        yield f"⚠️ **Analysis service error** (HTTP {error.code})\n\n`{detail}`"
+    except (urllib.error.URLError, OSError) as error:
+        yield (f"⚠️ **Analysis service unavailable**\n\nCould not reach `{ANALYSIS_SERVICE_URL}`.\n\n"
+               f"`{getattr(error, 'reason', error)}`")
@@ -0,0 +1,254 @@
+import argparse
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from collections.abc import Mapping
+
+import corpus
+from clauses import Clause, iter_clauses
+from render import format_agreement_for_context
+
+# ── Snapshot file format ───────────────────────────────────────────────────────
+#
+#   magic (8 bytes) | format version (u32) | header length (u32) | header JSON | data
+#
+# The header records the content hash of agreements/*.json the snapshot was
+# compiled from, plus, for each agreement, its own hash and [offset, length]
+# spans into the data area for its compact JSON, its pre-rendered context
+# text, its clause records (JSON lines) and a u64 array of per-clause offsets
+# into those records.
+#
+# The corpus compiles the snapshot itself when it loads and whenever the files
+# change (corpus.py), copying unchanged agreements from the previous snapshot;
+# `python snapshot.py` does the same ahead of time, e.g. in a deploy step.
+
+SNAPSHOT_PATH = os.path.join(corpus.AGREEMENTS_DIR, 'corpus.snapshot')
+SNAPSHOT_MAGIC = b'CMCSNAP\0'
+SNAPSHOT_VERSION = 2
+_PREAMBLE = struct.Struct('<8sII')
+
+# Modules whose output is baked into the snapshot; editing any of them makes it stale
+BUILDER_MODULES = ('clauses.py', 'render.py', 'snapshot.py')
+
+def builder_hash() -> str:
+    digest = hashlib.sha256()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in BUILDER_MODULES:
+        with open(os.path.join(base, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def build_snapshot(path: str = SNAPSHOT_PATH, hashes: dict = None, previous: 'Snapshot' = None) -> dict:
+    """Compile every agreement under agreements/ into a single memory-mappable snapshot. Given the agreements'
+    hashes and an earlier snapshot, the agreements whose hash it already records are copied from it rather
+    than parsed and rendered again."""
+    if hashes is None:
+        hashes = corpus.agreement_hashes()
+    digest = corpus.combined_hash(hashes)
+
+    blobs = []
+    offset = 0
+
+    def add(data: bytes) -> list:
+        nonlocal offset
+        blobs.append(data)
+        span = [offset, len(data)]
+        offset += len(data)
+        return span
+
+    table = {}
+    parsed = []
+    for key, loader in corpus.AGREEMENT_LOADERS.items():
+        old = previous.header['agreements'].get(key) if previous is not None else None
+        if old is not None and hashes.get(key) is not None and old.get('hash') == hashes.get(key):
+            table[key] = dict(old, **{field: add(previous._bytes(old[field]))
+                                      for field in ('json', 'context', 'clauses', 'clause_offsets')})
+            continue
+        agreement = loader()
+        if not agreement:
+            continue
+        parsed.append(key)
+        lines = [_dumps(record.to_dict()) for record in iter_clauses(key, agreement)]
+        clause_offsets = array.array('Q')
+        position = 0
+        for line in lines:
+            clause_offsets.append(position)
+            position += len(line)
+        table[key] = {
+            'hash': hashes.get(key),
+            'json': add(_dumps(agreement)),
+            'context': add(format_agreement_for_context(agreement, corpus.AGREEMENT_NAMES[key]).encode('utf-8')),
+            'clauses': add(b''.join(lines)),
+            'clause_offsets': add(clause_offsets.tobytes()),
+            'clause_count': len(lines),
+        }
+
+    header = _dumps({
+        'version': SNAPSHOT_VERSION,
+        'content_hash': digest,
+        'builder_hash': builder_hash(),
+        'built_at': time.time(),
+        'agreements': table,
+    })
+    # Per process, so two servers compiling the same snapshot at once do not write into one file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return {'path': path, 'content_hash': digest, 'bytes': os.path.getsize(path), 'parsed': parsed,
+            'agreements': {key: entry['clause_count'] for key, entry in table.items()}}
+
+# ── Memory-mapped reader ───────────────────────────────────────────────────────
+
+class Snapshot:
+    """Read-only view over a compiled snapshot. The app reads clause records and pre-rendered context from
+    it; an agreement's nested JSON is decoded only for the caller that asks, and not kept."""
+
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported snapshot format in {path}")
+        self.header = json.loads(self._mm[_PREAMBLE.size:_PREAMBLE.size + header_length])
+        self._base = _PREAMBLE.size + header_length
+
+    @property
+    def content_hash(self) -> str:
+        return self.header['content_hash']
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def _bytes(self, span: list) -> bytes:
+        start = self._base + span[0]
+        return self._mm[start:start + span[1]]
+
+    def keys(self) -> list:
+        return list(self.header['agreements'])
+
+    def agreement(self, key: str) -> dict:
+        """Decode one agreement's JSON from the mapped pages; a new copy per call, held only by the caller"""
+        return json.loads(self._bytes(self.header['agreements'][key]['json']))
+
+    def agreements(self) -> Mapping:
+        return _LazyAgreements(self)
+
+    def context(self, key: str) -> str:
+        entry = self.header['agreements'].get(key)
+        return self._bytes(entry['context']).decode('utf-8') if entry else None
+
+    def clause_count(self, key: str) -> int:
+        entry = self.header['agreements'].get(key)
+        return entry['clause_count'] if entry else 0
+
+    def _clause_offsets(self, entry: dict) -> array.array:
+        offsets = array.array('Q')
+        offsets.frombytes(self._bytes(entry['clause_offsets']))
+        offsets.append(entry['clauses'][1])
+        return offsets
+
+    def clause(self, key: str, index: int) -> Clause:
+        """Decode a single clause record without touching the rest of the agreement"""
+        entry = self.header['agreements'][key]
+        offsets = self._clause_offsets(entry)
+        start, end = offsets[index], offsets[index + 1]
+        return Clause.from_dict(json.loads(self._bytes([entry['clauses'][0] + start, end - start])))
+
+    def iter_clauses(self, key: str):
+        entry = self.header['agreements'].get(key)
+        if not entry:
+            return
+        offsets = self._clause_offsets(entry)
+        records = self._bytes(entry['clauses'])
+        for start, end in zip(offsets, offsets[1:]):
+            yield Clause.from_dict(json.loads(records[start:end]))
+
+class _LazyAgreements(Mapping):
+    """Mapping facade that decodes an agreement from the snapshot each time it is read"""
+
+    def __init__(self, snap: Snapshot):
+        self._snapshot = snap
+        self._keys = snap.keys()
+
+    def __getitem__(self, key: str) -> dict:
+        if key not in self._keys:
+            raise KeyError(key)
+        return self._snapshot.agreement(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+def _open_compiled(path: str) -> Snapshot:
+    """Open the snapshot if it exists and was compiled by the current code, whatever agreements it holds"""
+    if not os.path.exists(path):
+        return None
+    try:
+        snap = Snapshot(path)
+    except (OSError, ValueError):
+        return None
+    if snap.header.get('builder_hash') != builder_hash():
+        snap.close()
+        return None
+    return snap
+
+def open_snapshot(expected_hash: str, path: str = SNAPSHOT_PATH) -> Snapshot:
+    """Open the snapshot if it exists and was compiled from the current agreement files and code"""
+    snap = _open_compiled(path)
+    if snap is not None and snap.content_hash != expected_hash:
+        snap.close()
+        return None
+    return snap
+
+def compile_snapshot(hashes: dict, path: str = SNAPSHOT_PATH) -> tuple:
+    """(snapshot, agreements parsed) for the agreements with these hashes: the existing snapshot when it is
+    current, else one compiled now, with the unchanged agreements copied from the old one"""
+    digest = corpus.combined_hash(hashes)
+    previous = _open_compiled(path)
+    if previous is not None and previous.content_hash == digest:
+        return previous, []
+    try:
+        info = build_snapshot(path, hashes, previous)
+    finally:
+        if previous is not None:
+            previous.close()
+    return open_snapshot(digest, path), info['parsed']
+
+# ── Build step ─────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile agreements/*.json into a memory-mappable corpus snapshot")
+    parser.add_argument('--output', default=SNAPSHOT_PATH, help="snapshot file to write")
+    parser.add_argument('--check', action='store_true', help="report whether the existing snapshot is current")
+    args = parser.parse_args()
+
+    if args.check:
+        snap = open_snapshot(corpus.content_hash(), args.output)
+        print(f"{args.output}: {'current' if snap else 'missing or stale'}")
+        raise SystemExit(0 if snap else 1)
+
+    started = time.perf_counter()
+    info = build_snapshot(args.output)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {info['path']} ({info['bytes']:,} bytes, hash {info['content_hash'][:12]}) in {elapsed:.2f}s")
+    for key, count in info['agreements'].items():
+        print(f"  {key}: {count} clauses")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import corpus
+
+# ── Local stub server ──────────────────────────────────────────────────────────
+#
+# Stands in for remote endpoints during local testing and benchmarks.
+#
+#   GET /<path>   serves files from --root (default: agreements/) with ETag and
+#                 Last-Modified, answering If-None-Match / If-Modified-Since
+#                 with 304 like raw.githubusercontent.com does.
+#
+#   POST /v1/messages
+#                 a canned Anthropic Messages API reply (JSON, or server-sent
+#                 events when the request asks to stream), so the apps and
+#                 benchmarks run without a network or an API key.
+#
+#   python stub_server.py --port 8700 --delay 5      # slow network
+#   python stub_server.py --port 8700 --fail         # unreachable origin (HTTP 503)
+#   CUPE_COMMON_URL=http://127.0.0.1:8700/cupe_common/cupe_common.json streamlit run app41.py
+#   ANTHROPIC_BASE_URL=http://127.0.0.1:8700 streamlit run bargain.py
+
+STUB_ANSWER = ("**1. CURRENT STATE**\nThis is a stub answer from the local test server [Article 1.1].\n\n"
+               "**2. KEY CONSIDERATIONS**\n- Stub consideration [Article 1.2].\n\n"
+               "**3. OPTIONS & RECOMMENDATION**\nStub recommendation.")
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without TCP_NODELAY a kept-alive
+    # connection stalls ~40ms on delayed ACKs, which real API servers do not do
+    disable_nagle_algorithm = True
+    root = corpus.AGREEMENTS_DIR
+    delay = 0.0
+    fail = False
+    token_delay = 0.0
+    # Shared across handler instances: TCP connections accepted and requests answered
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.stats.count('connections')
+
+    def _send(self, status: int, body: bytes = b'', headers: dict = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            self._send(503, b'stub origin unavailable')
+            return
+        path = os.path.realpath(os.path.join(self.root, self.path.split('?')[0].lstrip('/')))
+        if not path.startswith(os.path.realpath(self.root)) or not os.path.isfile(path):
+            self._send(404, b'not found')
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        mtime = int(os.path.getmtime(path))
+        headers = {'ETag': etag, 'Last-Modified': formatdate(mtime, usegmt=True),
+                   'Content-Type': 'application/json; charset=utf-8'}
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, headers=headers)
+            return
+        since = self.headers.get('If-Modified-Since')
+        if since and 'If-None-Match' not in self.headers:
+            try:
+                if mtime <= parsedate_to_datetime(since).timestamp():
+                    self._send(304, headers=headers)
+                    return
+            except (TypeError, ValueError):
+                pass
+        self._send(200, body, headers)
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        self.stats.count('requests')
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            self._send(503, b'{"type": "error", "error": {"type": "overloaded_error", "message": "stub unavailable"}}',
+                       {'Content-Type': 'application/json'})
+            return
+        if not self.path.split('?')[0].endswith('/v1/messages'):
+            self._send(404, b'not found')
+            return
+        usage = {'input_tokens': sum(len(json.dumps(m)) for m in body.get('messages', [])) // 4,
+                 'output_tokens': len(STUB_ANSWER) // 4,
+                 'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0}
+        message = {'id': f"msg_stub_{next(_message_ids)}", 'type': 'message', 'role': 'assistant',
+                   'model': body.get('model', 'stub'), 'stop_reason': 'end_turn', 'stop_sequence': None}
+        if body.get('stream'):
+            self._stream_message(message, usage)
+            return
+        reply = {**message, 'content': [{'type': 'text', 'text': STUB_ANSWER}], 'usage': usage}
+        self._send(200, json.dumps(reply).encode('utf-8'), {'Content-Type': 'application/json'})
+
+    def _stream_message(self, message: dict, usage: dict):
+        """Server-sent events in the order the Messages API emits them, one word per delta"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def event(name: str, data: dict):
+            chunk = f"event: {name}\ndata: {json.dumps({'type': name, **data})}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(chunk):x}\r\n".encode('ascii') + chunk + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            event('message_start', {'message': {**message, 'content': [], 'stop_reason': None,
+                                                'usage': {**usage, 'output_tokens': 1}}})
+            event('content_block_start', {'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+            for word in STUB_ANSWER.split(' '):
+                if self.token_delay:
+                    time.sleep(self.token_delay)
+                event('content_block_delta', {'index': 0, 'delta': {'type': 'text_delta', 'text': word + ' '}})
+            event('content_block_stop', {'index': 0})
+            event('message_delta', {'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                    'usage': {'output_tokens': usage['output_tokens']}})
+            event('message_stop', {})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (a cancelled stream)
+            self.stats.count('cancelled')
+            self.close_connection = True
+
+_message_ids = itertools.count(1)
+
+class StubStats:
+    """Thread-safe counters for what the stub has served"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.counts = {}
+
+def make_server(port: int = 0, root: str = None, delay: float = 0.0, fail: bool = False,
+                token_delay: float = 0.0) -> ThreadingHTTPServer:
+    """Build (but do not start) a stub server; port 0 picks a free port. Counters are on server.stats."""
+    stats = StubStats()
+    handler = type('ConfiguredStubHandler', (StubHandler,), {
+        'root': root or StubHandler.root, 'delay': delay, 'fail': fail, 'token_delay': token_delay, 'stats': stats,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    server.stats = stats
+    return server
+
+def start_server(**options) -> ThreadingHTTPServer:
+    """Start a stub server on a background thread (for benchmarks); returns the running server"""
+    server = make_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def server_url(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub server for offline testing")
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--root', default=corpus.AGREEMENTS_DIR, help="directory served for GET requests")
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument('--fail', action='store_true', help="answer every request with HTTP 503")
+    parser.add_argument('--token-delay', type=float, default=0.0, help="seconds between streamed words")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.root, args.delay, args.fail, args.token_delay)
+    print(f"Stub server listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+from corpus import get_corpus
+from lookup import find_lookup, lookup_agreements, parse_lookup
+
+QUESTION = "What does Article 10.1 say in the common agreement?"
+
+def test_kind_without_union_reads_the_selections_union():
+    corpus = get_corpus()
+    assert lookup_agreements(corpus, 'bcgeu_local', parse_lookup(QUESTION)) == ['bcgeu_common']
+    assert lookup_agreements(corpus, 'cupe_local', parse_lookup(QUESTION)) == ['cupe_common']
+    lookup = find_lookup(corpus, 'bcgeu_local', QUESTION)
+    assert lookup is not None
+    assert [record['agreement'] for record in lookup.records] == ['bcgeu_common']
+
+def test_named_union_is_read_outside_the_selection():
+    corpus = get_corpus()
+    parsed = parse_lookup("What does Article 10.1 say in the CUPE common agreement?")
+    assert lookup_agreements(corpus, 'bcgeu_local', parsed) == ['cupe_common']
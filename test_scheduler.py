@@ -0,0 +1,28 @@
+import itertools
+
+import llm
+import stub_server
+from scheduler import RequestScheduler
+from tokens import estimate_tokens
+
+def test_stopped_stream_keeps_streamed_output_charged(monkeypatch):
+    # One output token a second refills the bucket, so the few milliseconds the test takes do not blur it
+    scheduler = RequestScheduler(input_tokens_per_minute=1_000_000, output_tokens_per_minute=60)
+    monkeypatch.setattr(llm, 'get_scheduler', lambda: scheduler)
+    server = stub_server.start_server()
+    try:
+        client = llm.new_client("sk-test", stub_server.server_url(server))
+        stream = llm.ResponseStream(client, session="test", model="stub", max_tokens=50,
+                                    messages=[{'role': 'user', 'content': "question"}])
+        chunks = iter(stream)
+        list(itertools.islice(chunks, 10))
+        chunks.close()
+    finally:
+        server.shutdown()
+
+    assert not stream.completed and stream.usage is None
+    assert scheduler.in_flight == 0
+    streamed = estimate_tokens(stream.text)
+    assert streamed > 0
+    level = scheduler.snapshot()['limits']['output_tokens']['available']
+    assert abs(level - (60 - streamed)) <= 2
@@ -0,0 +1,14 @@
+import math
+
+# ── Token estimates ────────────────────────────────────────────────────────────
+#
+# A character-based estimate is accurate to within ~10% for the agreement
+# text and is free to compute, which is what pre-send budgeting needs.
+
+CHARS_PER_TOKEN = 4.0
+
+def estimate_tokens(text: str) -> int:
+    """Approximate Claude token count for a piece of text"""
+    if not text:
+        return 0
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN))
@@ -0,0 +1,379 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+import corpus as corpus_module
+import retrieval
+from clauses import corpus_clauses
+
+try:
+    import numpy as np
+except ImportError:  # semantic search is optional; BM25 keeps working without it
+    np = None
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# ── Semantic clause index ──────────────────────────────────────────────────────
+#
+# Built offline (python vector_index.py build) into agreements/.vector_index/:
+#
+#   clauses.faiss     inner-product FAISS index, one unit vector per clause
+#   vectors.npy       the same vectors, for the numpy fallback when faiss is absent
+#   components.npy    fitted embedder state (projection matrix)
+#   idf.npy           fitted embedder state (feature weights)
+#   index.meta        content hash, embedder settings and clause ids, as JSON
+#
+# Everything is memory-mapped on load. Embeddings are computed locally with no
+# network access; the embedder is pluggable through EMBEDDERS. When the saved
+# index is missing or stale (an agreement was edited or reloaded), the process
+# rebuilds it on a background thread and uses keyword retrieval alone until it
+# is ready; each file is replaced whole, so an index still mapped by a request
+# in flight is never overwritten under it.
+
+VECTOR_INDEX_DIR = os.path.join(corpus_module.AGREEMENTS_DIR, '.vector_index')
+DEFAULT_EMBEDDER = os.environ.get('CLAUSE_EMBEDDER', 'lsa')
+VECTOR_INDEX_AUTOBUILD = os.environ.get('VECTOR_INDEX_AUTOBUILD', 'on').lower() not in ('0', 'off', 'false', 'no')
+
+logger = logging.getLogger(__name__)
+
+# Words the agreements use interchangeably for the same entitlement. Each word is
+# stemmed as retrieval tokenizes text, and the stem also emits its concept as a
+# feature, so a question phrased in everyday terms ("sick leave", "fired") meets
+# clauses written in contract language ("illness", "dismissal") before any
+# co-occurrence is learned. Word forms that stem differently are listed apart.
+CONCEPTS = {
+    'illness':     ('sick', 'sickness', 'ill', 'illness', 'injury', 'injuries', 'injured', 'disability',
+                    'disabilities', 'disabled', 'medical', 'unwell'),
+    'termination': ('fire', 'fired', 'firing', 'dismiss', 'dismissed', 'dismissal', 'terminate', 'terminated',
+                    'termination', 'discharge', 'discharged', 'let'),
+    'layoff':      ('layoff', 'layoffs', 'lay', 'laid', 'redundant', 'redundancy', 'bump', 'bumping', 'displace',
+                    'displaced', 'displacement'),
+    'vacation':    ('vacation', 'vacations', 'holiday', 'holidays', 'annual'),
+    'pay':         ('pay', 'paid', 'wage', 'wages', 'salary', 'salaries', 'rate', 'rates', 'earning', 'earnings',
+                    'compensation', 'payment', 'payments', 'paycheque'),
+    'overtime':    ('overtime', 'extra', 'callout', 'standby'),
+    'parental':    ('parental', 'maternity', 'paternity', 'pregnancy', 'pregnant', 'birth', 'adoption', 'adopt',
+                    'baby', 'newborn'),
+    'bereavement': ('bereavement', 'death', 'funeral', 'died', 'passed'),
+    'harassment':  ('harass', 'harassed', 'harassment', 'bully', 'bullying', 'discriminate', 'discrimination'),
+    'grievance':   ('grievance', 'grievances', 'grieve', 'grieved', 'complaint', 'complaints', 'dispute', 'disputes',
+                    'arbitration', 'arbitrator'),
+    'discipline':  ('discipline', 'disciplined', 'disciplinary', 'suspension', 'suspend', 'suspended', 'warning',
+                    'warnings', 'reprimand'),
+    'benefits':    ('benefit', 'benefits', 'dental', 'health', 'extended', 'insurance', 'pension', 'pensions',
+                    'retirement', 'retire'),
+    'hours':       ('hour', 'hours', 'hourly', 'shift', 'shifts', 'schedule', 'scheduled', 'scheduling', 'rotation',
+                    'workday'),
+    'travel':      ('travel', 'travelling', 'mileage', 'expense', 'expenses', 'kilometre', 'kilometres', 'vehicle'),
+    'posting':     ('posting', 'postings', 'vacancy', 'vacancies', 'promotion', 'transfer', 'appointment',
+                    'competition'),
+}
+
+_concept_of = None
+
+def concept_stems() -> dict:
+    """Concept by the stem of each of its words, built on first use (retrieval imports this module). A word
+    that does not tokenize to one stem, or a stem claimed by two concepts, would never (or wrongly) match a
+    query, so it is an error."""
+    global _concept_of
+    if _concept_of is not None:
+        return _concept_of
+    concept_of = {}
+    for concept, words in CONCEPTS.items():
+        for word in words:
+            stems = retrieval.tokenize(word)
+            if len(stems) != 1:
+                raise ValueError(f"concept word {word!r} ({concept}) tokenizes to {stems}, not one stem")
+            if concept_of.setdefault(stems[0], concept) != concept:
+                raise ValueError(f"concept word {word!r} ({concept}) stems to {stems[0]!r}, "
+                                 f"already a {concept_of[stems[0]]} stem")
+    _concept_of = concept_of
+    return concept_of
+
+# Vectors built with another lexicon are stale
+LEXICON_VERSION = zlib.crc32(json.dumps(CONCEPTS, sort_keys=True).encode('utf-8'))
+
+class HashedNgramEmbedder:
+    """Feature-hashed bag of stemmed words, their concepts and (optionally) character
+    n-grams, with sublinear term frequency and L2 normalisation"""
+
+    name = 'hashed-ngram'
+
+    def __init__(self, dim: int = 4096, ngram_range: tuple = None, concepts: bool = True):
+        self.dim = dim
+        self.ngram_range = tuple(ngram_range) if ngram_range else None
+        self.concepts = concepts
+
+    def config(self) -> dict:
+        return {'dim': self.dim, 'ngram_range': list(self.ngram_range) if self.ngram_range else None,
+                'concepts': self.concepts}
+
+    def _hash(self, feature: str) -> int:
+        return zlib.crc32(feature.encode('utf-8')) % self.dim
+
+    def _features(self, text: str) -> list:
+        features = []
+        concept_of = concept_stems() if self.concepts else {}
+        for word in retrieval.tokenize(text):
+            features.append(self._hash('w:' + word))
+            if word in concept_of:
+                features.append(self._hash('c:' + concept_of[word]))
+            if self.ngram_range:
+                low, high = self.ngram_range
+                padded = f"<{word}>"
+                for n in range(low, high + 1):
+                    for start in range(len(padded) - n + 1):
+                        features.append(self._hash(padded[start:start + n]))
+        return features
+
+    def counts(self, texts: list) -> "np.ndarray":
+        """Sublinear term-frequency matrix, one row per text"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            features = self._features(text)
+            if features:
+                matrix[row] = np.bincount(features, minlength=self.dim)
+        return np.log1p(matrix, out=matrix)
+
+    def fit(self, texts: list):
+        return self
+
+    def embed(self, texts: list) -> "np.ndarray":
+        return _normalize(self.counts(texts))
+
+    def save(self, directory: str):
+        pass
+
+    def load(self, directory: str):
+        return self
+
+class LSAEmbedder:
+    """TF-IDF over hashed n-grams projected onto latent topics (truncated SVD).
+
+    The projection is learned from the agreements themselves, so words that keep
+    company in the corpus land near each other even when a clause never uses the
+    query's wording."""
+
+    name = 'lsa'
+
+    def __init__(self, dim: int = 4096, components: int = 128, ngram_range: tuple = None, concepts: bool = True):
+        self.base = HashedNgramEmbedder(dim, ngram_range, concepts)
+        self.n_components = components
+        self.idf = None
+        self.components = None
+
+    def config(self) -> dict:
+        return {**self.base.config(), 'components': self.n_components}
+
+    def fit(self, texts: list):
+        counts = self.base.counts(texts)
+        doc_freq = np.count_nonzero(counts, axis=0)
+        self.idf = (np.log((1 + len(texts)) / (1 + doc_freq)) + 1).astype(np.float32)
+        weighted = _normalize(counts * self.idf)
+        # Truncated SVD through the clause-by-clause Gram matrix: far cheaper than a
+        # full SVD when there are fewer clauses than hashed features
+        eigenvalues, eigenvectors = np.linalg.eigh(weighted @ weighted.T)
+        top = np.argsort(eigenvalues)[::-1][:self.n_components]
+        singular = np.sqrt(np.maximum(eigenvalues[top], 1e-12))
+        components = (weighted.T @ eigenvectors[:, top]) / singular
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        return self
+
+    def embed(self, texts: list) -> "np.ndarray":
+        weighted = _normalize(self.base.counts(texts) * self.idf)
+        return _normalize(weighted @ self.components)
+
+    def save(self, directory: str):
+        _save_array(directory, 'idf.npy', self.idf)
+        _save_array(directory, 'components.npy', self.components)
+
+    def load(self, directory: str):
+        self.idf = np.load(os.path.join(directory, 'idf.npy'), mmap_mode='r')
+        self.components = np.load(os.path.join(directory, 'components.npy'), mmap_mode='r')
+        return self
+
+EMBEDDERS = {
+    HashedNgramEmbedder.name: HashedNgramEmbedder,
+    LSAEmbedder.name: LSAEmbedder,
+}
+
+def _normalize(matrix: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+def available() -> bool:
+    return np is not None
+
+def _replace_path(directory: str, name: str) -> str:
+    """A temporary path for a file of the index, unique to this process, to os.replace over the file"""
+    return os.path.join(directory, f"{name}.{os.getpid()}.tmp")
+
+def _save_array(directory: str, name: str, array):
+    tmp_path = _replace_path(directory, name)
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+# ── Index ──────────────────────────────────────────────────────────────────────
+
+class VectorIndex:
+    """Clause vectors plus the embedder that produced them"""
+
+    def __init__(self, embedder, clause_ids: list, vectors, faiss_index=None, content_hash: str = None):
+        self.embedder = embedder
+        self.clause_ids = clause_ids
+        self.vectors = vectors
+        self.faiss_index = faiss_index
+        self.content_hash = content_hash
+
+    def search(self, query: str, k: int = 20, allowed=None) -> list:
+        """Top-k (similarity, clause position) pairs; allowed is an optional set of positions"""
+        query_vector = self.embedder.embed([query])
+        # Over-fetch when filtering so a restricted search still returns k results
+        fetch = len(self.clause_ids) if allowed is not None else min(k, len(self.clause_ids))
+        if self.faiss_index is not None:
+            scores, positions = self.faiss_index.search(query_vector, fetch)
+            pairs = zip(scores[0].tolist(), positions[0].tolist())
+        else:
+            similarities = np.asarray(self.vectors) @ query_vector[0]
+            top = np.argsort(-similarities)[:fetch]
+            pairs = zip(similarities[top].tolist(), top.tolist())
+        results = []
+        for score, position in pairs:
+            if position < 0 or (allowed is not None and position not in allowed):
+                continue
+            results.append((score, position))
+            if len(results) == k:
+                break
+        return results
+
+def build_vector_index(records: list, content_hash: str, embedder_name: str = DEFAULT_EMBEDDER,
+                       directory: str = VECTOR_INDEX_DIR) -> VectorIndex:
+    """Embed every clause in one vectorised batch and persist the index"""
+    texts = [retrieval.clause_search_text(record) for record in records]
+    embedder = EMBEDDERS[embedder_name]().fit(texts)
+    vectors = embedder.embed(texts)
+
+    os.makedirs(directory, exist_ok=True)
+    embedder.save(directory)
+    _save_array(directory, 'vectors.npy', vectors)
+    faiss_index = None
+    if faiss is not None:
+        faiss_index = faiss.IndexFlatIP(vectors.shape[1])
+        faiss_index.add(vectors)
+        tmp_path = _replace_path(directory, 'clauses.faiss')
+        faiss.write_index(faiss_index, tmp_path)
+        os.replace(tmp_path, os.path.join(directory, 'clauses.faiss'))
+    meta = {
+        'content_hash': content_hash,
+        'embedder': embedder.name,
+        'config': embedder.config(),
+        'clause_ids': [record['id'] for record in records],
+        'lexicon': LEXICON_VERSION,
+        'built_at': time.time(),
+    }
+    # Written last: until it names the new content hash, the files are not loaded for it
+    tmp_path = _replace_path(directory, 'index.meta')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(directory, 'index.meta'))
+    return VectorIndex(embedder, meta['clause_ids'], vectors, faiss_index, content_hash)
+
+def load_vector_index(content_hash: str, clause_ids: list, directory: str = VECTOR_INDEX_DIR) -> VectorIndex:
+    """Memory-map a persisted index if it matches the current corpus, else return None"""
+    try:
+        with open(os.path.join(directory, 'index.meta'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (meta.get('content_hash') != content_hash or meta.get('clause_ids') != clause_ids
+            or meta.get('lexicon') != LEXICON_VERSION):
+        return None
+    embedder_class = EMBEDDERS.get(meta.get('embedder'))
+    if embedder_class is None:
+        return None
+    config = meta.get('config', {})
+    embedder = embedder_class(**config).load(directory)
+    vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+    faiss_index = None
+    faiss_path = os.path.join(directory, 'clauses.faiss')
+    if faiss is not None and os.path.exists(faiss_path):
+        faiss_index = faiss.read_index(faiss_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return VectorIndex(embedder, meta['clause_ids'], vectors, faiss_index, content_hash)
+
+_vector_indexes = {}
+_vector_lock = threading.Lock()
+
+def get_vector_index(corpus) -> VectorIndex:
+    """The persisted semantic index for a corpus, or None if numpy is unavailable or the index is missing or
+    stale; a missing or stale index is rebuilt in the background (once per content hash)"""
+    if not available():
+        return None
+    if corpus.content_hash in _vector_indexes:
+        return _vector_indexes[corpus.content_hash]
+    with _vector_lock:
+        if corpus.content_hash not in _vector_indexes:
+            records = corpus_clauses(corpus)
+            index = load_vector_index(corpus.content_hash, [record['id'] for record in records])
+            _vector_indexes.clear()
+            _vector_indexes[corpus.content_hash] = index
+            if index is None and VECTOR_INDEX_AUTOBUILD:
+                logger.info("semantic index missing or stale for corpus %s: rebuilding in the background, keyword "
+                            "retrieval only until it is ready", corpus.content_hash[:12])
+                threading.Thread(target=_rebuild, args=(records, corpus.content_hash), name="vector-index-build",
+                                 daemon=True).start()
+    return _vector_indexes[corpus.content_hash]
+
+def _rebuild(records: list, content_hash: str):
+    started = time.perf_counter()
+    try:
+        index = build_vector_index(records, content_hash)
+    except Exception:
+        logger.exception("semantic index rebuild for corpus %s failed", content_hash[:12])
+        return
+    with _vector_lock:
+        # Kept only if the corpus has not changed again meanwhile
+        if content_hash in _vector_indexes:
+            _vector_indexes[content_hash] = index
+    logger.info("semantic index rebuilt for corpus %s: %d clauses in %.1fs", content_hash[:12], len(records),
+                time.perf_counter() - started)
+
+# ── Build step ─────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the semantic clause index over all agreements")
+    parser.add_argument('command', choices=['build', 'query'])
+    parser.add_argument('text', nargs='?', help="query text (query command)")
+    parser.add_argument('--embedder', default=DEFAULT_EMBEDDER, choices=sorted(EMBEDDERS))
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    if not available():
+        raise SystemExit("numpy is required for the semantic index (pip install -r requirements.txt)")
+
+    shared = corpus_module.get_corpus()
+    records = corpus_clauses(shared)
+    if args.command == 'build':
+        started = time.perf_counter()
+        index = build_vector_index(records, shared.content_hash, args.embedder)
+        backend = 'faiss' if index.faiss_index is not None else 'numpy'
+        print(f"Indexed {len(records)} clauses with '{args.embedder}' ({backend}) "
+              f"in {time.perf_counter() - started:.2f}s -> {VECTOR_INDEX_DIR}")
+        return
+
+    index = get_vector_index(shared)
+    if index is None:
+        raise SystemExit("No current vector index; run: python vector_index.py build")
+    for score, position in index.search(args.text or "", args.k):
+        print(f"{score:6.3f}  {records[position]['citation']}")
+
+if __name__ == "__main__":
+    main()
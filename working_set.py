@@ -0,0 +1,127 @@
+import os
+
+from crossref import get_reference_graph, with_cross_references
+from prune import drop_duplicate_clauses
+from render import SELECTION_AGREEMENTS
+from retrieval import (CONTEXT_TOKEN_BUDGET, format_clause, format_retrieved_context, search_clauses,
+                       select_within_budget)
+from tokens import estimate_tokens
+
+# ── Follow-up working set ──────────────────────────────────────────────────────
+#
+# Follow-ups almost always concern the articles the conversation is already
+# about. The clauses behind the last answer are kept per session, with the
+# text exactly as it was sent. A follow-up sends that text again, unchanged,
+# then a block with only the clauses its own question pulls in that were not
+# there yet (and their cross-references). The earlier request's agreement text
+# is a prefix of the new one, so it is read from the prompt cache and only the
+# new block is processed. When the set outgrows its budget, the clauses that
+# have gone longest without being relevant leave it and the text is rendered
+# afresh.
+
+FOLLOWUP_WORKING_SET = os.environ.get('FOLLOWUP_WORKING_SET', 'on').lower() not in ('0', 'off', 'false', 'no')
+# New clauses come from this many of the follow-up's best hits, within this many tokens
+FOLLOWUP_TOP_K = int(os.environ.get('FOLLOWUP_TOP_K', 10))
+FOLLOWUP_TOKEN_BUDGET = int(os.environ.get('FOLLOWUP_TOKEN_BUDGET', 4000))
+# Most tokens the working set holds. Past it, it is trimmed back to the size of a fresh retrieval, which
+# leaves room for several follow-ups' additions before the next trim (each trim re-renders the text, so the
+# request after it is not read from the prompt cache).
+WORKING_SET_TOKEN_BUDGET = int(os.environ.get('WORKING_SET_TOKEN_BUDGET', 24000))
+
+class WorkingSet:
+    """The clauses in play in a conversation: the text blocks they were last sent as, and the turn each
+    clause was last relevant to"""
+
+    def __init__(self):
+        self.content_hash = None
+        self.selection_key = None
+        self.blocks = []
+        self.last_used = {}
+        self.turn = 0
+
+    def matches(self, corpus, selection_key: str) -> bool:
+        return bool(self.blocks) and self.content_hash == corpus.content_hash and self.selection_key == selection_key
+
+    def remember(self, corpus, selection_key: str, blocks: list, records: list, relevant=()):
+        """Make what a turn sent the working set. relevant holds clauses the turn's question found again."""
+        self.turn += 1
+        position = get_reference_graph(corpus).positions
+        if self.content_hash != corpus.content_hash or self.selection_key != selection_key:
+            self.content_hash, self.selection_key, self.last_used = corpus.content_hash, selection_key, {}
+        relevant = {position[record['id']] for record in relevant}
+        self.last_used = {position[record['id']]: self.turn if position[record['id']] in relevant
+                          else self.last_used.get(position[record['id']], self.turn) for record in records}
+        self.blocks = list(blocks)
+
+    def records(self, corpus) -> list:
+        graph = get_reference_graph(corpus)
+        return [graph.records[doc_id] for doc_id in sorted(self.last_used)]
+
+def get_working_set(session_state) -> WorkingSet:
+    if 'working_set' not in session_state:
+        session_state.working_set = WorkingSet()
+    return session_state.working_set
+
+class FollowUpContext:
+    """A follow-up's agreement text as blocks: the working set as sent before, then what this question adds"""
+
+    def __init__(self, blocks: list, records: list, added: list, referenced: list, relevant: list, trimmed: int):
+        self.blocks = blocks
+        self.records = records
+        self.added = added
+        self.referenced = referenced
+        self.relevant = relevant
+        self.trimmed = trimmed
+
+    @property
+    def text(self) -> str:
+        return "".join(self.blocks)
+
+def followup_context(corpus, selection_key: str, working_set: WorkingSet, query: str,
+                     top_k: int = FOLLOWUP_TOP_K, token_budget: int = FOLLOWUP_TOKEN_BUDGET,
+                     working_budget: int = WORKING_SET_TOKEN_BUDGET,
+                     trim_to: int = CONTEXT_TOKEN_BUDGET) -> FollowUpContext:
+    """The working set plus the clauses among the follow-up's top_k hits that it does not hold yet (within
+    token_budget), and the clauses those refer to"""
+    agreement_keys = [key for key in SELECTION_AGREEMENTS[selection_key] if key in corpus]
+    position = get_reference_graph(corpus).positions
+    hits = drop_duplicate_clauses(search_clauses(corpus, query, agreement_keys, top_k), agreement_keys)
+    carried = working_set.records(corpus)
+    relevant = [record for _, record in hits if position[record['id']] in working_set.last_used]
+    added = select_within_budget([(score, record) for score, record in hits
+                                  if position[record['id']] not in working_set.last_used], token_budget)
+    added.sort(key=lambda record: position[record['id']])
+    blocks = list(working_set.blocks)
+    # Over budget, the clauses that have gone longest without being relevant leave, and the rest is re-sent
+    # as one block
+    used = sum(estimate_tokens(format_clause(record)) for record in carried + added)
+    trimmed = 0
+    if used > working_budget:
+        fresh = {record['id'] for record in relevant}
+        dropped = set()
+        for record in sorted(carried, key=lambda record: working_set.last_used[position[record['id']]]):
+            if used <= trim_to:
+                break
+            if record['id'] not in fresh:
+                dropped.add(record['id'])
+                used -= estimate_tokens(format_clause(record))
+        carried = [record for record in carried if record['id'] not in dropped]
+        trimmed = len(dropped)
+        blocks = [format_retrieved_context(carried, agreement_keys)]
+    referenced = []
+    if added:
+        added_text, added_records, referenced = with_cross_references(
+            corpus, selection_key, format_retrieved_context(added, agreement_keys), added, known=carried)
+        blocks.append(added_text)
+        referenced_ids = {record['id'] for record in referenced}
+        added = [record for record in added_records if record['id'] not in referenced_ids]
+    return FollowUpContext(blocks, carried + added + referenced, added, referenced, relevant, trimmed)
+
+def working_set_caption(followup: FollowUpContext) -> str:
+    reused = len(followup.records) - len(followup.added) - len(followup.referenced)
+    caption = f"🧩 Follow-up reused {reused} clauses already in play and added {len(followup.added)} new"
+    if followup.referenced:
+        caption += f" (+{len(followup.referenced)} cross-referenced)"
+    if followup.trimmed:
+        caption += f", {followup.trimmed} no longer relevant dropped"
+    return caption